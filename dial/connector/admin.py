@@ -8,10 +8,15 @@ from .models import (
     WithingsAuthentication,
     SleepSummary,
     SleepRaw,
+    SleepSignal,
     Weight,
     ActivityRaw,
     ActivitySummary,
     Nutrition,
+    RateLimitBucket,
+    SyncCursor,
+    FetchJob,
+    FetchChunk,
 )
 
 
@@ -54,7 +59,12 @@ class NutritionAdmin(ImportExportActionModelAdmin):
 admin.site.register(WithingsAuthentication)
 admin.site.register(SleepSummary)
 admin.site.register(SleepRaw)
+admin.site.register(SleepSignal)
 admin.site.register(Weight)
 admin.site.register(ActivityRaw)
 admin.site.register(ActivitySummary)
 admin.site.register(Nutrition, NutritionAdmin)
+admin.site.register(RateLimitBucket)
+admin.site.register(SyncCursor)
+admin.site.register(FetchJob)
+admin.site.register(FetchChunk)
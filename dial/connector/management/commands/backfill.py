@@ -0,0 +1,112 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from connector.management.commands.rebuild_activity_rollups import parse_date
+from connector.models import APIUser, FetchJob
+from connector.tasks import enqueue_fetch_job
+from connector.utils.backfill import (
+    BACKFILL_CHUNK_DAYS,
+    BACKFILL_START_DATE,
+    backfill_progress,
+)
+from connector.utils.jobs import is_fetch_job_active, plan_fetch_job
+
+DATA_TYPES = ["sleep", "activity", "measurements"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Fetches the whole history of a user in the background, a few chunks at a "
+        "time. Running it again resumes an interrupted backfill."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=int, help="Withings user ID to backfill.")
+        parser.add_argument(
+            "--types",
+            default=",".join(DATA_TYPES),
+            help=f"Comma-separated data types to backfill, out of {DATA_TYPES}.",
+        )
+        parser.add_argument(
+            "--from",
+            dest="start",
+            default=BACKFILL_START_DATE,
+            help=f"First day (YYYY-MM-DD) to fetch. Defaults to {BACKFILL_START_DATE}.",
+        )
+        parser.add_argument(
+            "--to", dest="end", help="Day (YYYY-MM-DD) to fetch up to. Defaults to now."
+        )
+        parser.add_argument(
+            "--use-copy",
+            action="store_true",
+            help="Insert the raw activity data with COPY.",
+        )
+        parser.add_argument(
+            "--status",
+            action="store_true",
+            help="Only show the progress of the unfinished backfills.",
+        )
+
+    def handle(self, *args, **options):
+        if options["status"]:
+            self.show_status(options["user"])
+            return
+        if options["user"] is None:
+            raise CommandError("--user is required unless --status is given.")
+        user = APIUser.objects.filter(user_id=options["user"]).first()
+        if user is None:
+            raise CommandError(f"User {options['user']} does not exist.")
+        data_types = [t.strip() for t in options["types"].split(",") if t.strip()]
+        unknown = set(data_types) - set(DATA_TYPES)
+        if unknown:
+            raise CommandError(f"Unknown data type(s): {', '.join(sorted(unknown))}.")
+        start = parse_date(options["start"], "--from")
+        end = parse_date(options["end"], "--to") if options["end"] else timezone.now()
+        if start >= end:
+            raise CommandError("--from has to be before --to.")
+
+        for data_type in data_types:
+            job = FetchJob.objects.filter(
+                user=user, data_type=data_type, backfill=True, status="running"
+            ).first()
+            if job is None:
+                job = plan_fetch_job(
+                    user,
+                    data_type,
+                    start,
+                    end,
+                    use_copy=options["use_copy"],
+                    chunk_days=BACKFILL_CHUNK_DAYS,
+                    backfill=True,
+                )
+                self.stdout.write(
+                    f"Started backfill {job.pk} of {data_type} in "
+                    f"{job.chunks.count()} chunk(s)."
+                )
+            elif is_fetch_job_active(job):
+                self.stdout.write(
+                    f"Backfill {job.pk} of {data_type} is still running - leaving it."
+                )
+                continue
+            else:
+                self.stdout.write(f"Resuming backfill {job.pk} of {data_type}.")
+                # nothing moved for a while, so its lanes are lost
+                FetchJob.objects.filter(pk=job.pk).update(lanes=0)
+            enqueue_fetch_job(job)
+        self.stdout.write(self.style.SUCCESS("Done - check on it with --status."))
+
+    def show_status(self, user_id: int = None):
+        jobs = FetchJob.objects.filter(backfill=True, status="running")
+        if user_id is not None:
+            jobs = jobs.filter(user__user_id=user_id)
+        for job in jobs.select_related("user").order_by("created_at"):
+            progress = backfill_progress(job)
+            self.stdout.write(
+                f"Backfill {job.pk} of {job.data_type} for {job.user}: "
+                f"{progress['done']}/{progress['chunks']} chunk(s) done, "
+                f"{progress['failed']} failed, {progress['rows']} row(s) "
+                f"({progress['rows_per_second']:.1f} rows/s), "
+                f"ETA {progress['eta'] or '-'}."
+            )
+        if not jobs.exists():
+            self.stdout.write("No backfill is running.")
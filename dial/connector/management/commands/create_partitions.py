@@ -0,0 +1,40 @@
+from datetime import datetime
+
+import pytz
+from django.core.management.base import BaseCommand, CommandError
+
+from connector.utils.partitions import PARTITION_MONTHS_AHEAD, create_partitions
+
+
+class Command(BaseCommand):
+    help = "Creates monthly partitions of the partitioned time-series tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--months-ahead",
+            type=int,
+            default=PARTITION_MONTHS_AHEAD,
+            help="Number of future months to create partitions for.",
+        )
+        parser.add_argument(
+            "--from",
+            dest="start",
+            help="First month (YYYY-MM) to create partitions for. Defaults to the current month.",
+        )
+
+    def handle(self, *args, **options):
+        start = None
+        if options["start"]:
+            try:
+                start = datetime.strptime(options["start"], "%Y-%m").replace(
+                    tzinfo=pytz.utc
+                )
+            except ValueError:
+                raise CommandError("--from has to be in the YYYY-MM format.")
+
+        created = create_partitions(months_ahead=options["months_ahead"], start=start)
+        for name in created:
+            self.stdout.write(f"Created partition {name}.")
+        self.stdout.write(
+            self.style.SUCCESS(f"Done - {len(created)} partition(s) created.")
+        )
@@ -0,0 +1,57 @@
+from datetime import datetime
+
+import pytz
+from django.core.management.base import BaseCommand, CommandError
+
+from connector.models import APIUser
+from connector.utils.rollups import rebuild_activity_rollups
+
+
+def parse_date(value: str, option: str) -> datetime:
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=pytz.utc)
+    except ValueError:
+        raise CommandError(f"{option} has to be in the YYYY-MM-DD format.")
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the hourly and daily activity rollups from the raw activity data."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user",
+            type=int,
+            help="Withings user ID to rebuild the rollups of. Defaults to all users.",
+        )
+        parser.add_argument(
+            "--from",
+            dest="start",
+            help="First day (YYYY-MM-DD) to rebuild. Defaults to the oldest data.",
+        )
+        parser.add_argument(
+            "--to",
+            dest="end",
+            help="Last day (YYYY-MM-DD) to rebuild. Defaults to the newest data.",
+        )
+
+    def handle(self, *args, **options):
+        start = end = None
+        if options["start"]:
+            start = parse_date(options["start"], "--from")
+        if options["end"]:
+            end = parse_date(options["end"], "--to").replace(
+                hour=23, minute=59, second=59, microsecond=999999
+            )
+
+        users = APIUser.objects.all()
+        if options["user"] is not None:
+            users = users.filter(user_id=options["user"])
+            if not users.exists():
+                raise CommandError(f"User {options['user']} does not exist.")
+
+        total = 0
+        for user in users:
+            rebuilt = rebuild_activity_rollups(user, start=start, end=end)
+            self.stdout.write(f"Rebuilt {rebuilt} rollup(s) of {user}.")
+            total += rebuilt
+        self.stdout.write(self.style.SUCCESS(f"Done - {total} rollup(s) rebuilt."))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from connector.models import APIUser
+from connector.utils.trends import update_weight_trends
+
+
+class Command(BaseCommand):
+    help = "Recomputes the weight trends from all the stored weight measurements."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user",
+            type=int,
+            help="Withings user ID to recompute the trends of. Defaults to all users.",
+        )
+
+    def handle(self, *args, **options):
+        users = APIUser.objects.all()
+        if options["user"] is not None:
+            users = users.filter(user_id=options["user"])
+            if not users.exists():
+                raise CommandError(f"User {options['user']} does not exist.")
+
+        total = 0
+        for user in users:
+            updated = update_weight_trends(user)
+            self.stdout.write(f"Updated {updated} weight trend(s) of {user}.")
+            total += updated
+        self.stdout.write(self.style.SUCCESS(f"Done - {total} trend(s) updated."))
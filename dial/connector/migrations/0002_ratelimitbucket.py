@@ -0,0 +1,30 @@
+# Generated by Django 3.1.12 on 2026-10-18 06:40
+
+from django.db import migrations, models
+import django.utils.timezone
+import shortuuidfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('connector', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RateLimitBucket',
+            fields=[
+                ('id', shortuuidfield.fields.ShortUUIDField(blank=True, editable=False, max_length=22, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=64, unique=True)),
+                ('tokens', models.FloatField()),
+                ('capacity', models.FloatField()),
+                ('refill_rate', models.FloatField()),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('requests', models.IntegerField(default=0)),
+                ('delayed_requests', models.IntegerField(default=0)),
+                ('total_wait', models.FloatField(default=0.0)),
+                ('max_wait', models.FloatField(default=0.0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 3.1.12 on 2026-10-18 06:51
+
+from django.db import migrations, models
+
+# keeps the most recently reported row of every natural key
+DELETE_DUPLICATES_SQL = """
+DELETE FROM {table} AS t
+USING (
+    SELECT id, row_number() OVER (
+        PARTITION BY {keys} ORDER BY reported_at DESC, id DESC
+    ) AS position
+    FROM {table}
+) AS ranked
+WHERE t.id = ranked.id AND ranked.position > 1;
+"""
+
+
+def delete_duplicates(table, keys):
+    return migrations.RunSQL(
+        DELETE_DUPLICATES_SQL.format(table=table, keys=", ".join(keys)),
+        reverse_sql=migrations.RunSQL.noop,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('connector', '0002_ratelimitbucket'),
+    ]
+
+    operations = [
+        delete_duplicates('connector_activityraw', ('user_id', 'measured_at', 'measurement_type')),
+        delete_duplicates('connector_activitysummary', ('user_id', 'measured_at', 'measurement_type')),
+        delete_duplicates('connector_sleepraw', ('user_id', 'device_id', 'start_date')),
+        delete_duplicates('connector_sleepsummary', ('user_id', 'device_id', 'start_date')),
+        delete_duplicates('connector_weight', ('user_id', 'measured_at')),
+        migrations.AddConstraint(
+            model_name='activityraw',
+            constraint=models.UniqueConstraint(fields=('user', 'measured_at', 'measurement_type'), name='activityraw_natural_key'),
+        ),
+        migrations.AddConstraint(
+            model_name='activitysummary',
+            constraint=models.UniqueConstraint(fields=('user', 'measured_at', 'measurement_type'), name='activitysummary_natural_key'),
+        ),
+        migrations.AddConstraint(
+            model_name='sleepraw',
+            constraint=models.UniqueConstraint(fields=('user', 'device_id', 'start_date'), name='sleepraw_natural_key'),
+        ),
+        migrations.AddConstraint(
+            model_name='sleepsummary',
+            constraint=models.UniqueConstraint(fields=('user', 'device_id', 'start_date'), name='sleepsummary_natural_key'),
+        ),
+        migrations.AddConstraint(
+            model_name='weight',
+            constraint=models.UniqueConstraint(fields=('user', 'measured_at'), name='weight_natural_key'),
+        ),
+    ]
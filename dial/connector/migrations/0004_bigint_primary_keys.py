@@ -0,0 +1,51 @@
+# Generated by Django 3.1.12 on 2026-10-18 06:53
+
+from django.db import migrations, models
+
+# Nothing references the time-series tables, so the random varchar keys are
+# simply replaced with new sequential ones. Django cannot cast the existing
+# values to bigint, hence the raw SQL.
+BIGINT_PK_SQL = """
+ALTER TABLE {table} DROP COLUMN id;
+ALTER TABLE {table} ADD COLUMN id bigserial PRIMARY KEY;
+"""
+SHORTUUID_PK_SQL = """
+ALTER TABLE {table} DROP COLUMN id;
+ALTER TABLE {table} ADD COLUMN id varchar(22);
+UPDATE {table} SET id = substr(md5(random()::text || ctid::text), 1, 22);
+ALTER TABLE {table} ADD PRIMARY KEY (id);
+"""
+TABLES = (
+    'activityraw',
+    'activitysummary',
+    'sleepraw',
+    'sleepsummary',
+    'weight',
+)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('connector', '0003_natural_keys'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    BIGINT_PK_SQL.format(table=f'connector_{model_name}'),
+                    reverse_sql=SHORTUUID_PK_SQL.format(table=f'connector_{model_name}'),
+                )
+                for model_name in TABLES
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name=model_name,
+                    name='id',
+                    field=models.BigAutoField(primary_key=True, serialize=False),
+                )
+                for model_name in TABLES
+            ],
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 3.1.12 on 2026-10-18 06:54
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('connector', '0004_bigint_primary_keys'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='activityraw',
+            index=django.contrib.postgres.indexes.BrinIndex(fields=['measured_at'], name='activityraw_measured_brin'),
+        ),
+        migrations.AddIndex(
+            model_name='activitysummary',
+            index=models.Index(fields=['measured_at'], name='activitysummary_measured_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='nutrition',
+            index=models.Index(fields=['start_date'], name='nutrition_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sleepraw',
+            index=models.Index(fields=['user', 'start_date'], name='sleepraw_user_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sleepraw',
+            index=django.contrib.postgres.indexes.BrinIndex(fields=['start_date'], name='sleepraw_start_brin'),
+        ),
+        migrations.AddIndex(
+            model_name='sleepsummary',
+            index=models.Index(fields=['user', 'start_date'], name='sleepsummary_user_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sleepsummary',
+            index=models.Index(fields=['end_date'], name='sleepsummary_end_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='weight',
+            index=models.Index(fields=['measured_at'], name='weight_measured_idx'),
+        ),
+    ]
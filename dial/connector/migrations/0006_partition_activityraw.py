@@ -0,0 +1,108 @@
+from datetime import datetime
+
+import pytz
+from django.db import migrations
+
+TABLE = 'connector_activityraw'
+PARTITION_KEY = 'measured_at'
+MONTHS_AHEAD = 3
+
+
+def add_months(month, months):
+    year, month_index = divmod(month.month - 1 + months, 12)
+    return month.replace(year=month.year + year, month=month_index + 1)
+
+
+def table_definitions(cursor, table):
+    # everything that has to be recreated on the rebuilt table, except its PK
+    cursor.execute(
+        """
+        SELECT conname, pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE conrelid = %s::regclass AND contype <> 'p'
+        """,
+        [table],
+    )
+    constraints = cursor.fetchall()
+    cursor.execute(
+        """
+        SELECT indexname, indexdef
+        FROM pg_indexes
+        WHERE tablename = %s AND indexname NOT IN (
+            SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass
+        )
+        """,
+        [table, table],
+    )
+    indexes = cursor.fetchall()
+    cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+    sequence = cursor.fetchone()[0]
+    return constraints, indexes, sequence
+
+
+def rebuild_table(cursor, partition_by, create_partitions, primary_key):
+    # Copies the table into a new one with the same columns, then swaps them and
+    # recreates the constraints and indexes (after the data is loaded).
+    constraints, indexes, sequence = table_definitions(cursor, TABLE)
+    new_table = f'{TABLE}_new'
+    cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY NONE')
+    cursor.execute(
+        f'CREATE TABLE {new_table} (LIKE {TABLE} INCLUDING DEFAULTS) {partition_by}'
+    )
+    create_partitions(cursor, new_table)
+    cursor.execute(f'INSERT INTO {new_table} SELECT * FROM {TABLE}')
+    cursor.execute(f'DROP TABLE {TABLE} CASCADE')
+    cursor.execute(f'ALTER TABLE {new_table} RENAME TO {TABLE}')
+    cursor.execute(f'ALTER TABLE {TABLE} ADD PRIMARY KEY ({primary_key})')
+    for name, definition in constraints:
+        cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {name} {definition}')
+    for _, definition in indexes:
+        cursor.execute(definition.replace(' ON ONLY ', ' ON '))
+    cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY {TABLE}.id')
+
+
+def create_monthly_partitions(cursor, table):
+    cursor.execute(f'SELECT min({PARTITION_KEY}) FROM {TABLE}')
+    oldest = cursor.fetchone()[0] or datetime.now(pytz.utc)
+    now = datetime.now(pytz.utc)
+    month = datetime(oldest.year, oldest.month, 1, tzinfo=pytz.utc)
+    last_month = add_months(datetime(now.year, now.month, 1, tzinfo=pytz.utc), MONTHS_AHEAD)
+    while month <= last_month:
+        cursor.execute(
+            f'CREATE TABLE {TABLE}_y{month.year}m{month.month:02d} PARTITION OF {table} '
+            f'FOR VALUES FROM (%s) TO (%s)',
+            [month, add_months(month, 1)],
+        )
+        month = add_months(month, 1)
+    cursor.execute(f'CREATE TABLE {TABLE}_default PARTITION OF {table} DEFAULT')
+
+
+def partition(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        rebuild_table(
+            cursor,
+            partition_by=f'PARTITION BY RANGE ({PARTITION_KEY})',
+            create_partitions=create_monthly_partitions,
+            primary_key=f'id, {PARTITION_KEY}',
+        )
+
+
+def unpartition(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        rebuild_table(
+            cursor,
+            partition_by='',
+            create_partitions=lambda cursor, table: None,
+            primary_key='id',
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('connector', '0005_time_series_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition, unpartition),
+    ]
@@ -0,0 +1,34 @@
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+SIGNALS = ('hr', 'rr', 'snoring')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('connector', '0006_partition_activityraw'),
+    ]
+
+    operations = [
+        operation
+        for signal in SIGNALS
+        for operation in (
+            migrations.AddField(
+                model_name='sleepraw',
+                name=f'{signal}_timestamps',
+                field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None),
+            ),
+            migrations.AddField(
+                model_name='sleepraw',
+                name=f'{signal}_values',
+                field=django.contrib.postgres.fields.ArrayField(base_field=models.SmallIntegerField(), default=list, size=None),
+            ),
+            # a default lets the old column be added back when migrating backwards
+            migrations.AlterField(
+                model_name='sleepraw',
+                name=f'{signal}_series',
+                field=django.contrib.postgres.fields.ArrayField(base_field=models.JSONField(), default=list, size=None),
+            ),
+        )
+    ]
@@ -0,0 +1,47 @@
+from django.db import migrations
+
+SIGNALS = ('hr', 'rr', 'snoring')
+
+# {"timestamp": "2020-12-10T21:10:00+0000", "value": 55} -> epoch seconds, value
+TO_ARRAYS_SQL = """
+UPDATE connector_sleepraw SET
+    {signal}_timestamps = ARRAY(
+        SELECT extract(epoch FROM (point->>'timestamp')::timestamptz)::integer
+        FROM unnest({signal}_series) WITH ORDINALITY AS series(point, position)
+        ORDER BY position
+    ),
+    {signal}_values = ARRAY(
+        SELECT round((point->>'value')::numeric)::smallint
+        FROM unnest({signal}_series) WITH ORDINALITY AS series(point, position)
+        ORDER BY position
+    );
+"""
+TO_JSON_SQL = """
+UPDATE connector_sleepraw SET
+    {signal}_series = ARRAY(
+        SELECT jsonb_build_object(
+            'timestamp',
+            to_char(to_timestamp(ts) AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"+0000"'),
+            'value',
+            value
+        )
+        FROM unnest({signal}_timestamps, {signal}_values) AS series(ts, value)
+    );
+"""
+
+
+class Migration(migrations.Migration):
+    # kept apart from the schema changes - PostgreSQL does not allow altering
+    # a table after updating it in the same transaction
+
+    dependencies = [
+        ('connector', '0007_sleepraw_native_series'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            TO_ARRAYS_SQL.format(signal=signal),
+            reverse_sql=TO_JSON_SQL.format(signal=signal),
+        )
+        for signal in SIGNALS
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('connector', '0008_sleepraw_native_series_data'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='sleepraw',
+            name='hr_series',
+        ),
+        migrations.RemoveField(
+            model_name='sleepraw',
+            name='rr_series',
+        ),
+        migrations.RemoveField(
+            model_name='sleepraw',
+            name='snoring_series',
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 3.1.12 on 2026-10-18 07:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# the points already stored in SleepRaw; a point of the same signal can be
+# reported twice (e.g. by overlapping sleep segments) - it is only stored once
+BACKFILL_SQL = """
+INSERT INTO connector_sleepsignal (user_id, ts, signal, value)
+SELECT r.user_id, to_timestamp(s.ts), '{signal}', s.value
+FROM connector_sleepraw r
+CROSS JOIN LATERAL unnest(r.{signal}_timestamps, r.{signal}_values) AS s(ts, value)
+WHERE s.value IS NOT NULL
+ON CONFLICT (user_id, signal, ts) DO NOTHING;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('connector', '0009_remove_sleepraw_json_series'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SleepSignal',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('ts', models.DateTimeField()),
+                ('signal', models.CharField(choices=[('hr', 'Heart rate'), ('rr', 'Respiration rate'), ('snoring', 'Snoring')], max_length=16)),
+                ('value', models.SmallIntegerField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='connector.apiuser')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='sleepsignal',
+            index=models.Index(fields=['signal', 'ts'], name='sleepsignal_signal_ts_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='sleepsignal',
+            constraint=models.UniqueConstraint(fields=('user', 'signal', 'ts'), name='sleepsignal_natural_key'),
+        ),
+    ] + [
+        migrations.RunSQL(BACKFILL_SQL.format(signal=signal), migrations.RunSQL.noop)
+        for signal in ('hr', 'rr', 'snoring')
+    ]
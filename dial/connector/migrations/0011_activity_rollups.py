@@ -0,0 +1,64 @@
+# Generated by Django 3.1.12 on 2026-10-18 07:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('connector', '0010_sleepsignal'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityHourly',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('metric', models.CharField(max_length=32)),
+                ('bucket', models.DateTimeField()),
+                ('sum', models.FloatField()),
+                ('min', models.FloatField()),
+                ('max', models.FloatField()),
+                ('avg', models.FloatField()),
+                ('count', models.IntegerField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='connector.apiuser')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ActivityDaily',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('metric', models.CharField(max_length=32)),
+                ('bucket', models.DateTimeField()),
+                ('sum', models.FloatField()),
+                ('min', models.FloatField()),
+                ('max', models.FloatField()),
+                ('avg', models.FloatField()),
+                ('count', models.IntegerField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='connector.apiuser')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddIndex(
+            model_name='activityhourly',
+            index=models.Index(fields=['metric', 'bucket'], name='activityhourly_metric_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='activityhourly',
+            constraint=models.UniqueConstraint(fields=('user', 'metric', 'bucket'), name='activityhourly_natural_key'),
+        ),
+        migrations.AddIndex(
+            model_name='activitydaily',
+            index=models.Index(fields=['metric', 'bucket'], name='activitydaily_metric_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='activitydaily',
+            constraint=models.UniqueConstraint(fields=('user', 'metric', 'bucket'), name='activitydaily_natural_key'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.1.12 on 2026-10-18 07:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('connector', '0011_activity_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WeightTrend',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('metric', models.CharField(max_length=32)),
+                ('measured_at', models.DateTimeField()),
+                ('value', models.FloatField()),
+                ('avg_7', models.FloatField()),
+                ('avg_14', models.FloatField()),
+                ('ewma', models.FloatField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='connector.apiuser')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='weighttrend',
+            index=models.Index(fields=['metric', 'measured_at'], name='weighttrend_metric_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='weighttrend',
+            constraint=models.UniqueConstraint(fields=('user', 'metric', 'measured_at'), name='weighttrend_natural_key'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.1.12 on 2026-10-18 07:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('connector', '0012_weighttrend'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityColdDay',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('day', models.DateField()),
+                ('measurement_type', models.CharField(max_length=32)),
+                ('device_type', models.CharField(max_length=128)),
+                ('device_id', models.IntegerField()),
+                ('points', models.IntegerField()),
+                ('timestamps', models.BinaryField()),
+                ('values', models.BinaryField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='connector.apiuser')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='activitycoldday',
+            constraint=models.UniqueConstraint(fields=('user', 'day', 'measurement_type', 'device_id', 'device_type'), name='activitycoldday_natural_key'),
+        ),
+    ]
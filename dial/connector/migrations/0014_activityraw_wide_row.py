@@ -0,0 +1,45 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('connector', '0013_activitycoldday'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activityraw',
+            name='spo2_auto',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='activityraw',
+            name='stroke',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='activityraw',
+            name='pool_lap',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.RemoveConstraint(
+            model_name='activityraw',
+            name='activityraw_natural_key',
+        ),
+        migrations.RemoveConstraint(
+            model_name='activitycoldday',
+            name='activitycoldday_natural_key',
+        ),
+        # defaults let the columns be added back when migrating backwards
+        migrations.AlterField(
+            model_name='activityraw',
+            name='measurement_type',
+            field=models.CharField(default='steps', max_length=32),
+        ),
+        migrations.AlterField(
+            model_name='activitycoldday',
+            name='measurement_type',
+            field=models.CharField(default='heart_rate', max_length=32),
+        ),
+    ]
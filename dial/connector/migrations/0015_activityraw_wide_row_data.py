@@ -0,0 +1,163 @@
+import zlib
+
+import numpy as np
+from django.db import migrations
+from django.db.models import Count
+
+# The cold storage encoding as it is at this migration (see
+# connector.utils.cold_storage), frozen so that later changes to it do not
+# change what this migration does.
+COLD_COLUMNS = (
+    'steps',
+    'duration',
+    'distance',
+    'elevation',
+    'calories',
+    'heart_rate',
+    'spo2_auto',
+    'stroke',
+    'pool_lap',
+)
+INTEGER_COLUMNS = {'steps', 'duration', 'elevation', 'heart_rate', 'stroke', 'pool_lap'}
+
+
+def encode_timestamps(timestamps: list) -> bytes:
+    deltas = np.diff(np.array(timestamps, dtype=np.int64), prepend=0)
+    return zlib.compress(deltas.tobytes(), 9)
+
+
+def decode_timestamps(data: bytes) -> list:
+    return np.cumsum(np.frombuffer(zlib.decompress(data), dtype=np.int64)).tolist()
+
+
+def encode_values(rows: list) -> bytes:
+    chunks = []
+    for column in COLD_COLUMNS:
+        values = [row.get(column) for row in rows]
+        present = [value for value in values if value is not None]
+        mask = np.array([value is not None for value in values], dtype=bool)
+        chunks.append(np.packbits(mask).tobytes())
+        if column in INTEGER_COLUMNS:
+            chunks.append(
+                np.diff(np.array(present, dtype=np.int64), prepend=0).tobytes()
+            )
+        else:
+            chunks.append(np.array(present, dtype=np.float64).tobytes())
+    return zlib.compress(b''.join(chunks), 9)
+
+
+def decode_values(data: bytes, points: int) -> list:
+    data = zlib.decompress(data)
+    rows = [{} for _ in range(points)]
+    offset = 0
+    for column in COLD_COLUMNS:
+        if offset >= len(data):
+            for row in rows:
+                row[column] = None
+            continue
+        mask_size = (points + 7) // 8
+        mask = np.unpackbits(np.frombuffer(data, np.uint8, mask_size, offset))[:points]
+        offset += mask_size
+        count = int(mask.sum())
+        if column in INTEGER_COLUMNS:
+            present = np.cumsum(np.frombuffer(data, np.int64, count, offset)).tolist()
+        else:
+            present = np.frombuffer(data, np.float64, count, offset).tolist()
+        offset += count * 8
+        present = iter(present)
+        for row, is_present in zip(rows, mask):
+            row[column] = next(present) if is_present else None
+    return rows
+
+
+# The steps and the heart rate row of the same minute become one row. The
+# steps row has the duration of the whole minute, so it wins.
+MERGE_SQL = """
+WITH merged AS (
+    SELECT
+        user_id,
+        measured_at,
+        min(id) AS id,
+        coalesce(
+            max(duration) FILTER (WHERE measurement_type = 'steps'), max(duration)
+        ) AS duration,
+        max(steps) AS steps,
+        max(distance) AS distance,
+        max(elevation) AS elevation,
+        max(calories) AS calories,
+        max(heart_rate) AS heart_rate
+    FROM connector_activityraw
+    GROUP BY user_id, measured_at
+    HAVING count(*) > 1
+), updated AS (
+    UPDATE connector_activityraw r SET
+        duration = m.duration,
+        steps = m.steps,
+        distance = m.distance,
+        elevation = m.elevation,
+        calories = m.calories,
+        heart_rate = m.heart_rate
+    FROM merged m
+    WHERE r.id = m.id AND r.measured_at = m.measured_at
+)
+DELETE FROM connector_activityraw r
+USING merged m
+WHERE r.user_id = m.user_id AND r.measured_at = m.measured_at AND r.id <> m.id;
+"""
+SPLIT_SQL = """
+UPDATE connector_activityraw SET measurement_type = 'heart_rate'
+WHERE heart_rate IS NOT NULL AND steps IS NULL;
+INSERT INTO connector_activityraw (reported_at, device_type, device_id, user_id,
+    measured_at, duration, heart_rate, measurement_type)
+SELECT reported_at, device_type, device_id, user_id, measured_at, duration,
+    heart_rate, 'heart_rate'
+FROM connector_activityraw
+WHERE heart_rate IS NOT NULL AND steps IS NOT NULL;
+UPDATE connector_activityraw SET heart_rate = NULL
+WHERE heart_rate IS NOT NULL AND steps IS NOT NULL AND measurement_type = 'steps';
+"""
+
+
+def merge_cold_days(apps, schema_editor):
+    # only happens if more than the heart rate went to the cold storage
+    ActivityColdDay = apps.get_model('connector', 'ActivityColdDay')
+    key_fields = ('user', 'day', 'device_type', 'device_id')
+    duplicates = (
+        ActivityColdDay.objects.values(*key_fields)
+        .annotate(cold_days=Count('id'))
+        .filter(cold_days__gt=1)
+    )
+    for key in duplicates:
+        cold_days = list(
+            ActivityColdDay.objects.filter(**{field: key[field] for field in key_fields})
+        )
+        points = {}
+        for cold_day in cold_days:
+            timestamps = decode_timestamps(bytes(cold_day.timestamps))
+            rows = decode_values(bytes(cold_day.values), cold_day.points)
+            for timestamp, row in zip(timestamps, rows):
+                point = points.setdefault(timestamp, dict.fromkeys(COLD_COLUMNS))
+                for column, value in row.items():
+                    if value is not None:
+                        point[column] = value
+        merged, *others = cold_days
+        timestamps = sorted(points)
+        merged.points = len(timestamps)
+        merged.timestamps = encode_timestamps(timestamps)
+        merged.values = encode_values([points[timestamp] for timestamp in timestamps])
+        merged.save()
+        ActivityColdDay.objects.filter(id__in=[other.id for other in others]).delete()
+
+
+class Migration(migrations.Migration):
+    # kept apart from the schema changes - PostgreSQL does not allow altering
+    # a table after updating it in the same transaction
+
+    dependencies = [
+        ('connector', '0014_activityraw_wide_row'),
+    ]
+
+    operations = [
+        migrations.RunSQL(MERGE_SQL, SPLIT_SQL),
+        migrations.RunPython(merge_cold_days, migrations.RunPython.noop),
+    ]
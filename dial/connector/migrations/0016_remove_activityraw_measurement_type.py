@@ -0,0 +1,27 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('connector', '0015_activityraw_wide_row_data'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='activityraw',
+            name='measurement_type',
+        ),
+        migrations.RemoveField(
+            model_name='activitycoldday',
+            name='measurement_type',
+        ),
+        migrations.AddConstraint(
+            model_name='activityraw',
+            constraint=models.UniqueConstraint(fields=('user', 'measured_at'), name='activityraw_natural_key'),
+        ),
+        migrations.AddConstraint(
+            model_name='activitycoldday',
+            constraint=models.UniqueConstraint(fields=('user', 'day', 'device_id', 'device_type'), name='activitycoldday_natural_key'),
+        ),
+    ]
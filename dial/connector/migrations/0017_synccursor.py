@@ -0,0 +1,29 @@
+# Generated by Django 3.1.12 on 2026-10-18 07:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('connector', '0016_remove_activityraw_measurement_type'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncCursor',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('data_type', models.CharField(max_length=32)),
+                ('endpoint', models.CharField(max_length=32)),
+                ('synced_until', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='connector.apiuser')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='synccursor',
+            constraint=models.UniqueConstraint(fields=('user', 'data_type', 'endpoint'), name='synccursor_natural_key'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 3.1.12 on 2026-10-18 07:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('connector', '0018_pendingnotification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FetchJob',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('data_type', models.CharField(choices=[('sleep', 'Sleep'), ('activity', 'Activity')], max_length=16)),
+                ('start_date', models.DateTimeField()),
+                ('end_date', models.DateTimeField()),
+                ('use_copy', models.BooleanField(default=False)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='running', max_length=16)),
+                ('raw_count', models.IntegerField(default=0)),
+                ('summary_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('finished_at', models.DateTimeField(null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='connector.apiuser')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FetchChunk',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('raw', 'Raw'), ('summary', 'Summary')], max_length=16)),
+                ('start_date', models.DateTimeField()),
+                ('end_date', models.DateTimeField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=16)),
+                ('rows', models.IntegerField(default=0)),
+                ('attempts', models.IntegerField(default=0)),
+                ('started_at', models.DateTimeField(null=True)),
+                ('finished_at', models.DateTimeField(null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='connector.fetchjob')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='fetchchunk',
+            index=models.Index(fields=['status'], name='fetchchunk_status_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='fetchchunk',
+            constraint=models.UniqueConstraint(fields=('job', 'kind', 'start_date'), name='fetchchunk_natural_key'),
+        ),
+    ]
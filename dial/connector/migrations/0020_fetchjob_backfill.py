@@ -0,0 +1,23 @@
+# Generated by Django 3.1.12 on 2026-10-18 07:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('connector', '0019_fetchjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fetchjob',
+            name='backfill',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='fetchjob',
+            name='data_type',
+            field=models.CharField(choices=[('sleep', 'Sleep'), ('activity', 'Activity'), ('measurements', 'Measurements')], max_length=16),
+        ),
+    ]
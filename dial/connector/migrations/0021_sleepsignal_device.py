@@ -0,0 +1,48 @@
+# Generated by Django 3.1.12 on 2026-10-18 08:02
+
+from django.db import migrations, models
+
+# the points of different devices were merged into one row per timestamp, so
+# they are derived from SleepRaw again, this time per device
+BACKFILL_SQL = """
+INSERT INTO connector_sleepsignal (user_id, device_type, device_id, ts, signal, value)
+SELECT r.user_id, r.device_type, r.device_id, to_timestamp(s.ts), '{signal}', s.value
+FROM connector_sleepraw r
+CROSS JOIN LATERAL unnest(r.{signal}_timestamps, r.{signal}_values) AS s(ts, value)
+WHERE s.value IS NOT NULL
+ON CONFLICT (user_id, device_id, signal, ts) DO NOTHING;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('connector', '0020_fetchjob_backfill'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='sleepsignal',
+            name='sleepsignal_natural_key',
+        ),
+        migrations.RunSQL('DELETE FROM connector_sleepsignal;', migrations.RunSQL.noop),
+        migrations.AddField(
+            model_name='sleepsignal',
+            name='device_id',
+            field=models.IntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='sleepsignal',
+            name='device_type',
+            field=models.CharField(default='', max_length=128),
+            preserve_default=False,
+        ),
+        migrations.AddConstraint(
+            model_name='sleepsignal',
+            constraint=models.UniqueConstraint(fields=('user', 'device_id', 'signal', 'ts'), name='sleepsignal_natural_key'),
+        ),
+    ] + [
+        migrations.RunSQL(BACKFILL_SQL.format(signal=signal), migrations.RunSQL.noop)
+        for signal in ('hr', 'rr', 'snoring')
+    ]
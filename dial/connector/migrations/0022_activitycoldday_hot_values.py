@@ -0,0 +1,112 @@
+import zlib
+from datetime import datetime
+
+import numpy as np
+import pytz
+from django.db import migrations
+
+# The cold storage encoding the existing cold days were written with (see
+# connector.utils.cold_storage), frozen so that later changes to it do not
+# change what this migration does.
+COLD_COLUMNS = (
+    'steps',
+    'duration',
+    'distance',
+    'elevation',
+    'calories',
+    'heart_rate',
+    'spo2_auto',
+    'stroke',
+    'pool_lap',
+)
+INTEGER_COLUMNS = {'steps', 'duration', 'elevation', 'heart_rate', 'stroke', 'pool_lap'}
+
+
+def decode_timestamps(data: bytes) -> list:
+    return np.cumsum(np.frombuffer(zlib.decompress(data), dtype=np.int64)).tolist()
+
+
+def encode_values(rows: list) -> bytes:
+    chunks = []
+    for column in COLD_COLUMNS:
+        values = [row.get(column) for row in rows]
+        present = [value for value in values if value is not None]
+        mask = np.array([value is not None for value in values], dtype=bool)
+        chunks.append(np.packbits(mask).tobytes())
+        if column in INTEGER_COLUMNS:
+            chunks.append(
+                np.diff(np.array(present, dtype=np.int64), prepend=0).tobytes()
+            )
+        else:
+            chunks.append(np.array(present, dtype=np.float64).tobytes())
+    return zlib.compress(b''.join(chunks), 9)
+
+
+def decode_values(data: bytes, points: int) -> list:
+    data = zlib.decompress(data)
+    rows = [{} for _ in range(points)]
+    offset = 0
+    for column in COLD_COLUMNS:
+        if offset >= len(data):
+            for row in rows:
+                row[column] = None
+            continue
+        mask_size = (points + 7) // 8
+        mask = np.unpackbits(np.frombuffer(data, np.uint8, mask_size, offset))[:points]
+        offset += mask_size
+        count = int(mask.sum())
+        if column in INTEGER_COLUMNS:
+            present = np.cumsum(np.frombuffer(data, np.int64, count, offset)).tolist()
+        else:
+            present = np.frombuffer(data, np.float64, count, offset).tolist()
+        offset += count * 8
+        present = iter(present)
+        for row, is_present in zip(rows, mask):
+            row[column] = next(present) if is_present else None
+    return rows
+
+
+# the columns that stay in the cold storage - the default of
+# ACTIVITY_COLD_METRICS, plus the duration of every point
+STORED_COLUMNS = ('duration', 'heart_rate')
+
+
+def restore_hot_values(apps, schema_editor):
+    # The cold storage used to take the whole raw rows. Their other values go
+    # back to the raw rows, so that the rollups can be recomputed from them.
+    ActivityColdDay = apps.get_model('connector', 'ActivityColdDay')
+    ActivityRaw = apps.get_model('connector', 'ActivityRaw')
+    hot_columns = [column for column in COLD_COLUMNS if column not in STORED_COLUMNS]
+    for cold_day in ActivityColdDay.objects.iterator():
+        timestamps = decode_timestamps(bytes(cold_day.timestamps))
+        rows = decode_values(bytes(cold_day.values), cold_day.points)
+        ActivityRaw.objects.bulk_create(
+            [
+                ActivityRaw(
+                    device_type=cold_day.device_type,
+                    device_id=cold_day.device_id,
+                    user_id=cold_day.user_id,
+                    measured_at=datetime.fromtimestamp(timestamp, pytz.utc),
+                    duration=row['duration'],
+                    **{column: row[column] for column in hot_columns},
+                )
+                for timestamp, row in zip(timestamps, rows)
+                if any(row[column] is not None for column in hot_columns)
+            ],
+            ignore_conflicts=True,
+        )
+        cold_day.values = encode_values(
+            [{column: row[column] for column in STORED_COLUMNS} for row in rows]
+        )
+        cold_day.save(update_fields=['values'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('connector', '0021_sleepsignal_device'),
+    ]
+
+    operations = [
+        migrations.RunPython(restore_hot_values, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.12 on 2026-10-18 08:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('connector', '0022_activitycoldday_hot_values'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fetchjob',
+            name='notification_appli',
+            field=models.IntegerField(null=True),
+        ),
+    ]
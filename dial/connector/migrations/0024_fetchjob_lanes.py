@@ -0,0 +1,18 @@
+# Generated by Django 3.1.12 on 2026-10-18 08:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('connector', '0023_fetchjob_notification_appli'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fetchjob',
+            name='lanes',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.12 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('connector', '0024_fetchjob_lanes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fetchjob',
+            name='lanes_seen_at',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
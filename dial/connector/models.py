@@ -1,11 +1,13 @@
 from datetime import datetime
 
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import BrinIndex
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
 from django.db.models import (
     CharField,
     IntegerField,
+    SmallIntegerField,
     BooleanField,
     DateTimeField,
     FloatField, EmailField,
@@ -23,6 +25,23 @@ MEAL_TYPES = [
     ("Other", "Other"),
 ]
 MEAL_DATA_SOURCES = [("MyFitnessPal", "MyFitnessPal")]
+SLEEP_SIGNALS = [
+    ("hr", "Heart rate"),
+    ("rr", "Respiration rate"),
+    ("snoring", "Snoring"),
+]
+FETCH_DATA_TYPES = [
+    ("sleep", "Sleep"),
+    ("activity", "Activity"),
+    ("measurements", "Measurements"),
+]
+FETCH_KINDS = [("raw", "Raw"), ("summary", "Summary")]
+FETCH_STATUSES = [
+    ("pending", "Pending"),
+    ("running", "Running"),
+    ("done", "Done"),
+    ("failed", "Failed"),
+]
 
 
 class APIUser(models.Model):
@@ -54,7 +73,7 @@ class WithingsAuthentication(models.Model):
 
 
 class SleepSummary(models.Model):
-    id = ShortUUIDField(primary_key=True)
+    id = models.BigAutoField(primary_key=True)
     reported_at = DateTimeField(default=timezone.now, blank=True)
     start_date = DateTimeField()
     end_date = DateTimeField()
@@ -79,9 +98,23 @@ class SleepSummary(models.Model):
     wakeup_count = IntegerField()
     wakeup_duration = IntegerField()
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "device_id", "start_date"],
+                name="sleepsummary_natural_key",
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=["user", "start_date"], name="sleepsummary_user_start_idx"
+            ),
+            models.Index(fields=["end_date"], name="sleepsummary_end_idx"),
+        ]
+
 
 class SleepRaw(models.Model):
-    id = ShortUUIDField(primary_key=True)
+    id = models.BigAutoField(primary_key=True)
     reported_at = DateTimeField(default=timezone.now, blank=True)
     device_type = CharField(max_length=128)
     device_id = IntegerField()
@@ -90,13 +123,54 @@ class SleepRaw(models.Model):
     end_date = DateTimeField()
     sleep_phase = CharField(max_length=32)
     sleep_phase_id = IntegerField()
-    hr_series = ArrayField(models.JSONField())
-    rr_series = ArrayField(models.JSONField())
-    snoring_series = ArrayField(models.JSONField())
+    # parallel arrays: epoch seconds and the value measured at that time
+    hr_timestamps = ArrayField(IntegerField(), default=list)
+    hr_values = ArrayField(SmallIntegerField(), default=list)
+    rr_timestamps = ArrayField(IntegerField(), default=list)
+    rr_values = ArrayField(SmallIntegerField(), default=list)
+    snoring_timestamps = ArrayField(IntegerField(), default=list)
+    snoring_values = ArrayField(SmallIntegerField(), default=list)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "device_id", "start_date"],
+                name="sleepraw_natural_key",
+            )
+        ]
+        indexes = [
+            models.Index(fields=["user", "start_date"], name="sleepraw_user_start_idx"),
+            BrinIndex(fields=["start_date"], name="sleepraw_start_brin"),
+        ]
+
+
+class SleepSignal(models.Model):
+    # one row per point of the SleepRaw series, for per-signal time range queries
+    id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey(APIUser, on_delete=models.CASCADE)
+    # the device of the SleepRaw row - a tracker and a Sleep Analyzer can report
+    # points with the same timestamp
+    device_type = CharField(max_length=128)
+    device_id = IntegerField()
+    ts = DateTimeField()
+    signal = CharField(choices=SLEEP_SIGNALS, max_length=16)
+    value = SmallIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "device_id", "signal", "ts"],
+                name="sleepsignal_natural_key",
+            )
+        ]
+        indexes = [
+            # the dashboard is not filtered by user
+            models.Index(fields=["signal", "ts"], name="sleepsignal_signal_ts_idx"),
+        ]
 
 
 class Weight(models.Model):
-    id = ShortUUIDField(primary_key=True)
+    id = models.BigAutoField(primary_key=True)
     reported_at = DateTimeField(default=timezone.now, blank=True)
     device_id = CharField(max_length=128)
     user = models.ForeignKey(APIUser, on_delete=models.CASCADE)
@@ -112,9 +186,46 @@ class Weight(models.Model):
     pulse_wave_velocity = FloatField(null=True)
     heart_rate = IntegerField(null=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "measured_at"],
+                name="weight_natural_key",
+            )
+        ]
+        indexes = [
+            models.Index(fields=["measured_at"], name="weight_measured_idx"),
+        ]
+
+
+class WeightTrend(models.Model):
+    # moving averages of one Weight metric, computed when the samples come in
+    id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey(APIUser, on_delete=models.CASCADE)
+    metric = CharField(max_length=32)
+    measured_at = DateTimeField()
+    value = FloatField()
+    avg_7 = FloatField()
+    avg_14 = FloatField()
+    ewma = FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "metric", "measured_at"],
+                name="weighttrend_natural_key",
+            )
+        ]
+        indexes = [
+            # the dashboard is not filtered by user
+            models.Index(
+                fields=["metric", "measured_at"], name="weighttrend_metric_idx"
+            ),
+        ]
+
 
 class ActivityRaw(models.Model):
-    id = ShortUUIDField(primary_key=True)
+    id = models.BigAutoField(primary_key=True)
     reported_at = DateTimeField(default=timezone.now, blank=True)
     device_type = CharField(max_length=128)
     device_id = IntegerField()
@@ -126,11 +237,23 @@ class ActivityRaw(models.Model):
     elevation = IntegerField(null=True)
     calories = FloatField(null=True)
     heart_rate = IntegerField(null=True)
-    measurement_type = CharField(max_length=32)
+    spo2_auto = FloatField(null=True)
+    stroke = IntegerField(null=True)
+    pool_lap = IntegerField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "measured_at"], name="activityraw_natural_key"
+            )
+        ]
+        indexes = [
+            BrinIndex(fields=["measured_at"], name="activityraw_measured_brin"),
+        ]
 
 
 class ActivitySummary(models.Model):
-    id = ShortUUIDField(primary_key=True)
+    id = models.BigAutoField(primary_key=True)
     reported_at = DateTimeField(default=timezone.now, blank=True)
     device_type = CharField(max_length=128)
     device_id = IntegerField()
@@ -155,6 +278,71 @@ class ActivitySummary(models.Model):
     hr_zone_max_duration = IntegerField(null=True)
     measurement_type = CharField(max_length=32)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "measured_at", "measurement_type"],
+                name="activitysummary_natural_key",
+            )
+        ]
+        indexes = [
+            models.Index(fields=["measured_at"], name="activitysummary_measured_idx"),
+        ]
+
+
+class ActivityRollup(models.Model):
+    # aggregates of the non-null ActivityRaw values of one metric in a bucket
+    id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey(APIUser, on_delete=models.CASCADE)
+    metric = CharField(max_length=32)
+    bucket = DateTimeField()
+    sum = FloatField()
+    min = FloatField()
+    max = FloatField()
+    avg = FloatField()
+    count = IntegerField()
+
+    class Meta:
+        abstract = True
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "metric", "bucket"], name="%(class)s_natural_key"
+            )
+        ]
+        indexes = [
+            # the dashboard is not filtered by user
+            models.Index(fields=["metric", "bucket"], name="%(class)s_metric_idx"),
+        ]
+
+
+class ActivityHourly(ActivityRollup):
+    pass
+
+
+class ActivityDaily(ActivityRollup):
+    pass
+
+
+class ActivityColdDay(models.Model):
+    # the cold metrics of the ActivityRaw rows of one day and device,
+    # compressed (see connector.utils.cold_storage for the encoding)
+    id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey(APIUser, on_delete=models.CASCADE)
+    day = models.DateField()
+    device_type = CharField(max_length=128)
+    device_id = IntegerField()
+    points = IntegerField()
+    timestamps = models.BinaryField()
+    values = models.BinaryField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "day", "device_id", "device_type"],
+                name="activitycoldday_natural_key",
+            )
+        ]
+
 
 class Nutrition(models.Model):
     id = ShortUUIDField(primary_key=True)
@@ -176,3 +364,111 @@ class Nutrition(models.Model):
     sugar = FloatField()
     fiber = FloatField()
     protein = FloatField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["start_date"], name="nutrition_start_idx"),
+        ]
+
+
+class RateLimitBucket(models.Model):
+    id = ShortUUIDField(primary_key=True)
+    name = CharField(max_length=64, unique=True)
+    tokens = FloatField()
+    capacity = FloatField()
+    refill_rate = FloatField()
+    updated_at = DateTimeField(default=timezone.now)
+    requests = IntegerField(default=0)
+    delayed_requests = IntegerField(default=0)
+    total_wait = FloatField(default=0.0)
+    max_wait = FloatField(default=0.0)
+
+
+class SyncCursor(models.Model):
+    # how far the data of one user has been fetched from one endpoint without
+    # gaps - the notification-triggered fetches resume from there
+    id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey(APIUser, on_delete=models.CASCADE)
+    data_type = CharField(max_length=32)
+    endpoint = CharField(max_length=32)
+    synced_until = DateTimeField()
+    updated_at = DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "data_type", "endpoint"],
+                name="synccursor_natural_key",
+            )
+        ]
+
+
+class PendingNotification(models.Model):
+    # the notifications of one Withings user and appli that came in within the
+    # debounce interval - a single task fetches the union of their windows
+    id = models.BigAutoField(primary_key=True)
+    user_id = IntegerField()
+    appli = IntegerField()
+    # no window: the task resumes from the sync cursors
+    start_date = DateTimeField(null=True)
+    end_date = DateTimeField(null=True)
+    notifications = IntegerField(default=1)
+    due_at = DateTimeField()
+    created_at = DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user_id", "appli"], name="pendingnotification_natural_key"
+            )
+        ]
+
+
+class FetchJob(models.Model):
+    # one fetch of a user's data, split into chunks that run as separate tasks
+    id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey(APIUser, on_delete=models.CASCADE)
+    data_type = CharField(choices=FETCH_DATA_TYPES, max_length=16)
+    start_date = DateTimeField()
+    end_date = DateTimeField()
+    use_copy = BooleanField(default=False)
+    # backfills run a few chunks at a time (see connector.utils.backfill)
+    backfill = BooleanField(default=False)
+    # backfill lanes that are queued, waiting for a countdown or fetching
+    lanes = IntegerField(default=0)
+    # when a lane of the job last ran - a lane waiting for a countdown does
+    # not touch the chunks, but is still going
+    lanes_seen_at = DateTimeField(null=True)
+    # the appli of the notification the job was planned for - its window is
+    # put back if the job fails (see connector.utils.notifications)
+    notification_appli = IntegerField(null=True)
+    status = CharField(choices=FETCH_STATUSES, max_length=16, default="running")
+    # filled in once all the chunks are finished
+    raw_count = IntegerField(default=0)
+    summary_count = IntegerField(default=0)
+    created_at = DateTimeField(default=timezone.now)
+    finished_at = DateTimeField(null=True)
+
+
+class FetchChunk(models.Model):
+    id = models.BigAutoField(primary_key=True)
+    job = models.ForeignKey(FetchJob, on_delete=models.CASCADE, related_name="chunks")
+    kind = CharField(choices=FETCH_KINDS, max_length=16)
+    start_date = DateTimeField()
+    end_date = DateTimeField()
+    status = CharField(choices=FETCH_STATUSES, max_length=16, default="pending")
+    rows = IntegerField(default=0)
+    attempts = IntegerField(default=0)
+    started_at = DateTimeField(null=True)
+    finished_at = DateTimeField(null=True)
+    error = models.TextField(blank=True, default="")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["job", "kind", "start_date"], name="fetchchunk_natural_key"
+            )
+        ]
+        indexes = [
+            models.Index(fields=["status"], name="fetchchunk_status_idx"),
+        ]
@@ -1,14 +1,33 @@
 import datetime
 import os
 
-from celery import Celery
+from celery import Celery, group
 from celery.utils.log import get_task_logger
 
-from .utils.activity import request_all_activities_data
+from .models import APIUser, FetchJob
 from .utils.authentication import get_valid_token
+from .utils.backfill import (
+    BACKFILL_RETRY_SECONDS,
+    end_backfill_lane,
+    log_backfill_progress,
+    next_backfill_chunk_id,
+    quota_wait_seconds,
+    start_backfill_lanes,
+    touch_backfill_lanes,
+)
+from .utils.client import get_pool_stats
+from .utils.cold_storage import compact_activities
 from .utils.common import DATETIME_FORMAT_COMMON
+from .utils.jobs import plan_fetch_job, run_fetch_chunk, stalled_fetch_jobs
 from .utils.measurements import request_all_measurements_data
-from .utils.sleep import request_all_sleep_data, DATETIME_FORMAT
+from .utils.notifications import (
+    claim_notification_window,
+    overdue_notifications,
+    release_notification_window,
+)
+from .utils.partitions import create_partitions
+from .utils.rate_limit import get_rate_limit_stats
+from .utils.retention import enforce_retention
 
 CELERY_BROKER = os.environ.get("CELERY_BROKER")
 LOGGER = get_task_logger(__name__)
@@ -18,39 +37,39 @@ app = Celery("tasks", broker=CELERY_BROKER)
 @app.task(name="auto_appli_44", queue="sleep_tasks")
 def celery_appli_44_sleep(json_body):
     user_id = json_body["userid"]
-    start_date = datetime.datetime.fromtimestamp(int(json_body["startdate"]))
-    end_date = datetime.datetime.fromtimestamp(int(json_body["enddate"]))
+    window = claim_notification_window(user_id, json_body["appli"])
+    if window is None:
+        LOGGER.info("The notification was handled by an earlier task.")
+        return
+    start_date, end_date = window
 
-    # fetch a valid token
-    LOGGER.info("Fetching valid token for user: %s", user_id)
-    access_token_data = get_valid_token(user_id)
-
-    # make data request
-    LOGGER.info(
-        "Fetching sleep entries for dates: %s to %s...",
-        start_date.strftime(DATETIME_FORMAT),
-        end_date.strftime(DATETIME_FORMAT),
-    )
-    raw_counter, summary_counter = request_all_sleep_data(
-        access_token=access_token_data["access_token"],
-        user_id=user_id,
-        start_date=None,
-        end_date=None,
-        from_notification=True,
-    )
     LOGGER.info(
-        "Fetched and updated %s raw sleep entries and %s summary sleep entries",
-        raw_counter,
-        summary_counter,
+        "Fetching sleep entries for dates: %s to %s...", start_date, end_date,
     )
+    try:
+        job = plan_fetch_job(
+            APIUser.objects.get(user_id=user_id),
+            "sleep",
+            start_date,
+            end_date,
+            from_notification=start_date is None,
+            notification_appli=int(json_body["appli"]),
+        )
+        enqueue_fetch_job(job)
+    except Exception:
+        release_notification_window(user_id, json_body["appli"], start_date, end_date)
+        raise
     return
 
 
 @app.task(name="auto_appli_1", queue="default")
 def celery_appli_1_measurements(json_body):
     user_id = json_body["userid"]
-    start_date = datetime.datetime.fromtimestamp(int(json_body["startdate"]))
-    end_date = datetime.datetime.fromtimestamp(int(json_body["enddate"]))
+    window = claim_notification_window(user_id, json_body["appli"])
+    if window is None:
+        LOGGER.info("The notification was handled by an earlier task.")
+        return
+    start_date, end_date = window
 
     # fetch a valid token
     LOGGER.info("Fetching valid token for user: %s", user_id)
@@ -59,52 +78,59 @@ def celery_appli_1_measurements(json_body):
     # make data request
     LOGGER.info(
         "Fetching measurements of type 'weight' for dates %s to %s...",
-        start_date.strftime(DATETIME_FORMAT),
-        end_date.strftime(DATETIME_FORMAT),
-    )
-    measurements_counter = request_all_measurements_data(
-        access_token_data["access_token"],
-        user_id=user_id,
-        start_date=None,
-        end_date=None,
-        meas_type="weight",
-        offset=None,
-        from_notification=True,
+        start_date,
+        end_date,
     )
+    try:
+        measurements_counter = request_all_measurements_data(
+            access_token_data["access_token"],
+            user_id=user_id,
+            start_date=start_date,
+            end_date=end_date,
+            meas_type="weight",
+            offset=None,
+            from_notification=start_date is None,
+        )
+    except Exception:
+        release_notification_window(user_id, json_body["appli"], start_date, end_date)
+        raise
     LOGGER.info(
         "Fetched and updated %s weight measurement entries.", measurements_counter,
     )
+    LOGGER.debug("Withings connection pool stats: %s", get_pool_stats())
+    LOGGER.debug("Withings rate limit stats: %s", get_rate_limit_stats())
     return
 
 
 @app.task(name="auto_appli_16", queue="default")
 def celery_appli_16_activities(json_body):
     user_id = json_body["userid"]
-    date = json_body["date"]
-
-    # fetch a valid token
-    LOGGER.info("Fetching valid token for user: %s", user_id)
-    access_token_data = get_valid_token(user_id)
+    window = claim_notification_window(user_id, json_body["appli"])
+    if window is None:
+        LOGGER.info("The notification was handled by an earlier task.")
+        return
+    start_date, end_date = window
 
-    # make data request
-    LOGGER.info("Fetching activities with a date %s...", date)
-    raw_counter, summary_counter = request_all_activities_data(
-        access_token_data["access_token"],
-        user_id=user_id,
-        start_date=None,
-        end_date=None,
-        from_notification=True,
-    )
-    LOGGER.info(
-        "Fetched and updated %s raw activity entries and %s summary activity entries",
-        raw_counter,
-        summary_counter,
-    )
+    LOGGER.info("Fetching activities for dates %s to %s...", start_date, end_date)
+    try:
+        job = plan_fetch_job(
+            APIUser.objects.get(user_id=user_id),
+            "activity",
+            start_date,
+            end_date,
+            from_notification=start_date is None,
+            notification_appli=int(json_body["appli"]),
+        )
+        enqueue_fetch_job(job)
+    except Exception:
+        release_notification_window(user_id, json_body["appli"], start_date, end_date)
+        raise
     return
 
 
 @app.task(name="man_sleep", queue="default")
 def celery_request_all_sleep_data(access_token_data, user_id, start_date, end_date):
+    # access_token_data is not used any more - every chunk gets a valid token
     LOGGER.debug("Celery task received: sleep.")
     LOGGER.info(
         "Fetching sleep entries for dates: %s to %s...", start_date, end_date,
@@ -113,15 +139,11 @@ def celery_request_all_sleep_data(access_token_data, user_id, start_date, end_da
     start_date = datetime.datetime.strptime(start_date, DATETIME_FORMAT_COMMON)
     end_date = datetime.datetime.strptime(end_date, DATETIME_FORMAT_COMMON)
 
-    raw_counter, summary_counter = request_all_sleep_data(
-        access_token=access_token_data["access_token"],
-        user_id=user_id,
-        start_date=start_date,
-        end_date=end_date,
-    )
-    LOGGER.debug(
-        f"Celery task finished: sleep. Fetched {raw_counter} raw and {summary_counter} summary entries."
+    job = plan_fetch_job(
+        APIUser.objects.get(user_id=user_id), "sleep", start_date, end_date
     )
+    enqueue_fetch_job(job)
+    LOGGER.debug("Celery task finished: sleep. Enqueued fetch job %s.", job.pk)
     return
 
 
@@ -151,11 +173,16 @@ def celery_request_all_measurement_data(
         f"Celery task finished: measurements. Fetched and updated {measurements_count} "
         f"entries for the following measurement type: {measurement_type}."
     )
+    LOGGER.debug("Withings connection pool stats: %s", get_pool_stats())
+    LOGGER.debug("Withings rate limit stats: %s", get_rate_limit_stats())
     return
 
 
 @app.task(name="man_activity", queue="default")
-def celery_request_all_activity_data(access_token_data, user_id, start_date, end_date):
+def celery_request_all_activity_data(
+    access_token_data, user_id, start_date, end_date, use_copy=False
+):
+    # access_token_data is not used any more - every chunk gets a valid token
     LOGGER.debug("Celery task received: activity.")
     LOGGER.info(
         "Fetching activity entries for dates: %s to %s...", start_date, end_date,
@@ -164,13 +191,150 @@ def celery_request_all_activity_data(access_token_data, user_id, start_date, end
     start_date = datetime.datetime.strptime(start_date, DATETIME_FORMAT_COMMON)
     end_date = datetime.datetime.strptime(end_date, DATETIME_FORMAT_COMMON)
 
-    raw_counter, summary_counter = request_all_activities_data(
-        access_token=access_token_data["access_token"],
-        user_id=user_id,
-        start_date=start_date,
-        end_date=end_date,
+    job = plan_fetch_job(
+        APIUser.objects.get(user_id=user_id),
+        "activity",
+        start_date,
+        end_date,
+        use_copy=use_copy,
     )
-    LOGGER.debug(
-        f"Celery task finished: sleep. Fetched {raw_counter} raw and {summary_counter} summary entries."
+    enqueue_fetch_job(job)
+    LOGGER.debug("Celery task finished: activity. Enqueued fetch job %s.", job.pk)
+    return
+
+
+@app.task(name="fetch_chunk", queue="default")
+def celery_fetch_chunk(chunk_id):
+    LOGGER.debug("Celery task received: fetch chunk %s.", chunk_id)
+    chunk = run_fetch_chunk(chunk_id)
+    LOGGER.info(
+        "Celery task finished: fetch chunk %s (%s, %s to %s) is %s with %s entries.",
+        chunk_id,
+        chunk.kind,
+        chunk.start_date,
+        chunk.end_date,
+        chunk.status,
+        chunk.rows,
+    )
+    LOGGER.debug("Withings connection pool stats: %s", get_pool_stats())
+    LOGGER.debug("Withings rate limit stats: %s", get_rate_limit_stats())
+    return
+
+
+@app.task(name="backfill_step", queue="default")
+def celery_backfill_step(job_id):
+    # One lane of a backfill: fetches the oldest pending chunk of the job and
+    # enqueues itself for the next one, until none is left.
+    job = FetchJob.objects.select_related("user").get(pk=job_id)
+    if job.status != "running":
+        LOGGER.info("Backfill %s is %s - stopping.", job_id, job.status)
+        end_backfill_lane(job)
+        return
+    touch_backfill_lanes(job)
+    wait = quota_wait_seconds()
+    if wait > 0:
+        LOGGER.debug("Backfill %s waits %.1fs for the rate limit.", job_id, wait)
+        enqueue_backfill_step(job, countdown=wait)
+        return
+    chunk_id = next_backfill_chunk_id(job)
+    if chunk_id is None:
+        LOGGER.debug("Backfill %s has no chunk left to fetch.", job_id)
+        end_backfill_lane(job)
+        return
+    try:
+        run_fetch_chunk(chunk_id)
+    except Exception:
+        LOGGER.exception("Backfill %s failed to fetch chunk %s.", job_id, chunk_id)
+        enqueue_backfill_step(job, countdown=BACKFILL_RETRY_SECONDS)
+        return
+    log_backfill_progress(job)
+    enqueue_backfill_step(job)
+    return
+
+
+@app.task(name="resume_fetch_jobs", queue="default")
+def celery_resume_fetch_jobs():
+    LOGGER.debug("Celery task received: resume fetch jobs.")
+    jobs = stalled_fetch_jobs()
+    for job in jobs:
+        enqueue_fetch_job(job)
+    notifications = overdue_notifications()
+    for user_id, appli in notifications:
+        NOTIFICATION_TASKS[appli].delay({"userid": user_id, "appli": appli})
+    LOGGER.info(
+        "Celery task finished: resumed %s fetch job(s) and %s notification(s).",
+        len(jobs),
+        len(notifications),
+    )
+    return
+
+
+# the task of each appli, for the notifications that are enqueued again
+NOTIFICATION_TASKS = {
+    1: celery_appli_1_measurements,
+    16: celery_appli_16_activities,
+    44: celery_appli_44_sleep,
+}
+
+
+def fetch_job_queue(job):
+    # sleep fetches stay on the sleep workers
+    return "sleep_tasks" if job.data_type == "sleep" else "default"
+
+
+def enqueue_backfill_step(job, countdown=None):
+    celery_backfill_step.apply_async(
+        (job.pk,), countdown=countdown, queue=fetch_job_queue(job)
+    )
+
+
+def enqueue_fetch_job(job):
+    # All the pending chunks at once, spread over the workers of the queue -
+    # the shared rate limiter keeps them within the API quota. A backfill
+    # instead gets a few lanes that go through its chunks one by one.
+    queue = fetch_job_queue(job)
+    if job.backfill:
+        signatures = [
+            celery_backfill_step.si(job.pk).set(queue=queue)
+            for _ in range(start_backfill_lanes(job))
+        ]
+    else:
+        chunk_ids = (
+            job.chunks.filter(status="pending")
+            .order_by("start_date", "kind")
+            .values_list("id", flat=True)
+        )
+        signatures = [
+            celery_fetch_chunk.si(chunk_id).set(queue=queue) for chunk_id in chunk_ids
+        ]
+    group(signatures).apply_async()
+
+
+@app.task(name="maintain_partitions", queue="default")
+def celery_create_partitions():
+    LOGGER.debug("Celery task received: partitions.")
+    created = create_partitions()
+    LOGGER.info("Created %s new partition(s): %s", len(created), created)
+    return
+
+
+@app.task(name="compact_activities", queue="default")
+def celery_compact_activities():
+    LOGGER.debug("Celery task received: cold storage.")
+    compacted = compact_activities()
+    LOGGER.info(
+        "Celery task finished: cold storage. Compacted %s raw activity row(s).",
+        compacted,
+    )
+    return
+
+
+@app.task(name="enforce_retention", queue="default")
+def celery_enforce_retention():
+    LOGGER.debug("Celery task received: retention.")
+    reclaimed = enforce_retention()
+    LOGGER.info(
+        "Celery task finished: retention. Reclaimed %s raw activity row(s).",
+        sum(reclaimed["dropped_partitions"].values()) + reclaimed["deleted_rows"],
     )
     return
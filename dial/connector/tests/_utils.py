@@ -2,12 +2,20 @@ from datetime import datetime
 
 import pytz
 from django.test import TestCase
+from unittest.mock import patch
 
 from ..models import APIUser
 
 
 class DialTestBase(TestCase):
     def setUp(self):
+        # rate limiting has its own tests - do not throttle the fake API calls
+        rate_limits = patch.dict(
+            "connector.utils.rate_limit.WITHINGS_RATE_LIMITS", clear=True
+        )
+        rate_limits.start()
+        self.addCleanup(rate_limits.stop)
+
         self.fake_token = "token124"
         self.user = APIUser.objects.get_or_create(
             first_name='Test',
@@ -10,10 +10,11 @@ from ._utils import DialTestBase
 from .fake_responses import (
     DATE1,
     DATE2,
+    FAKE_ACTIVITY_RAW_RESPONSE,
     FAKE_ACTIVITY_SUMMARY_RESPONSE,
 )
-from ..models import ActivitySummary
-from ..utils.activity import get_activity_summary
+from ..models import ActivityRaw, ActivitySummary
+from ..utils.activity import build_activity_raw, get_activity_summary
 
 
 class ActivitySummaryTestCase(DialTestBase):
@@ -49,7 +50,7 @@ class ActivitySummaryTestCase(DialTestBase):
             measurement_type="steps",
         )
 
-    @patch("requests.post")
+    @patch("connector.utils.client.post")
     def test_activity_summary(self, patched_post):
         request_response = MagicMock()
         request_response.text = json.dumps(FAKE_ACTIVITY_SUMMARY_RESPONSE)
@@ -131,3 +132,28 @@ class ActivitySummaryTestCase(DialTestBase):
                     expected_activities[i]["hr_zone_3"],
                 )
                 self.assertEqual(activity_result.measurement_type, "steps")
+
+
+class ActivityRawTestCase(DialTestBase):
+    def test_all_metrics_of_a_timestamp_end_up_in_one_row(self):
+        series = FAKE_ACTIVITY_RAW_RESPONSE["body"]["series"]
+        entry = {**series["1608915300"], "heart_rate": 68, "spo2_auto": 97.5}
+        activity = build_activity_raw("1608915300", entry, self.user)
+        activity.save()
+
+        activity = ActivityRaw.objects.get()
+        self.assertEqual(
+            (
+                activity.steps,
+                activity.duration,
+                activity.distance,
+                activity.heart_rate,
+                activity.spo2_auto,
+                activity.stroke,
+            ),
+            (7, 60, 4.74, 68, 97.5, None),
+        )
+
+    def test_entries_without_data_are_skipped(self):
+        entry = {"model": "Activite Steel HR", "model_id": 55}
+        self.assertIsNone(build_activity_raw("1608915300", entry, self.user))
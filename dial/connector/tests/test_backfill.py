@@ -0,0 +1,216 @@
+from datetime import datetime, timedelta
+from io import StringIO
+from unittest.mock import MagicMock, patch
+
+import pytz
+from django.core.management import call_command
+from django.utils import timezone
+
+from ._utils import DialTestBase
+from ..models import FetchChunk, FetchJob, RateLimitBucket
+from ..tasks import celery_backfill_step, enqueue_fetch_job
+from ..utils.backfill import backfill_progress, quota_wait_seconds
+from ..utils.jobs import plan_fetch_job, stalled_fetch_jobs
+from ..utils.rate_limit import GLOBAL_BUCKET
+
+START = datetime(2021, 3, 1, tzinfo=pytz.utc)
+
+
+def plan_backfill(user, days: int = 30) -> FetchJob:
+    return plan_fetch_job(
+        user, "sleep", START, START + timedelta(days=days), backfill=True
+    )
+
+
+@patch("connector.utils.jobs.get_valid_token", return_value={"access_token": "t"})
+class BackfillTestCase(DialTestBase):
+    @patch("connector.tasks.group")
+    def test_only_a_few_lanes_run_at_once(self, patched_group, _):
+        job = plan_backfill(self.user)
+        with patch("connector.utils.backfill.BACKFILL_MAX_IN_FLIGHT", 3):
+            enqueue_fetch_job(job)
+            # the lanes are still going (e.g. waiting for a countdown)
+            enqueue_fetch_job(job)
+        self.assertEqual(
+            [len(call.args[0]) for call in patched_group.call_args_list], [3, 0]
+        )
+        signatures = patched_group.call_args_list[0].args[0]
+        self.assertEqual([signature.args for signature in signatures], [(job.pk,)] * 3)
+        job.refresh_from_db()
+        self.assertEqual(job.lanes, 3)
+
+    @patch("connector.tasks.celery_backfill_step.apply_async")
+    def test_backfills_leave_a_reserve_on_every_request(self, patched_apply, _):
+        fetchers = {
+            ("sleep", "raw"): (MagicMock(return_value=1), None, None),
+            ("sleep", "summary"): (MagicMock(return_value=1), None, None),
+        }
+        job = plan_backfill(self.user, days=1)
+        with patch.dict("connector.utils.jobs.FETCHERS", fetchers), patch(
+            "connector.utils.jobs.BACKFILL_RATE_RESERVE", 0.25
+        ):
+            celery_backfill_step(job.pk)
+        self.assertEqual(
+            fetchers[("sleep", "raw")][0].call_args.kwargs["rate_reserve"], 0.25
+        )
+
+    @patch("connector.tasks.celery_backfill_step.apply_async")
+    def test_a_lane_goes_through_the_chunks_oldest_first(self, patched_apply, _):
+        fetchers = {
+            ("sleep", "raw"): (MagicMock(return_value=10), None, None),
+            ("sleep", "summary"): (MagicMock(return_value=1), None, None),
+        }
+        job = plan_backfill(self.user, days=10)
+        with patch.dict("connector.utils.jobs.FETCHERS", fetchers):
+            FetchJob.objects.filter(pk=job.pk).update(lanes=1)
+            for _ in range(4):
+                celery_backfill_step(job.pk)
+            celery_backfill_step(job.pk)
+
+        self.assertEqual(
+            [c.kwargs["start_date"] for c in fetchers[("sleep", "raw")][0].mock_calls],
+            [START, START + timedelta(days=7)],
+        )
+        job.refresh_from_db()
+        self.assertEqual(
+            (job.status, job.raw_count, job.summary_count), ("done", 20, 2)
+        )
+        self.assertEqual(patched_apply.call_count, 4)
+        # the lane ended
+        self.assertEqual(job.lanes, 0)
+
+    @patch("connector.tasks.celery_backfill_step.apply_async")
+    def test_failed_chunks_are_retried(self, patched_apply, _):
+        failing = MagicMock(side_effect=ValueError("broken"))
+        fetchers = {
+            ("sleep", "raw"): (failing, None, None),
+            ("sleep", "summary"): (MagicMock(return_value=1), None, None),
+        }
+        job = plan_backfill(self.user, days=1)
+        with patch.dict("connector.utils.jobs.FETCHERS", fetchers), patch(
+            "connector.utils.jobs.BACKFILL_MAX_ATTEMPTS", 2
+        ):
+            celery_backfill_step(job.pk)
+            raw = job.chunks.get(kind="raw")
+            self.assertEqual((raw.status, raw.attempts), ("pending", 1))
+            self.assertEqual(patched_apply.call_args.kwargs["countdown"], 60)
+            for _ in range(2):
+                celery_backfill_step(job.pk)
+
+        raw.refresh_from_db()
+        self.assertEqual((raw.status, raw.attempts), ("failed", 2))
+        job.refresh_from_db()
+        self.assertEqual(job.status, "failed")
+
+    @patch("connector.tasks.celery_backfill_step.apply_async")
+    def test_lanes_wait_while_the_quota_is_low(self, patched_apply, _):
+        now = timezone.now()
+        bucket = RateLimitBucket.objects.create(
+            name=GLOBAL_BUCKET, tokens=1, capacity=10, refill_rate=2, updated_at=now
+        )
+        self.assertEqual(quota_wait_seconds(now), 2)
+        self.assertEqual(quota_wait_seconds(now + timedelta(seconds=3)), 0)
+
+        job = plan_backfill(self.user, days=1)
+        with patch("connector.utils.backfill.timezone.now", return_value=now):
+            celery_backfill_step(job.pk)
+        self.assertFalse(job.chunks.exclude(status="pending").exists())
+        self.assertEqual(patched_apply.call_args.kwargs["countdown"], 2)
+
+        bucket.tokens = 10
+        bucket.save()
+        self.assertEqual(quota_wait_seconds(now), 0)
+
+    def test_stalled_jobs_are_resumed(self, _):
+        now = timezone.now()
+        job = plan_backfill(self.user, days=10)
+        FetchJob.objects.filter(pk=job.pk).update(created_at=now - timedelta(hours=2))
+        FetchJob.objects.filter(pk=job.pk).update(lanes=2)
+        first, *_ = job.chunks.order_by("start_date", "kind")
+        FetchChunk.objects.filter(pk=first.pk).update(
+            status="running", started_at=now - timedelta(hours=1)
+        )
+        self.assertEqual(stalled_fetch_jobs(now), [job])
+        job.refresh_from_db()
+        self.assertEqual(job.lanes, 0)
+        self.assertFalse(job.chunks.filter(status="running").exists())
+
+        # a chunk that just started means the job is still going
+        FetchChunk.objects.filter(pk=first.pk).update(
+            status="running", started_at=now - timedelta(minutes=1)
+        )
+        self.assertEqual(stalled_fetch_jobs(now), [])
+
+    @patch("connector.tasks.celery_backfill_step.apply_async")
+    def test_lanes_waiting_for_the_quota_are_not_resumed(self, patched_apply, _):
+        now = timezone.now()
+        job = plan_backfill(self.user, days=10)
+        enqueue_fetch_job(job)
+        FetchJob.objects.filter(pk=job.pk).update(created_at=now - timedelta(hours=2))
+        # the lanes only wait, the chunks are not touched
+        later = now + timedelta(hours=1)
+        RateLimitBucket.objects.create(
+            name=GLOBAL_BUCKET, tokens=0, capacity=10, refill_rate=1, updated_at=later
+        )
+        with patch("connector.utils.backfill.timezone.now", return_value=later):
+            celery_backfill_step(job.pk)
+        self.assertEqual(patched_apply.call_args.kwargs["countdown"], 5)
+        self.assertFalse(job.chunks.exclude(status="pending").exists())
+
+        self.assertEqual(stalled_fetch_jobs(later), [])
+        job.refresh_from_db()
+        self.assertEqual(job.lanes, 2)
+
+    def test_progress_and_eta(self, _):
+        job = plan_backfill(self.user, days=28)
+        chunks = list(job.chunks.order_by("start_date", "kind"))
+        for i, chunk in enumerate(chunks[:2]):
+            chunk.status = "done"
+            chunk.rows = 100
+            chunk.started_at = START + timedelta(seconds=10 * i)
+            chunk.finished_at = START + timedelta(seconds=10 * (i + 1))
+            chunk.save()
+
+        progress = backfill_progress(job)
+        self.assertEqual(
+            progress,
+            {
+                "chunks": 8,
+                "done": 2,
+                "failed": 0,
+                "remaining": 6,
+                "rows": 200,
+                "rows_per_second": 10.0,
+                "eta": timedelta(seconds=60),
+            },
+        )
+
+    @patch("connector.management.commands.backfill.enqueue_fetch_job")
+    def test_the_command_resumes_unfinished_backfills(self, patched_enqueue, _):
+        out = StringIO()
+        call_command(
+            "backfill",
+            user=123,
+            types="sleep,activity",
+            start="2021-03-01",
+            end="2021-04-01",
+            stdout=out,
+        )
+        jobs = FetchJob.objects.filter(backfill=True)
+        self.assertEqual(
+            sorted(jobs.values_list("data_type", flat=True)), ["activity", "sleep"]
+        )
+        self.assertEqual(jobs.get(data_type="sleep").chunks.count(), 4)
+        self.assertEqual(patched_enqueue.call_count, 2)
+
+        # still running - not enqueued twice
+        call_command("backfill", user=123, types="sleep", stdout=out)
+        self.assertEqual(patched_enqueue.call_count, 2)
+
+        FetchJob.objects.update(created_at=timezone.now() - timedelta(hours=1))
+        call_command("backfill", user=123, types="sleep", stdout=out)
+        self.assertEqual(patched_enqueue.call_count, 3)
+        self.assertEqual(jobs.count(), 2)
+
+        call_command("backfill", status=True, stdout=out)
+        self.assertIn("0/4 chunk(s) done", out.getvalue())
@@ -0,0 +1,30 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from ..utils import client
+
+
+class ClientTestCase(TestCase):
+    def tearDown(self):
+        client.close_session()
+
+    def test_session_reused_within_process(self):
+        self.assertIs(client.get_session(), client.get_session())
+
+    def test_session_rebuilt_after_fork(self):
+        session = client.get_session()
+        with patch("connector.utils.client.os.getpid", return_value=-1):
+            self.assertIsNot(client.get_session(), session)
+
+    def test_pool_configuration(self):
+        adapter = client.get_session().get_adapter("https://wbsapi.withings.net")
+        self.assertEqual(adapter._pool_connections, client.WITHINGS_POOL_CONNECTIONS)
+        self.assertEqual(adapter._pool_maxsize, client.WITHINGS_POOL_MAXSIZE)
+
+    @patch("requests.Session.post")
+    def test_post_applies_timeouts(self, patched_post):
+        client.post("https://wbsapi.withings.net/v2/measure", data={"action": "get"})
+        self.assertEqual(
+            patched_post.call_args[1]["timeout"],
+            (client.WITHINGS_CONNECT_TIMEOUT, client.WITHINGS_READ_TIMEOUT),
+        )
@@ -0,0 +1,148 @@
+from datetime import date, datetime, timedelta
+from unittest.mock import patch
+
+import pytz
+
+from ._utils import DialTestBase
+from ..models import ActivityColdDay, ActivityHourly, ActivityRaw
+from ..utils import cold_storage
+from ..utils.cold_storage import (
+    compact_activities,
+    decode_values,
+    encode_values,
+    get_activities,
+)
+from ..utils.rollups import refresh_activity_rollups
+
+DAY = datetime(2021, 3, 1, tzinfo=pytz.utc)
+NOW = datetime(2021, 3, 20, tzinfo=pytz.utc)
+
+
+class ColdStorageTestCase(DialTestBase):
+    def make_activities(self, start: datetime, minutes: int, **kwargs):
+        ActivityRaw.objects.bulk_create(
+            ActivityRaw(
+                device_type="watch",
+                device_id=1,
+                user=self.user,
+                measured_at=start + timedelta(minutes=minute),
+                duration=60,
+                heart_rate=60 + minute % 7,
+                **kwargs,
+            )
+            for minute in range(minutes)
+        )
+
+    def test_values_are_encoded_losslessly(self):
+        rows = [
+            {"steps": 10, "distance": 0.1 + 0.2, "calories": None},
+            {"steps": None, "distance": 1e-300, "calories": -3.5},
+            {"steps": -7, "distance": None, "calories": 0.0},
+        ]
+        decoded = decode_values(encode_values(rows), len(rows))
+        for row, decoded_row in zip(rows, decoded):
+            self.assertEqual(decoded_row, {**dict.fromkeys(decoded_row), **row})
+
+    def test_closed_days_are_moved_to_the_cold_storage(self):
+        self.make_activities(DAY, 24 * 60)
+        self.make_activities(NOW - timedelta(days=1), 10)
+        hot_rows = list(
+            ActivityRaw.objects.filter(measured_at__lt=DAY + timedelta(days=1))
+            .order_by("measured_at")
+            .values_list("measured_at", "heart_rate", "duration", "steps")
+        )
+
+        self.assertEqual(compact_activities(now=NOW), 24 * 60)
+
+        cold_day = ActivityColdDay.objects.get()
+        self.assertEqual((cold_day.day, cold_day.points), (date(2021, 3, 1), 24 * 60))
+        # a tenth of the bytes that a single raw row would take per point
+        self.assertLess(len(cold_day.timestamps) + len(cold_day.values), 24 * 60)
+        self.assertEqual(ActivityRaw.objects.count(), 10)
+        self.assertEqual(ActivityHourly.objects.filter(bucket__lt=NOW).count(), 24)
+
+        activities = get_activities(
+            self.user, DAY - timedelta(hours=1), NOW + timedelta(hours=1)
+        )
+        self.assertEqual(len(activities), 24 * 60 + 10)
+        self.assertEqual(
+            [
+                (activity.measured_at, activity.heart_rate, activity.duration, None)
+                for activity in activities[: 24 * 60]
+            ],
+            hot_rows,
+        )
+
+    def test_compacting_a_day_again_merges_the_points(self):
+        self.make_activities(DAY, 3)
+        compact_activities(now=NOW)
+        self.make_activities(DAY + timedelta(minutes=2), 3)
+        compact_activities(now=NOW)
+
+        self.assertEqual(ActivityColdDay.objects.get().points, 5)
+        self.assertEqual(len(get_activities(self.user, DAY, NOW)), 5)
+
+    @patch("connector.utils.cold_storage.ACTIVITY_COLD_METRICS", [])
+    def test_nothing_is_compacted_without_cold_metrics(self):
+        self.make_activities(DAY, 3)
+        self.assertEqual(compact_activities(now=NOW), 0)
+        self.assertEqual(ActivityRaw.objects.count(), 3)
+
+    def test_only_rows_with_a_cold_metric_are_compacted(self):
+        self.make_activities(DAY, 2, steps=12)
+        ActivityRaw.objects.create(
+            device_type="watch",
+            device_id=1,
+            user=self.user,
+            measured_at=DAY + timedelta(hours=1),
+            duration=60,
+            steps=30,
+        )
+
+        self.assertEqual(compact_activities(now=NOW), 2)
+
+        # the steps stay in the raw rows, only the heart rate is moved
+        self.assertEqual(
+            list(
+                ActivityRaw.objects.order_by("measured_at").values_list(
+                    "steps", "heart_rate"
+                )
+            ),
+            [(12, None), (12, None), (30, None)],
+        )
+        self.assertEqual(
+            [
+                (activity.steps, activity.heart_rate)
+                for activity in get_activities(self.user, DAY, NOW)
+            ],
+            [(12, 60), (12, 61), (30, None)],
+        )
+
+        # recomputing the rollups of the compacted day keeps the steps whole
+        refresh_activity_rollups(self.user, DAY, DAY + timedelta(hours=1))
+        self.assertEqual(
+            ActivityHourly.objects.get(
+                metric="steps", bucket=DAY + timedelta(hours=1)
+            ).sum,
+            30,
+        )
+        self.assertEqual(ActivityHourly.objects.get(metric="steps", bucket=DAY).sum, 24)
+
+    def test_rows_written_during_the_compaction_keep_their_values(self):
+        self.make_activities(DAY, 2)
+        store_cold_day = cold_storage._store_cold_day
+
+        def store_and_write(*args):
+            store_cold_day(*args)
+            # e.g. a backfill chunk writing the day at the same time
+            self.make_activities(DAY + timedelta(hours=2), 1, steps=5)
+
+        with patch(
+            "connector.utils.cold_storage._store_cold_day", side_effect=store_and_write
+        ):
+            self.assertEqual(compact_activities(now=NOW), 2)
+
+        self.assertEqual(ActivityColdDay.objects.get().points, 2)
+        self.assertEqual(
+            list(ActivityRaw.objects.values_list("steps", "heart_rate")), [(5, 60)]
+        )
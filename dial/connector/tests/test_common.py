@@ -1,10 +1,23 @@
-from datetime import datetime
+import json
+from datetime import datetime, timedelta
+from unittest.mock import patch, MagicMock
 
 import pytz
+from django.utils.timezone import make_aware
 
 from ._utils import DialTestBase
 from ..models import ActivitySummary, APIUser
-from ..utils.common import prepare_date_pairs
+from ..utils.circuit_breaker import CircuitBreaker, reset_circuit_breakers
+from ..utils.common import (
+    notification_window,
+    prepare_date_pairs,
+    iterate_pages,
+    send_data_request,
+    APIError,
+    RetryableAPIError,
+    CircuitOpenError,
+    WITHINGS_MAX_RETRIES,
+)
 from testfixtures import Replace, test_datetime
 
 
@@ -45,7 +58,12 @@ class UtilsTestCase(DialTestBase):
         ):
             end_date = datetime.strptime("2020-12-31T08:59:37", "%Y-%m-%dT%H:%M:%S")
             date_pairs_obs = prepare_date_pairs(
-                ActivitySummary, self.start_date, end_date, True
+                ActivitySummary,
+                self.user,
+                "getactivity",
+                self.start_date,
+                end_date,
+                True,
             )
             date_pairs_exp = [
                 (
@@ -63,7 +81,12 @@ class UtilsTestCase(DialTestBase):
         ):
             end_date = datetime.strptime("2020-12-31T08:59:37", "%Y-%m-%dT%H:%M:%S")
             date_pairs_obs = prepare_date_pairs(
-                ActivitySummary, self.start_date, end_date, True
+                ActivitySummary,
+                self.user,
+                "getactivity",
+                self.start_date,
+                end_date,
+                True,
             )
             date_pairs_exp = [
                 (
@@ -81,7 +104,12 @@ class UtilsTestCase(DialTestBase):
         ):
             end_date = datetime.strptime("2020-12-31T08:59:37", "%Y-%m-%dT%H:%M:%S")
             date_pairs_obs = prepare_date_pairs(
-                ActivitySummary, self.start_date, end_date, True
+                ActivitySummary,
+                self.user,
+                "getactivity",
+                self.start_date,
+                end_date,
+                True,
             )
             date_pairs_exp = [
                 (
@@ -104,7 +132,7 @@ class UtilsTestCase(DialTestBase):
     def test_date_pairs_nonotif_same_day(self):
         end_date = datetime(2020, 12, 30, 9, 48, 37, tzinfo=pytz.UTC)
         date_pairs_obs = prepare_date_pairs(
-            ActivitySummary, self.start_date, end_date, False
+            ActivitySummary, self.user, "getactivity", self.start_date, end_date, False
         )
         date_pairs_exp = [
             (
@@ -119,7 +147,7 @@ class UtilsTestCase(DialTestBase):
     def test_date_pairs_nonotif_next_day(self):
         end_date = datetime(2020, 12, 31, 9, 48, 37, tzinfo=pytz.UTC)
         date_pairs_obs = prepare_date_pairs(
-            ActivitySummary, self.start_date, end_date, False
+            ActivitySummary, self.user, "getactivity", self.start_date, end_date, False
         )
         date_pairs_exp = [
             (
@@ -134,7 +162,7 @@ class UtilsTestCase(DialTestBase):
     def test_date_pairs_nonotif_more_days(self):
         end_date = datetime(2021, 1, 2, 9, 48, 37, tzinfo=pytz.UTC)
         date_pairs_obs = prepare_date_pairs(
-            ActivitySummary, self.start_date, end_date, False
+            ActivitySummary, self.user, "getactivity", self.start_date, end_date, False
         )
         date_pairs_exp = [
             (
@@ -153,3 +181,145 @@ class UtilsTestCase(DialTestBase):
         self.assertEqual(len(date_pairs_obs), len(date_pairs_exp))
         for i, j in zip(date_pairs_obs, date_pairs_exp):
             self.assertEqual(i, j)
+
+    @patch("connector.utils.common.NOTIFICATION_WINDOW_MARGIN_MINUTES", 10)
+    def test_notification_window_is_widened_by_the_margin(self):
+        start_date, end_date = notification_window(
+            {"userid": "123", "startdate": "1608915000", "enddate": "1608915600"}
+        )
+        self.assertEqual(
+            (start_date, end_date),
+            (
+                datetime(2020, 12, 25, 16, 40, tzinfo=pytz.UTC),
+                datetime(2020, 12, 25, 17, 10, tzinfo=pytz.UTC),
+            ),
+        )
+
+    def test_notification_window_of_a_day(self):
+        start_date, end_date = notification_window({"date": "2020-12-25"})
+        self.assertEqual(start_date, make_aware(datetime(2020, 12, 25)))
+        self.assertEqual(end_date - start_date, timedelta(days=1))
+        self.assertEqual(notification_window({"userid": "123"}), (None, None))
+
+
+def fake_page(entries, more, offset, status=0, status_code=200):
+    response = MagicMock()
+    response.status_code = status_code
+    response.text = json.dumps(
+        {
+            "status": status,
+            "body": {"series": entries, "more": more, "offset": offset},
+            "error": "fake error",
+        }
+    )
+    return response
+
+
+class PaginationTestCase(DialTestBase):
+    @patch("connector.utils.client.post")
+    def test_iterate_pages_follows_offset(self, patched_post):
+        patched_post.side_effect = [
+            fake_page([1, 2], True, 2),
+            fake_page([3, 4], True, 4),
+            fake_page([5], False, 0),
+        ]
+        pages = list(
+            iterate_pages("http://fake/measure", {"action": "get"}, self.fake_token)
+        )
+        self.assertEqual([page["series"] for page in pages], [[1, 2], [3, 4], [5]])
+        offsets = [
+            call[1]["data"].get("offset") for call in patched_post.call_args_list
+        ]
+        self.assertEqual(offsets, [None, 2, 4])
+
+    @patch("connector.utils.client.post")
+    def test_iterate_pages_stops_on_stuck_offset(self, patched_post):
+        patched_post.side_effect = [fake_page([1], True, 3), fake_page([2], True, 3)]
+        pages = list(
+            iterate_pages("http://fake/measure", {"action": "get"}, self.fake_token)
+        )
+        self.assertEqual(len(pages), 2)
+
+
+@patch("connector.utils.common.time.sleep")
+class RetryTestCase(DialTestBase):
+    def setUp(self):
+        super().setUp()
+        reset_circuit_breakers()
+        self.addCleanup(reset_circuit_breakers)
+        self.endpoint = "http://fake/measure"
+
+    @patch("connector.utils.client.post")
+    def test_transient_errors_are_retried(self, patched_post, patched_sleep):
+        patched_post.side_effect = [
+            fake_page([], False, 0, status_code=503),
+            fake_page([], False, 0, status=601),
+            fake_page([1], False, 0),
+        ]
+        body = send_data_request(self.endpoint, {"action": "get"}, self.fake_token)
+        self.assertEqual(body["series"], [1])
+        self.assertEqual(patched_post.call_count, 3)
+        self.assertEqual(patched_sleep.call_count, 2)
+
+    @patch("connector.utils.client.post")
+    def test_fatal_errors_are_not_retried(self, patched_post, patched_sleep):
+        patched_post.return_value = fake_page([], False, 0, status=503)
+        with self.assertRaises(APIError) as context:
+            send_data_request(self.endpoint, {"action": "get"}, self.fake_token)
+        self.assertNotIsInstance(context.exception, RetryableAPIError)
+        self.assertEqual(patched_post.call_count, 1)
+        patched_sleep.assert_not_called()
+
+    @patch("connector.utils.client.post")
+    def test_retries_are_limited(self, patched_post, patched_sleep):
+        patched_post.return_value = fake_page([], False, 0, status_code=502)
+        with self.assertRaises(RetryableAPIError):
+            send_data_request(self.endpoint, {"action": "get"}, self.fake_token)
+        self.assertEqual(patched_post.call_count, WITHINGS_MAX_RETRIES + 1)
+
+    @patch("connector.utils.circuit_breaker.time.monotonic")
+    @patch("connector.utils.client.post")
+    def test_circuit_opens_and_recovers(
+        self, patched_post, patched_monotonic, patched_sleep
+    ):
+        patched_monotonic.return_value = 1000
+        patched_post.return_value = fake_page([], False, 0, status_code=500)
+        with self.assertRaises(APIError):
+            send_data_request(self.endpoint, {"action": "get"}, self.fake_token)
+        calls_before = patched_post.call_count
+
+        # the circuit is open - fail fast without calling the API
+        with self.assertRaises(CircuitOpenError):
+            send_data_request(self.endpoint, {"action": "get"}, self.fake_token)
+        self.assertEqual(patched_post.call_count, calls_before)
+
+        # other endpoints are not affected
+        patched_post.return_value = fake_page([2], False, 0)
+        send_data_request("http://fake/sleep", {"action": "get"}, self.fake_token)
+
+        # after the cooldown a successful request closes the circuit
+        patched_monotonic.return_value = 2000
+        body = send_data_request(self.endpoint, {"action": "get"}, self.fake_token)
+        self.assertEqual(body["series"], [2])
+
+    @patch("connector.utils.circuit_breaker.time.monotonic")
+    def test_half_open_circuit_lets_one_trial_through(
+        self, patched_monotonic, patched_sleep
+    ):
+        patched_monotonic.return_value = 1000
+        breaker = CircuitBreaker("test", threshold=1, cooldown=60)
+        breaker.record_failure()
+        self.assertFalse(breaker.allow_request())
+
+        patched_monotonic.return_value = 1060
+        self.assertTrue(breaker.allow_request())
+        # the others keep failing fast while the trial is running
+        self.assertFalse(breaker.allow_request())
+
+        breaker.record_failure()
+        self.assertFalse(breaker.allow_request())
+        patched_monotonic.return_value = 1120
+        self.assertTrue(breaker.allow_request())
+        breaker.record_success()
+        self.assertTrue(breaker.allow_request())
+        self.assertTrue(breaker.allow_request())
@@ -0,0 +1,145 @@
+from datetime import timedelta
+
+from django.utils import timezone
+
+from ._utils import DialTestBase
+from ..models import SleepRaw, Weight
+from ..utils.db import BulkWriter, CopyWriter, copy_upsert, drop_existing, upsert
+
+
+class BulkWriterTestCase(DialTestBase):
+    def make_weight(self, minutes: int) -> Weight:
+        return Weight(
+            device_id="abc",
+            user=self.user,
+            source="scale",
+            measured_at=timezone.now() - timedelta(minutes=minutes),
+            weight=70.0,
+        )
+
+    def test_flushes_in_batches_and_on_exit(self):
+        with BulkWriter(Weight, batch_size=2) as writer:
+            for i in range(3):
+                writer.add(self.make_weight(i))
+            self.assertEqual(writer.written, 2)
+            self.assertEqual(Weight.objects.count(), 2)
+
+        self.assertEqual(writer.written, 3)
+        self.assertEqual(Weight.objects.count(), 3)
+
+    def test_buffer_is_discarded_on_error(self):
+        with self.assertRaises(ValueError):
+            with BulkWriter(Weight, batch_size=10) as writer:
+                writer.add(self.make_weight(0))
+                raise ValueError("boom")
+
+        self.assertEqual(writer.written, 0)
+        self.assertEqual(Weight.objects.count(), 0)
+
+    def test_invalid_rows_are_skipped(self):
+        with BulkWriter(Weight, ("user", "measured_at")) as writer:
+            writer.add(self.make_weight(0))
+            missing_source = self.make_weight(1)
+            missing_source.source = None
+            writer.add(missing_source)
+            too_long = self.make_weight(2)
+            too_long.device_id = "x" * 129
+            writer.add(too_long)
+
+        self.assertEqual((writer.written, writer.skipped), (1, 2))
+        self.assertEqual(Weight.objects.count(), 1)
+
+
+class UpsertTestCase(DialTestBase):
+    def setUp(self):
+        super().setUp()
+        self.now = timezone.now().replace(microsecond=0)
+
+    def make_sleep_raw(self, minutes: int, **kwargs) -> SleepRaw:
+        start_date = self.now - timedelta(minutes=minutes)
+        fields = dict(
+            device_type="32",
+            device_id=1,
+            user=self.user,
+            start_date=start_date,
+            end_date=start_date + timedelta(minutes=1),
+            sleep_phase="LIGHT",
+            sleep_phase_id=1,
+            hr_timestamps=[1607634600],
+            hr_values=[55],
+        )
+        fields.update(kwargs)
+        return SleepRaw(**fields)
+
+    def test_inserts_then_updates_only_changed_rows(self):
+        key = ("user", "device_id", "start_date")
+        self.assertEqual(
+            upsert(SleepRaw, [self.make_sleep_raw(1), self.make_sleep_raw(2)], key),
+            (2, 0),
+        )
+        row_id = SleepRaw.objects.get(start_date=self.now - timedelta(minutes=2)).id
+
+        revised = [self.make_sleep_raw(1), self.make_sleep_raw(2, sleep_phase="DEEP")]
+        self.assertEqual(upsert(SleepRaw, revised, key), (0, 1))
+
+        self.assertEqual(SleepRaw.objects.count(), 2)
+        revised_row = SleepRaw.objects.get(id=row_id)
+        self.assertEqual(revised_row.sleep_phase, "DEEP")
+        self.assertEqual(revised_row.hr_values, [55])
+
+    def test_duplicates_within_a_batch_keep_the_last_one(self):
+        with BulkWriter(SleepRaw, ("user", "device_id", "start_date")) as writer:
+            writer.add(self.make_sleep_raw(1, sleep_phase="LIGHT"))
+            writer.add(self.make_sleep_raw(1, sleep_phase="REM"))
+
+        self.assertEqual((writer.inserted, writer.updated), (1, 0))
+        self.assertEqual(SleepRaw.objects.get().sleep_phase, "REM")
+
+    def test_unchanged_rows_are_dropped_with_one_query(self):
+        key = ("user", "device_id", "start_date")
+        upsert(SleepRaw, [self.make_sleep_raw(1), self.make_sleep_raw(2)], key)
+        instances = [
+            self.make_sleep_raw(1),
+            self.make_sleep_raw(2, sleep_phase="DEEP"),
+            self.make_sleep_raw(3),
+        ]
+
+        with self.assertNumQueries(1):
+            changed = drop_existing(SleepRaw, instances, key, "start_date")
+        self.assertEqual(changed, instances[1:])
+
+        with BulkWriter(SleepRaw, key, time_field="start_date") as writer:
+            for instance in instances:
+                writer.add(instance)
+        self.assertEqual((writer.inserted, writer.updated), (1, 1))
+
+    def test_copy_merges_into_existing_rows(self):
+        key = ("user", "device_id", "start_date")
+        upsert(SleepRaw, [self.make_sleep_raw(1)], key)
+        tricky_device = 'a"b\\c\td'
+
+        with CopyWriter(SleepRaw, key, batch_size=2) as writer:
+            writer.add(self.make_sleep_raw(1, sleep_phase="REM"))
+            writer.add(
+                self.make_sleep_raw(
+                    2,
+                    device_type=tricky_device,
+                    rr_timestamps=[1, 2],
+                    rr_values=[14, 15],
+                )
+            )
+            writer.add(self.make_sleep_raw(3))
+
+        self.assertEqual((writer.inserted, writer.updated), (2, 1))
+        self.assertGreater(writer.rows_per_second, 0)
+        self.assertEqual(SleepRaw.objects.count(), 3)
+        self.assertEqual(
+            SleepRaw.objects.get(
+                start_date=self.now - timedelta(minutes=1)
+            ).sleep_phase,
+            "REM",
+        )
+        copied_row = SleepRaw.objects.get(start_date=self.now - timedelta(minutes=2))
+        self.assertEqual(copied_row.device_type, tricky_device)
+        self.assertEqual(copied_row.rr_values, [14, 15])
+        self.assertEqual(copy_upsert(SleepRaw, [self.make_sleep_raw(3)], key), (0, 0))
@@ -0,0 +1,56 @@
+import json
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+
+from ..utils.common import APIError
+from ..utils.fetch_engine import FetchEngine
+
+
+class FakeAPI:
+    def __init__(self, delay=0.01):
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, url, data=None, headers=None):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        # later windows answer faster to make sure the order is restored
+        time.sleep(self.delay / max(data["startdate"], 1))
+        with self.lock:
+            self.active -= 1
+        response = MagicMock()
+        response.status_code = 200
+        status = 0 if data["startdate"] > 0 else 503
+        response.text = json.dumps(
+            {"status": status, "body": {"series": [data["startdate"]]}, "error": "x"}
+        )
+        return response
+
+
+@patch.dict("connector.utils.rate_limit.WITHINGS_RATE_LIMITS", clear=True)
+class FetchEngineTestCase(TestCase):
+    def test_pages_are_yielded_in_window_order(self):
+        fake_api = FakeAPI()
+        windows = [{"action": "get", "startdate": i} for i in range(1, 21)]
+        engine = FetchEngine("http://fake/sleep", "token", concurrency=4)
+        with patch("connector.utils.client.post", side_effect=fake_api):
+            pages = list(engine.fetch(windows))
+
+        self.assertEqual([page["series"][0] for page in pages], list(range(1, 21)))
+        self.assertEqual(engine.requests, 20)
+        self.assertEqual(engine.windows, 20)
+        self.assertLessEqual(fake_api.max_active, 4)
+        self.assertGreater(fake_api.max_active, 1)
+        self.assertGreater(engine.wall_clock, 0)
+
+    def test_errors_are_raised_to_the_consumer(self):
+        windows = [{"action": "get", "startdate": i} for i in (1, 0, 2)]
+        engine = FetchEngine("http://fake/sleep", "token", concurrency=2)
+        with patch("connector.utils.client.post", side_effect=FakeAPI()):
+            with self.assertRaises(APIError):
+                list(engine.fetch(windows))
@@ -0,0 +1,232 @@
+import json
+
+from django.conf import settings
+from django.db import connection
+from django.test import TestCase
+from unittest import skipUnless
+
+from ..models import (
+    ActivityRaw,
+    ActivitySummary,
+    APIUser,
+    SleepRaw,
+    SleepSignal,
+    SleepSummary,
+    Weight,
+    WeightTrend,
+)
+
+DASHBOARD_PATH = settings.BASE_DIR.parent.parent / "grafana-dashboard.json"
+TIME_FROM = "'2021-01-01T00:00:00Z'::timestamptz"
+TIME_TO = "'2021-02-01T00:00:00Z'::timestamptz"
+# natural key lookups as done by the upsert and per-user "latest entry" lookups
+DEDUP_LOOKUPS = {
+    ActivityRaw: ("measured_at", {}),
+    ActivitySummary: ("measured_at", {"measurement_type": "steps"}),
+    SleepRaw: ("start_date", {"device_id": 1}),
+    SleepSignal: ("ts", {"device_id": 1, "signal": "hr"}),
+    SleepSummary: ("start_date", {"device_id": 1}),
+    Weight: ("measured_at", {}),
+    WeightTrend: ("measured_at", {"metric": "weight"}),
+}
+
+SEED_SQL = (
+    """
+    INSERT INTO connector_activityraw (reported_at, device_type, device_id, user_id,
+        measured_at, steps, duration, heart_rate)
+    SELECT now(), 'tracker', 1, %(user_id)s,
+        %(start)s::timestamptz + i * interval '15 minutes', i %% 100, 60, 60
+    FROM generate_series(1, 100000) AS i
+    """,
+    """
+    INSERT INTO connector_activitysummary (reported_at, device_type, device_id,
+        user_id, measured_at, is_tracker, steps, hr_average, measurement_type)
+    SELECT now(), 'tracker', 1, %(user_id)s,
+        %(start)s::timestamptz + i * interval '1 day', true, i, 60, 'steps'
+    FROM generate_series(1, 3000) AS i
+    """,
+    """
+    INSERT INTO connector_activityhourly (user_id, metric, bucket, sum, min, max,
+        avg, count)
+    SELECT %(user_id)s, metric, %(start)s::timestamptz + i * interval '1 hour',
+        600, 0, 20, 10, 60
+    FROM generate_series(1, 25000) AS i,
+        unnest(ARRAY['steps', 'heart_rate']) AS metric
+    """,
+    """
+    INSERT INTO connector_activitydaily (user_id, metric, bucket, sum, min, max,
+        avg, count)
+    SELECT %(user_id)s, metric, %(start)s::timestamptz + i * interval '1 day',
+        14400, 0, 20, 10, 1440
+    FROM generate_series(1, 3000) AS i,
+        unnest(ARRAY['steps', 'heart_rate']) AS metric
+    """,
+    """
+    INSERT INTO connector_sleepraw (reported_at, device_type, device_id, user_id,
+        start_date, end_date, sleep_phase, sleep_phase_id, hr_timestamps, hr_values,
+        rr_timestamps, rr_values, snoring_timestamps, snoring_values)
+    SELECT now(), 'SLEEP_MONITOR', 1, %(user_id)s,
+        %(start)s::timestamptz + i * interval '10 minutes',
+        %(start)s::timestamptz + (i + 1) * interval '10 minutes',
+        'LIGHT', 1, '{}', '{}', '{}', '{}', '{}', '{}'
+    FROM generate_series(1, 50000) AS i
+    """,
+    """
+    INSERT INTO connector_sleepsignal (user_id, device_type, device_id, ts, signal,
+        value)
+    SELECT %(user_id)s, 'SLEEP_MONITOR', 1,
+        %(start)s::timestamptz + i * interval '1 minute', signal, 60
+    FROM generate_series(1, 100000) AS i,
+        unnest(ARRAY['hr', 'rr', 'snoring']) AS signal
+    """,
+    """
+    INSERT INTO connector_sleepsummary (reported_at, start_date, end_date, user_id,
+        device_type, device_id, breathing_disturbances_intensity, duration_to_sleep,
+        duration_to_wakeup, snoring, snoring_episode_count, wakeup_count,
+        wakeup_duration, sleep_score)
+    SELECT now(), %(start)s::timestamptz + i * interval '1 day',
+        %(start)s::timestamptz + i * interval '1 day' + interval '8 hours',
+        %(user_id)s, 'SLEEP_MONITOR', 1, 0, 0, 0, 0, 0, 0, 0, 80
+    FROM generate_series(1, 3000) AS i
+    """,
+    """
+    INSERT INTO connector_weight (reported_at, device_id, user_id, measured_at,
+        source, weight)
+    SELECT now(), 'scale', %(user_id)s, %(start)s::timestamptz + i * interval '1 day',
+        'scale', 70
+    FROM generate_series(1, 3000) AS i
+    """,
+    """
+    INSERT INTO connector_weighttrend (user_id, metric, measured_at, value, avg_7,
+        avg_14, ewma)
+    SELECT %(user_id)s, metric, %(start)s::timestamptz + i * interval '1 day',
+        70, 70, 70, 70
+    FROM generate_series(1, 3000) AS i,
+        unnest(ARRAY['weight', 'fat_mass_weight', 'muscle_mass', 'fat_ratio',
+            'hydration', 'muscle_fat_ratio', 'muscle_ratio']) AS metric
+    """,
+    """
+    INSERT INTO connector_nutrition (id, reported_at, user_id, start_date, end_date,
+        meal, data_source, calories, total_fat, saturated_fat, trans_fat,
+        cholesterol, sodium, carbohydrates, sugar, fiber, protein)
+    SELECT left(md5(i::text), 22), now(), %(user_id)s,
+        %(start)s::timestamptz + i * interval '6 hours',
+        %(start)s::timestamptz + i * interval '6 hours',
+        'Lunch', 'MyFitnessPal', 500, 0, 0, 0, 0, 0, 0, 0, 0, 0
+    FROM generate_series(1, 10000) AS i
+    """,
+)
+
+
+def dashboard_queries() -> list:
+    queries = []
+
+    def collect(node):
+        if isinstance(node, dict):
+            if "rawSql" in node:
+                queries.append(node["rawSql"])
+            for value in node.values():
+                collect(value)
+        elif isinstance(node, list):
+            for value in node:
+                collect(value)
+
+    with open(DASHBOARD_PATH) as dashboard:
+        collect(json.load(dashboard))
+    return queries
+
+
+def render_grafana_macros(sql: str) -> str:
+    sql = sql.replace("$__timeFrom()", TIME_FROM).replace("$__timeTo()", TIME_TO)
+    while "$__timeFilter(" in sql:
+        start = sql.index("$__timeFilter(")
+        end = sql.index(")", start)
+        column = sql[start + len("$__timeFilter(") : end]
+        sql = f"{sql[:start]}{column} BETWEEN {TIME_FROM} AND {TIME_TO}{sql[end + 1:]}"
+    return sql
+
+
+class IndexUsageTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # plans for empty tables are meaningless - load a few years of data
+        cls.user = user = APIUser.objects.create(user_id=123, demo=False, height=1.7)
+        with connection.cursor() as cursor:
+            for sql in SEED_SQL:
+                cursor.execute(sql, {"user_id": user.id, "start": "2019-01-01"})
+            cursor.execute("ANALYZE")
+
+    def setUp(self):
+        # do not let the planner fall back to a seq scan on these small tables
+        with connection.cursor() as cursor:
+            cursor.execute("SET enable_seqscan = off")
+        self.addCleanup(self.reset_seqscan)
+
+    def reset_seqscan(self):
+        with connection.cursor() as cursor:
+            cursor.execute("RESET enable_seqscan")
+
+    def leading_column(self, index_name: str) -> str:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT a.attname
+                FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+                WHERE c.relname = %s
+                """,
+                [index_name],
+            )
+            return cursor.fetchone()[0]
+
+    def unindexed_tables(self, sql: str, params=None) -> set:
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+
+        tables = set()
+        nodes = [(plan[0]["Plan"], None)]
+        while nodes:
+            node, parent = nodes.pop()
+            if node["Node Type"] == "Seq Scan":
+                tables.add(node["Relation Name"])
+            elif "Index Cond" in node:
+                # an index whose leading column is not part of the condition is
+                # scanned from start to end - no better than a seq scan
+                if self.leading_column(node["Index Name"]) not in node["Index Cond"]:
+                    tables.add(node["Index Name"])
+            elif "Index Name" in node and parent["Node Type"] != "Limit":
+                # unconditioned index scans are only fine for ORDER BY ... LIMIT
+                tables.add(node["Index Name"])
+            nodes.extend((child, node) for child in node.get("Plans", []))
+        return tables
+
+    @skipUnless(DASHBOARD_PATH.exists(), "Grafana dashboard not available")
+    def test_dashboard_queries_use_indexes(self):
+        queries = dashboard_queries()
+        self.assertGreater(len(queries), 0)
+        for query in queries:
+            with self.subTest(query=query):
+                self.assertEqual(
+                    self.unindexed_tables(render_grafana_macros(query)), set()
+                )
+
+    def test_dedup_lookups_use_indexes(self):
+        for model, (time_field, key_filters) in DEDUP_LOOKUPS.items():
+            lookups = {
+                "natural key": model.objects.filter(
+                    user=self.user,
+                    **{time_field: "2021-01-01T00:00:00Z"},
+                    **key_filters,
+                ),
+                "latest entry": model.objects.filter(user=self.user).order_by(
+                    f"-{time_field}"
+                )[:1],
+            }
+            for name, queryset in lookups.items():
+                with self.subTest(model=model.__name__, lookup=name):
+                    sql, params = queryset.query.sql_with_params()
+                    self.assertEqual(self.unindexed_tables(sql, params), set())
@@ -0,0 +1,160 @@
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+import pytz
+
+from ._utils import DialTestBase
+from ..models import ActivityRaw, ActivitySummary
+from ..tasks import enqueue_fetch_job
+from ..utils.jobs import plan_fetch_job, run_fetch_chunk, split_range
+from ..utils.notifications import claim_notification_window
+from ..utils.sync import advance_sync_cursor
+
+START = datetime(2021, 3, 1, tzinfo=pytz.utc)
+
+
+def fake_fetcher(rows: int) -> MagicMock:
+    return MagicMock(return_value=rows)
+
+
+@patch("connector.utils.jobs.get_valid_token", return_value={"access_token": "t"})
+class FetchJobTestCase(DialTestBase):
+    def test_ranges_are_split_into_chunks(self, _):
+        self.assertEqual(
+            split_range(START, START + timedelta(days=10), 7),
+            [
+                (START, START + timedelta(days=7)),
+                (START + timedelta(days=7), START + timedelta(days=10)),
+            ],
+        )
+        self.assertEqual(
+            split_range(START, START + timedelta(hours=5), 7),
+            [(START, START + timedelta(hours=5))],
+        )
+        # whole UTC days, so that no rollup bucket is shared by two chunks
+        self.assertEqual(
+            split_range(START + timedelta(hours=10), START + timedelta(days=3), 2),
+            [
+                (START + timedelta(hours=10), START + timedelta(days=2)),
+                (START + timedelta(days=2), START + timedelta(days=3)),
+            ],
+        )
+
+    def test_every_kind_gets_its_own_chunks(self, _):
+        job = plan_fetch_job(self.user, "activity", START, START + timedelta(days=10))
+        self.assertEqual(
+            sorted(job.chunks.values_list("kind", "start_date")),
+            [
+                ("raw", START),
+                ("raw", START + timedelta(days=7)),
+                ("summary", START),
+                ("summary", START + timedelta(days=7)),
+            ],
+        )
+
+    def test_notification_jobs_resume_every_kind_from_its_cursor(self, _):
+        advance_sync_cursor(
+            self.user,
+            ActivityRaw,
+            "getintradayactivity",
+            START,
+            START + timedelta(days=2),
+        )
+        ActivitySummary.objects.create(
+            user=self.user,
+            device_type="tracker",
+            device_id=1,
+            measured_at=START + timedelta(days=1),
+            is_tracker=True,
+            measurement_type="steps",
+        )
+        job = plan_fetch_job(self.user, "activity", None, None, from_notification=True)
+        first_chunks = job.chunks.order_by("kind", "start_date").distinct("kind")
+        self.assertEqual(
+            list(first_chunks.values_list("kind", "start_date")),
+            [
+                ("raw", START + timedelta(days=2)),
+                ("summary", START + timedelta(days=1)),
+            ],
+        )
+
+    def test_chunk_results_are_aggregated_into_the_job(self, _):
+        fetchers = {
+            ("sleep", "raw"): (fake_fetcher(10), None, None),
+            ("sleep", "summary"): (fake_fetcher(1), None, None),
+        }
+        job = plan_fetch_job(self.user, "sleep", START, START + timedelta(days=10))
+        with patch.dict("connector.utils.jobs.FETCHERS", fetchers):
+            for chunk in job.chunks.all():
+                run_fetch_chunk(chunk.pk)
+                job.refresh_from_db()
+                self.assertEqual(
+                    job.status,
+                    "running"
+                    if job.chunks.filter(status="pending").exists()
+                    else "done",
+                )
+            # a duplicate task does not fetch the chunk again
+            run_fetch_chunk(chunk.pk)
+
+        self.assertEqual((job.raw_count, job.summary_count), (20, 2))
+        self.assertEqual(fetchers[("sleep", "raw")][0].call_count, 2)
+        self.assertEqual(
+            fetchers[("sleep", "raw")][0].call_args.kwargs,
+            {
+                "access_token": "t",
+                "user_id": 123,
+                "start_date": START + timedelta(days=7),
+                "end_date": START + timedelta(days=10),
+            },
+        )
+
+    def test_a_failed_chunk_fails_the_job(self, _):
+        failing = MagicMock(side_effect=ValueError("broken"))
+        fetchers = {
+            ("sleep", "raw"): (failing, None, None),
+            ("sleep", "summary"): (fake_fetcher(1), None, None),
+        }
+        job = plan_fetch_job(self.user, "sleep", START, START + timedelta(days=1))
+        with patch.dict("connector.utils.jobs.FETCHERS", fetchers):
+            with self.assertRaises(ValueError):
+                run_fetch_chunk(job.chunks.get(kind="raw").pk)
+            run_fetch_chunk(job.chunks.get(kind="summary").pk)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.summary_count), ("failed", 1))
+        self.assertEqual(job.chunks.get(kind="raw").error, "ValueError: broken")
+
+    def test_a_failed_notification_job_puts_its_window_back(self, _):
+        failing = MagicMock(side_effect=ValueError("broken"))
+        job = plan_fetch_job(
+            self.user, "sleep", START, START + timedelta(days=1), notification_appli=44,
+        )
+        fetchers = {
+            ("sleep", "raw"): (failing, None, None),
+            ("sleep", "summary"): (failing, None, None),
+        }
+        with patch.dict("connector.utils.jobs.FETCHERS", fetchers):
+            for chunk in job.chunks.all():
+                with self.assertRaises(ValueError):
+                    run_fetch_chunk(chunk.pk)
+
+        self.assertEqual(
+            claim_notification_window(123, 44), (START, START + timedelta(days=1))
+        )
+
+    @patch("connector.tasks.group")
+    def test_the_chunks_are_enqueued_together(self, patched_group, _):
+        job = plan_fetch_job(self.user, "sleep", START, START + timedelta(days=10))
+        enqueue_fetch_job(job)
+        signatures = patched_group.call_args.args[0]
+        self.assertEqual(
+            [signature.args[0] for signature in signatures],
+            list(
+                job.chunks.order_by("start_date", "kind").values_list("id", flat=True)
+            ),
+        )
+        self.assertEqual(
+            {signature.options["queue"] for signature in signatures}, {"sleep_tasks"}
+        )
+        patched_group.return_value.apply_async.assert_called_once()
@@ -0,0 +1,126 @@
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytz
+from django.utils import timezone
+
+from ._utils import DialTestBase
+from ..models import PendingNotification
+from ..tasks import (
+    celery_appli_1_measurements,
+    celery_appli_44_sleep,
+    celery_resume_fetch_jobs,
+)
+from ..utils.notifications import (
+    claim_notification_window,
+    debounce_notification,
+    overdue_notifications,
+)
+
+SLEEP_NOTIFICATION = {"userid": "123", "appli": "44"}
+
+
+@patch("connector.utils.common.NOTIFICATION_WINDOW_MARGIN_MINUTES", 0)
+class DebounceTestCase(DialTestBase):
+    def notification(self, start: int, end: int) -> dict:
+        return {**SLEEP_NOTIFICATION, "startdate": str(start), "enddate": str(end)}
+
+    def test_bursts_are_merged_into_one_window(self):
+        self.assertTrue(
+            debounce_notification(self.notification(1608915000, 1608915600))
+        )
+        self.assertFalse(
+            debounce_notification(self.notification(1608914000, 1608915100))
+        )
+        # other applis are debounced separately
+        self.assertTrue(
+            debounce_notification({**self.notification(0, 1), "appli": "1"})
+        )
+        self.assertEqual(PendingNotification.objects.get(appli=44).notifications, 2)
+
+        self.assertEqual(
+            claim_notification_window(123, 44),
+            (
+                datetime(2020, 12, 25, 16, 33, 20, tzinfo=pytz.UTC),
+                datetime(2020, 12, 25, 17, 0, tzinfo=pytz.UTC),
+            ),
+        )
+        # already taken over by the first task
+        self.assertIsNone(claim_notification_window(123, 44))
+        # a new burst starts a new task
+        self.assertTrue(
+            debounce_notification(self.notification(1608915000, 1608915600))
+        )
+
+    def test_notifications_without_a_window_leave_it_open(self):
+        debounce_notification(self.notification(1608915000, 1608915600))
+        debounce_notification(SLEEP_NOTIFICATION)
+        debounce_notification(self.notification(1608915000, 1608915600))
+        self.assertEqual(claim_notification_window("123", "44"), (None, None))
+
+    def test_lost_tasks_are_enqueued_again(self):
+        debounce_notification(SLEEP_NOTIFICATION)
+        PendingNotification.objects.update(due_at=timezone.now() - timedelta(hours=1))
+        self.assertTrue(debounce_notification(SLEEP_NOTIFICATION))
+
+    @patch("connector.tasks.get_valid_token", return_value={"access_token": "t"})
+    @patch(
+        "connector.tasks.request_all_measurements_data",
+        side_effect=ValueError("broken"),
+    )
+    def test_a_failed_fetch_puts_the_window_back(self, patched_request, _):
+        notification = {
+            **self.notification(1608915000, 1608915600),
+            "appli": "1",
+        }
+        debounce_notification(notification)
+        with self.assertRaises(ValueError):
+            celery_appli_1_measurements(notification)
+
+        pending = PendingNotification.objects.get()
+        self.assertEqual(
+            (pending.start_date, pending.end_date),
+            (
+                datetime(2020, 12, 25, 16, 50, tzinfo=pytz.UTC),
+                datetime(2020, 12, 25, 17, 0, tzinfo=pytz.UTC),
+            ),
+        )
+        # not picked up again until it is overdue, and only once
+        self.assertEqual(overdue_notifications(), [])
+        later = timezone.now() + timedelta(hours=1)
+        self.assertEqual(overdue_notifications(later), [(123, 1)])
+        self.assertEqual(overdue_notifications(later), [])
+
+    @patch("connector.tasks.enqueue_fetch_job", side_effect=ValueError("broken"))
+    def test_a_failed_enqueue_puts_the_window_back(self, _):
+        debounce_notification(self.notification(1608915000, 1608915600))
+        with self.assertRaises(ValueError):
+            celery_appli_44_sleep(SLEEP_NOTIFICATION)
+
+        pending = PendingNotification.objects.get()
+        self.assertEqual(
+            (pending.start_date, pending.end_date),
+            (
+                datetime(2020, 12, 25, 16, 50, tzinfo=pytz.UTC),
+                datetime(2020, 12, 25, 17, 0, tzinfo=pytz.UTC),
+            ),
+        )
+
+    @patch("connector.tasks.celery_appli_44_sleep")
+    def test_overdue_notifications_are_enqueued_again(self, patched_task):
+        debounce_notification(SLEEP_NOTIFICATION)
+        PendingNotification.objects.update(due_at=timezone.now() - timedelta(hours=1))
+        with patch.dict("connector.tasks.NOTIFICATION_TASKS", {44: patched_task}):
+            celery_resume_fetch_jobs()
+        patched_task.delay.assert_called_once_with({"userid": 123, "appli": 44})
+
+    @patch("connector.views.celery_appli_44_sleep")
+    def test_the_view_enqueues_one_task_per_burst(self, patched_task):
+        for _ in range(3):
+            response = self.client.post(
+                "/connector/",
+                "userid=123&appli=44&startdate=1608915000&enddate=1608915600",
+                content_type="application/x-www-form-urlencoded",
+            )
+            self.assertEqual(response.status_code, 200)
+        patched_task.apply_async.assert_called_once()
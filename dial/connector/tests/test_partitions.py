@@ -0,0 +1,63 @@
+from datetime import datetime
+from io import StringIO
+
+import pytz
+from django.core.management import call_command, CommandError
+from django.db import connection
+
+from ._utils import DialTestBase
+from ..models import ActivityRaw
+from ..utils.partitions import create_partitions, get_partitions
+
+TABLE = "connector_activityraw"
+
+
+class PartitionsTestCase(DialTestBase):
+    def make_activity(self, measured_at: datetime) -> ActivityRaw:
+        return ActivityRaw.objects.create(
+            device_type="tracker",
+            device_id=1,
+            user=self.user,
+            measured_at=measured_at,
+            duration=60,
+            steps=10,
+        )
+
+    def partition_of(self, activity: ActivityRaw) -> str:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT tableoid::regclass::text FROM {TABLE} WHERE id = %s",
+                [activity.id],
+            )
+            return cursor.fetchone()[0]
+
+    def test_rows_are_moved_out_of_the_default_partition(self):
+        activity = self.make_activity(datetime(2015, 3, 10, tzinfo=pytz.utc))
+        self.assertEqual(self.partition_of(activity), f"{TABLE}_default")
+
+        created = create_partitions(months_ahead=0)
+
+        self.assertIn(f"{TABLE}_y2015m03", created)
+        self.assertEqual(self.partition_of(activity), f"{TABLE}_y2015m03")
+        self.assertEqual(ActivityRaw.objects.count(), 1)
+        self.assertEqual(create_partitions(months_ahead=0), [])
+
+    def test_range_queries_are_pruned_to_one_partition(self):
+        output = StringIO()
+        call_command("create_partitions", "--from", "2015-01", stdout=output)
+        self.assertIn("partition(s) created", output.getvalue())
+        self.assertIn(f"{TABLE}_y2015m06", get_partitions(TABLE))
+        queryset = ActivityRaw.objects.filter(
+            measured_at__gte=datetime(2015, 6, 2, tzinfo=pytz.utc),
+            measured_at__lt=datetime(2015, 6, 3, tzinfo=pytz.utc),
+        )
+
+        plan = queryset.explain()
+
+        self.assertIn(f"{TABLE}_y2015m06", plan)
+        self.assertNotIn(f"{TABLE}_y2015m05", plan)
+        self.assertNotIn(f"{TABLE}_default", plan)
+
+    def test_command_rejects_invalid_month(self):
+        with self.assertRaises(CommandError):
+            call_command("create_partitions", "--from", "June")
@@ -0,0 +1,99 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.utils import timezone
+
+from ._utils import DialTestBase
+from ..models import RateLimitBucket
+from ..utils import rate_limit
+
+MEASURE_ENDPOINT = "https://wbsapi.withings.net/v2/measure"
+
+
+class RateLimitTestCase(DialTestBase):
+    def setUp(self):
+        super().setUp()
+        self.limits = {"*": 60, "measure": 30}
+
+    def test_parse_rate_limits(self):
+        self.assertEqual(
+            rate_limit.parse_rate_limits("*:120, sleep:60,measure:0"),
+            {"*": 120, "sleep": 60},
+        )
+
+    def test_endpoint_bucket_name(self):
+        self.assertEqual(rate_limit.endpoint_bucket_name(MEASURE_ENDPOINT), "measure")
+
+    def test_tokens_are_taken_from_global_and_endpoint_buckets(self):
+        with patch.dict(rate_limit.WITHINGS_RATE_LIMITS, self.limits):
+            waited = rate_limit.acquire(MEASURE_ENDPOINT)
+            rate_limit.acquire("https://wbsapi.withings.net/v2/sleep")
+
+        self.assertEqual(waited, 0)
+        self.assertEqual(RateLimitBucket.objects.get(name="*").requests, 2)
+        measure_bucket = RateLimitBucket.objects.get(name="measure")
+        self.assertEqual(measure_bucket.requests, 1)
+        self.assertEqual(measure_bucket.refill_rate, 0.5)
+        self.assertFalse(RateLimitBucket.objects.filter(name="sleep").exists())
+
+    def test_empty_bucket_waits_for_refill(self):
+        clock = {"now": timezone.now()}
+
+        def fake_sleep(seconds):
+            clock["now"] += timedelta(seconds=seconds)
+
+        RateLimitBucket.objects.create(
+            name="*", tokens=0.5, capacity=10, refill_rate=1, updated_at=clock["now"]
+        )
+        with patch.dict(rate_limit.WITHINGS_RATE_LIMITS, {"*": 60}), patch(
+            "connector.utils.rate_limit.timezone.now", lambda: clock["now"]
+        ), patch("connector.utils.rate_limit.time.sleep", side_effect=fake_sleep):
+            waited = rate_limit.acquire(MEASURE_ENDPOINT)
+
+        self.assertAlmostEqual(waited, 0.5)
+        bucket = RateLimitBucket.objects.get(name="*")
+        self.assertEqual(bucket.requests, 1)
+        self.assertEqual(bucket.delayed_requests, 1)
+        self.assertAlmostEqual(bucket.total_wait, 0.5)
+        self.assertEqual(rate_limit.get_rate_limit_stats()["*"]["delayed_requests"], 1)
+
+    def test_a_blocked_caller_does_not_use_up_the_global_bucket(self):
+        clock = {"now": timezone.now()}
+
+        def fake_sleep(seconds):
+            clock["now"] += timedelta(seconds=seconds)
+
+        RateLimitBucket.objects.create(
+            name="*", tokens=10, capacity=10, refill_rate=1, updated_at=clock["now"]
+        )
+        RateLimitBucket.objects.create(
+            name="measure",
+            tokens=0,
+            capacity=10,
+            refill_rate=0.5,
+            updated_at=clock["now"],
+        )
+        with patch.dict(rate_limit.WITHINGS_RATE_LIMITS, self.limits), patch(
+            "connector.utils.rate_limit.timezone.now", lambda: clock["now"]
+        ), patch("connector.utils.rate_limit.time.sleep", side_effect=fake_sleep):
+            waited = rate_limit.acquire(MEASURE_ENDPOINT)
+
+        self.assertAlmostEqual(waited, 2)
+        global_bucket = RateLimitBucket.objects.get(name="*")
+        self.assertEqual((global_bucket.requests, global_bucket.tokens), (1, 9))
+        self.assertEqual(global_bucket.delayed_requests, 0)
+        self.assertEqual(
+            RateLimitBucket.objects.get(name="measure").delayed_requests, 1
+        )
+
+    def test_a_reserve_is_left_to_the_other_callers(self):
+        now = timezone.now()
+        RateLimitBucket.objects.create(
+            name="*", tokens=5.5, capacity=10, refill_rate=1, updated_at=now
+        )
+        with patch.dict(rate_limit.WITHINGS_RATE_LIMITS, {"*": 60}), patch(
+            "connector.utils.rate_limit.timezone.now", return_value=now
+        ):
+            # half of the bucket is kept back, one more token is needed
+            self.assertEqual(rate_limit.take_tokens({"*": 60}, reserve=0.5), (0.5, "*"))
+            self.assertEqual(rate_limit.take_tokens({"*": 60}), (0, None))
@@ -0,0 +1,114 @@
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytz
+
+from ._utils import DialTestBase
+from ..models import ActivityColdDay, ActivityDaily, ActivityHourly, ActivityRaw
+from ..utils.partitions import create_partitions, drop_partitions, get_partitions
+from ..utils.retention import enforce_retention
+
+TABLE = "connector_activityraw"
+NOW = datetime(2015, 6, 15, 12, 0, tzinfo=pytz.utc)
+
+
+@patch("connector.utils.rollups.ACTIVITY_RAW_RETENTION_DAYS", 30)
+@patch("connector.utils.retention.RETENTION_BATCH_SIZE", 2)
+class RetentionTestCase(DialTestBase):
+    def make_activity(
+        self, measured_at: datetime, steps: int, heart_rate: int = None
+    ) -> ActivityRaw:
+        return ActivityRaw.objects.create(
+            device_type="tracker",
+            device_id=1,
+            user=self.user,
+            measured_at=measured_at,
+            duration=60,
+            steps=steps,
+            heart_rate=heart_rate,
+        )
+
+    def test_old_raw_data_is_replaced_by_rollups(self):
+        create_partitions(months_ahead=0, start=datetime(2015, 4, 1, tzinfo=pytz.utc))
+        # a whole old partition, one in the default partition and some spread
+        # around the cutoff (2015-05-16)
+        april = datetime(2015, 4, 10, 8, 0, tzinfo=pytz.utc)
+        for minutes in range(3):
+            self.make_activity(april + timedelta(minutes=minutes), steps=10)
+        self.make_activity(datetime(2014, 1, 1, tzinfo=pytz.utc), steps=5)
+        for day in range(14, 19):
+            for minutes in range(3):
+                self.make_activity(
+                    datetime(2015, 5, day, tzinfo=pytz.utc)
+                    + timedelta(minutes=minutes),
+                    steps=1,
+                )
+
+        reclaimed = enforce_retention(now=NOW)
+
+        self.assertEqual(reclaimed["dropped_partitions"], {f"{TABLE}_y2015m04": 3})
+        self.assertNotIn(f"{TABLE}_y2015m04", get_partitions(TABLE))
+        self.assertEqual(reclaimed["deleted_rows"], 1 + 2 * 3)
+        self.assertEqual(reclaimed["rolled_up_hours"], 4)
+        self.assertEqual(
+            ActivityRaw.objects.order_by("measured_at").first().measured_at,
+            datetime(2015, 5, 16, tzinfo=pytz.utc),
+        )
+        self.assertEqual(
+            ActivityHourly.objects.get(metric="steps", bucket=april).sum, 30
+        )
+        self.assertEqual(
+            ActivityDaily.objects.get(
+                metric="steps", bucket=datetime(2015, 5, 14, tzinfo=pytz.utc)
+            ).count,
+            3,
+        )
+
+        # nothing left to do, the rollups are not touched again
+        self.assertEqual(
+            enforce_retention(now=NOW),
+            {"rolled_up_hours": 0, "dropped_partitions": {}, "deleted_rows": 0},
+        )
+        self.assertEqual(
+            ActivityHourly.objects.get(metric="steps", bucket=april).sum, 30
+        )
+
+    @patch("connector.utils.rollups.refresh_activity_rollups")
+    def test_missing_rollups_are_made_once_per_day(self, patched_refresh):
+        for day in (1, 2):
+            for hour in range(3):
+                self.make_activity(
+                    datetime(2015, 5, day, hour, tzinfo=pytz.utc), steps=1
+                )
+        self.assertEqual(enforce_retention(now=NOW)["rolled_up_hours"], 6)
+        self.assertEqual(
+            [call.args[1:] for call in patched_refresh.call_args_list],
+            [
+                (
+                    datetime(2015, 5, day, tzinfo=pytz.utc),
+                    datetime(2015, 5, day, 2, tzinfo=pytz.utc),
+                )
+                for day in (1, 2)
+            ],
+        )
+
+    def test_heart_rate_is_compacted_before_it_expires(self):
+        create_partitions(months_ahead=0, start=datetime(2015, 4, 1, tzinfo=pytz.utc))
+        april = datetime(2015, 4, 10, 8, 0, tzinfo=pytz.utc)
+        for minutes in range(3):
+            self.make_activity(april + timedelta(minutes=minutes), 10, heart_rate=60)
+
+        enforce_retention(now=NOW)
+
+        self.assertEqual(ActivityColdDay.objects.get().points, 3)
+        self.assertEqual(
+            ActivityHourly.objects.get(metric="heart_rate", bucket=april).count, 3
+        )
+
+    def test_partitions_with_rows_to_keep_are_not_dropped(self):
+        create_partitions(months_ahead=0, start=datetime(2015, 4, 1, tzinfo=pytz.utc))
+        self.make_activity(datetime(2015, 4, 10, tzinfo=pytz.utc), 10, heart_rate=60)
+
+        dropped = drop_partitions(TABLE, NOW, keep="heart_rate IS NOT NULL")
+        self.assertNotIn(f"{TABLE}_y2015m04", dropped)
+        self.assertIn(f"{TABLE}_y2015m04", get_partitions(TABLE))
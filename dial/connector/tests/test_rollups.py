@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta
+from io import StringIO
+from unittest.mock import patch
+
+import pytz
+from django.core.management import call_command
+
+from ._utils import DialTestBase
+from ..models import ActivityDaily, ActivityHourly, ActivityRaw
+from ..utils.cold_storage import compact_activities
+from ..utils.rollups import refresh_activity_rollups
+
+START = datetime(2021, 3, 1, 10, 0, tzinfo=pytz.utc)
+
+
+@patch("connector.utils.rollups.ACTIVITY_RAW_RETENTION_DAYS", 0)
+class ActivityRollupsTestCase(DialTestBase):
+    def make_activity(self, minutes: int, **kwargs) -> ActivityRaw:
+        fields = dict(
+            device_type="tracker",
+            device_id=1,
+            user=self.user,
+            measured_at=START + timedelta(minutes=minutes),
+            duration=60,
+        )
+        fields.update(kwargs)
+        return ActivityRaw.objects.create(**fields)
+
+    def rollup(self, model, metric: str, bucket: datetime) -> tuple:
+        return model.objects.filter(metric=metric, bucket=bucket).values_list(
+            "sum", "min", "max", "avg", "count"
+        )[0]
+
+    def test_touched_buckets_are_refreshed(self):
+        self.make_activity(0, steps=10)
+        self.make_activity(30, steps=30)
+        self.make_activity(60, steps=5)
+        self.make_activity(61, heart_rate=60)
+        refresh_activity_rollups(self.user, START, START + timedelta(minutes=61))
+
+        self.assertEqual(
+            self.rollup(ActivityHourly, "steps", START), (40, 10, 30, 20, 2)
+        )
+        self.assertEqual(
+            self.rollup(ActivityHourly, "heart_rate", START + timedelta(hours=1)),
+            (60, 60, 60, 60, 1),
+        )
+        day = START.replace(hour=0)
+        self.assertEqual(self.rollup(ActivityDaily, "steps", day), (45, 5, 30, 15, 3))
+
+        # only the second hour changes, the day is recomputed from both hours
+        ActivityRaw.objects.filter(measured_at=START + timedelta(minutes=61)).delete()
+        refresh_activity_rollups(
+            self.user, START + timedelta(minutes=61), START + timedelta(minutes=61)
+        )
+        self.assertFalse(ActivityHourly.objects.filter(metric="heart_rate").exists())
+        self.assertFalse(ActivityDaily.objects.filter(metric="heart_rate").exists())
+        self.assertEqual(self.rollup(ActivityDaily, "steps", day), (45, 5, 30, 15, 3))
+
+    def test_buckets_without_all_their_raw_data_are_kept(self):
+        self.make_activity(0, steps=10, heart_rate=60)
+        self.make_activity(1, steps=20, heart_rate=70)
+        refresh_activity_rollups(self.user, START, START)
+        compact_activities(now=START + timedelta(days=8))
+
+        # the heart rate of the compacted day is only in the cold storage now
+        ActivityRaw.objects.filter(measured_at=START).update(steps=15)
+        refresh_activity_rollups(self.user, START, START + timedelta(minutes=1))
+        self.assertEqual(
+            self.rollup(ActivityHourly, "heart_rate", START), (130, 60, 70, 65, 2)
+        )
+        self.assertEqual(
+            self.rollup(ActivityHourly, "steps", START), (35, 15, 20, 17.5, 2)
+        )
+
+        # and past the retention nothing is left of the raw data
+        ActivityRaw.objects.all().delete()
+        with patch("connector.utils.rollups.ACTIVITY_RAW_RETENTION_DAYS", 90):
+            refresh_activity_rollups(self.user, START, START + timedelta(minutes=1))
+        self.assertEqual(
+            self.rollup(ActivityHourly, "steps", START), (35, 15, 20, 17.5, 2)
+        )
+        self.assertEqual(
+            self.rollup(ActivityDaily, "steps", START.replace(hour=0)),
+            (35, 15, 20, 17.5, 2),
+        )
+
+    def test_rebuild_command(self):
+        self.make_activity(0, steps=10)
+        self.make_activity(2 * 24 * 60, steps=20)
+        out = StringIO()
+        call_command("rebuild_activity_rollups", user=self.user.user_id, stdout=out)
+
+        self.assertIn("Done", out.getvalue())
+        self.assertEqual(
+            list(ActivityDaily.objects.order_by("bucket").values_list("bucket", "sum")),
+            [
+                (START.replace(hour=0), 10),
+                (START.replace(hour=0) + timedelta(days=2), 20),
+            ],
+        )
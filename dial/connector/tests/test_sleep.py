@@ -1,3 +1,19 @@
+import json
+from datetime import datetime
+from unittest.mock import patch, MagicMock
+
+import pytz
+
+from ._utils import DialTestBase
+from .fake_responses import FAKE_SLEEP_RAW_RESPONSE
+from ..models import SleepRaw, SleepSignal
+from ..utils.db import upsert
+from ..utils.sleep import (
+    SLEEP_SIGNAL_KEY_FIELDS,
+    build_sleep_signals,
+    get_sleep_data_raw,
+)
+
 # from datetime import datetime
 # from unittest.mock import patch
 #
@@ -85,3 +101,55 @@
 #     #         self.assertEqual(obs, exp)
 #     #     for obs, exp in zip(sleep.snoring_series, generate_series([0, 1, 2])):
 #     #         self.assertEqual(obs, exp)
+
+
+class SleepRawTestCase(DialTestBase):
+    @patch("connector.utils.client.post")
+    def test_sleep_raw_points_are_stored_per_signal(self, patched_post):
+        request_response = MagicMock()
+        request_response.text = json.dumps(FAKE_SLEEP_RAW_RESPONSE)
+        request_response.status_code = 200
+        patched_post.return_value = request_response
+
+        for _ in range(2):
+            obs_counter = get_sleep_data_raw(
+                access_token=self.fake_token,
+                user_id=self.user.user_id,
+                start_date=datetime(2020, 12, 8, tzinfo=pytz.utc),
+                end_date=datetime(2020, 12, 9, tzinfo=pytz.utc),
+            )
+        self.assertEqual(obs_counter, 0)
+
+        self.assertEqual(SleepRaw.objects.count(), 3)
+        self.assertEqual(SleepSignal.objects.count(), 3 * 13)
+        hr = SleepSignal.objects.filter(signal="hr").order_by("ts")
+        self.assertEqual(
+            [(point.ts.timestamp(), point.value) for point in hr[:2]],
+            [(1607385600, 52), (1607385660, 51)],
+        )
+
+    def test_points_of_different_devices_are_kept_apart(self):
+        start_date = datetime(2020, 12, 8, tzinfo=pytz.utc)
+        signals = []
+        for device_type, device_id, value in (
+            ("SLEEP_MONITOR", 1, 52),
+            ("32", 2, 60),
+        ):
+            sleep_raw = SleepRaw(
+                device_type=device_type,
+                device_id=device_id,
+                user=self.user,
+                start_date=start_date,
+                end_date=start_date,
+                sleep_phase="LIGHT",
+                sleep_phase_id=1,
+                hr_timestamps=[int(start_date.timestamp())],
+                hr_values=[value],
+            )
+            signals.extend(build_sleep_signals(sleep_raw))
+        upsert(SleepSignal, signals, SLEEP_SIGNAL_KEY_FIELDS)
+
+        self.assertEqual(
+            sorted(SleepSignal.objects.values_list("device_type", "value")),
+            [("32", 60), ("SLEEP_MONITOR", 52)],
+        )
@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytz
+
+from ._utils import DialTestBase
+from ..models import APIUser, SyncCursor, Weight
+from ..utils.common import resolve_date_range
+from ..utils.measurements import get_measurements
+from ..utils.sync import advance_sync_cursor, get_sync_cursor
+
+DAY = datetime(2021, 3, 1, tzinfo=pytz.utc)
+
+
+class SyncCursorTestCase(DialTestBase):
+    def make_weight(self, user: APIUser, measured_at: datetime) -> Weight:
+        return Weight.objects.create(
+            device_id="scale",
+            user=user,
+            measured_at=measured_at,
+            source="MEASURE_AUTO",
+            weight=70,
+        )
+
+    def test_notifications_resume_from_the_users_own_cursor(self):
+        other_user = APIUser.objects.create(
+            first_name="Other",
+            last_name="User",
+            email="other@user.com",
+            user_id=456,
+            demo=False,
+            height=1.8,
+        )
+        self.make_weight(self.user, DAY)
+        self.make_weight(other_user, DAY + timedelta(days=10))
+
+        # no cursor yet - the user's last entry, whatever the other users did
+        start_date, _ = resolve_date_range(
+            Weight, self.user, "getmeas", None, None, True
+        )
+        self.assertEqual(start_date, DAY)
+
+        advance_sync_cursor(self.user, Weight, "getmeas", DAY, DAY + timedelta(hours=5))
+        start_date, _ = resolve_date_range(
+            Weight, self.user, "getmeas", None, None, True
+        )
+        self.assertEqual(start_date, DAY + timedelta(hours=5))
+
+    def test_the_cursor_only_advances_over_adjacent_windows(self):
+        advance_sync_cursor(self.user, Weight, "getmeas", DAY, DAY + timedelta(days=1))
+        # a window past a gap and an older one are both ignored
+        self.assertFalse(
+            advance_sync_cursor(
+                self.user,
+                Weight,
+                "getmeas",
+                DAY + timedelta(days=3),
+                DAY + timedelta(days=4),
+            )
+        )
+        self.assertFalse(advance_sync_cursor(self.user, Weight, "getmeas", DAY, DAY))
+        self.assertTrue(
+            advance_sync_cursor(
+                self.user,
+                Weight,
+                "getmeas",
+                DAY + timedelta(hours=12),
+                DAY + timedelta(days=2),
+            )
+        )
+        self.assertEqual(
+            get_sync_cursor(self.user, Weight, "getmeas"), DAY + timedelta(days=2)
+        )
+        self.assertIsNone(get_sync_cursor(self.user, Weight, "getsummary"))
+
+    def test_the_cursor_does_not_pass_now(self):
+        now = datetime.now(pytz.utc)
+        advance_sync_cursor(self.user, Weight, "getmeas", now, now + timedelta(days=1))
+        self.assertLessEqual(
+            SyncCursor.objects.get().synced_until, now + timedelta(seconds=5)
+        )
+
+    @patch("connector.utils.measurements.iterate_pages")
+    def test_manual_requests_with_naive_dates(self, patched_pages):
+        patched_pages.return_value = [{"measuregrps": [], "more": False}]
+        get_measurements(
+            self.fake_token,
+            self.user.user_id,
+            datetime(2021, 3, 1),
+            datetime(2021, 3, 2),
+            "weight",
+        )
+        self.assertEqual(
+            get_sync_cursor(self.user, Weight, "getmeas"), DAY + timedelta(days=1)
+        )
@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta
+
+import pytz
+
+from ._utils import DialTestBase
+from ..models import Weight, WeightTrend
+from ..utils.trends import update_weight_trends
+
+START = datetime(2021, 3, 1, 7, 0, tzinfo=pytz.utc)
+
+
+class WeightTrendsTestCase(DialTestBase):
+    def make_weight(self, day: int, weight: float, **kwargs) -> Weight:
+        return Weight.objects.create(
+            device_id="scale",
+            user=self.user,
+            measured_at=START + timedelta(days=day),
+            source="MEASURE_AUTO",
+            weight=weight,
+            **kwargs,
+        )
+
+    def trends(self, metric: str) -> list:
+        return list(
+            WeightTrend.objects.filter(metric=metric)
+            .order_by("measured_at")
+            .values_list("value", "avg_7", "avg_14", "ewma")
+        )
+
+    def test_trends_are_computed_per_sample(self):
+        for day in range(8):
+            self.make_weight(day, 70 + day)
+        self.make_weight(8, 80, muscle_mass=30, fat_mass_weight=0)
+        update_weight_trends(self.user)
+
+        weights = self.trends("weight")
+        self.assertEqual(len(weights), 9)
+        self.assertEqual(weights[0], (70, 70, 70, 70))
+        # the last 7 samples and all 9 samples so far
+        self.assertEqual(
+            weights[8][1:3],
+            (
+                sum([72, 73, 74, 75, 76, 77, 80]) / 7,
+                sum([70, 71, 72, 73, 74, 75, 76, 77, 80]) / 9,
+            ),
+        )
+        self.assertAlmostEqual(weights[1][3], 70 + 2 / 11)
+        self.assertEqual(self.trends("muscle_ratio"), [(37.5, 37.5, 37.5, 37.5)])
+        # no ratio for a zero fat mass
+        self.assertEqual(self.trends("muscle_fat_ratio"), [])
+
+    def test_only_new_samples_are_computed(self):
+        for day in range(10):
+            self.make_weight(day, 70 + day)
+        update_weight_trends(self.user)
+        first_trends = self.trends("weight")
+
+        new_weight = self.make_weight(10, 60)
+        written = update_weight_trends(self.user, since=new_weight.measured_at)
+        self.assertEqual(written, 1)
+
+        trends = self.trends("weight")
+        self.assertEqual(trends[:10], first_trends)
+        self.assertEqual(trends[10][1], sum([74, 75, 76, 77, 78, 79, 60]) / 7)
+        self.assertAlmostEqual(trends[10][3], 2 / 11 * 60 + 9 / 11 * first_trends[9][3])
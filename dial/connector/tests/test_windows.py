@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+import pytz
+
+from ..utils.windows import WindowPlanner, DENSE_RESPONSE_ENTRIES
+
+
+class WindowPlannerTestCase(TestCase):
+    def setUp(self):
+        self.start_date = datetime(2020, 1, 1, 9, 0, tzinfo=pytz.UTC)
+        self.end_date = datetime(2021, 1, 1, 9, 0, tzinfo=pytz.UTC)
+
+    def test_one_year_backfill(self):
+        planner = WindowPlanner("getactivity", self.start_date, self.end_date)
+        self.assertEqual(planner.planned_calls, 12)
+        windows = list(planner)
+        self.assertEqual(len(windows), 12)
+        self.assertEqual(planner.calls, 12)
+        self.assertEqual(windows[0][0], self.start_date)
+        self.assertEqual(windows[-1][1], self.end_date)
+        for (_, prev_end), (next_start, _) in zip(windows, windows[1:]):
+            self.assertEqual(prev_end, next_start)
+
+    def test_raw_action_uses_single_days(self):
+        planner = WindowPlanner("get", self.start_date, self.end_date)
+        self.assertEqual(planner.planned_calls, 366)
+
+    def test_short_range_is_extended_to_a_day(self):
+        planner = WindowPlanner(
+            "getmeas", self.start_date, self.start_date + timedelta(hours=2)
+        )
+        self.assertEqual(
+            list(planner), [(self.start_date, self.start_date + timedelta(days=1))]
+        )
+
+    def test_dense_response_shrinks_window(self):
+        planner = WindowPlanner("getmeas", self.start_date, self.end_date)
+        windows = []
+        for window in planner:
+            if not windows:
+                planner.feedback(DENSE_RESPONSE_ENTRIES)
+            windows.append(window)
+        self.assertEqual(windows[0][1] - windows[0][0], timedelta(days=31))
+        self.assertEqual(windows[1][1] - windows[1][0], timedelta(days=15.5))
+        self.assertEqual(planner.planned_calls, len(windows))
+
+    def test_sparse_response_keeps_window(self):
+        planner = WindowPlanner("getsummary", self.start_date, self.end_date)
+        iterator = iter(planner)
+        next(iterator)
+        planner.feedback(3, more=False)
+        self.assertEqual(planner.span, timedelta(days=31))
+        planner.feedback(3, more=True)
+        self.assertEqual(planner.span, timedelta(days=15.5))
@@ -2,11 +2,21 @@ import os
 from datetime import datetime
 import logging
 
-from django.db import IntegrityError
+import pytz
+from django.db import transaction
 from django.utils.timezone import make_aware
 
 from connector.models import ActivityRaw, ActivitySummary, APIUser
-from connector.utils.common import send_data_request, prepare_date_pairs
+from connector.utils.common import (
+    iterate_pages,
+    prepare_date_pairs,
+    resolve_date_range,
+)
+from connector.utils.db import BulkWriter, CopyWriter
+from connector.utils.fetch_engine import FetchEngine
+from connector.utils.rollups import rebuild_activity_rollups, refresh_activity_rollups
+from connector.utils.sync import advance_sync_cursor
+from connector.utils.windows import WindowPlanner
 
 
 WITHINGS_API_URL = os.environ.get("WITHINGS_API_URL", "https://wbsapi.withings.net/v2")
@@ -40,9 +50,79 @@ ACTIVITY_DATA_FIELDS = [
     "hr_zone_3",
 ]
 DATETIME_FORMAT_ACTIVITY = "%Y-%m-%d"
+ACTIVITY_KEY_FIELDS = ("user", "measured_at", "measurement_type")
+ACTIVITY_RAW_KEY_FIELDS = ("user", "measured_at")
 LOGGER = logging.getLogger(__name__)
 
 
+def build_activity_summary(entry: dict, user: APIUser):
+    if "heart_rate" in entry.keys() or "steps" in entry.keys():
+        measurement_type = "heart_rate" if "heart_rate" in entry.keys() else "steps"
+    else:
+        LOGGER.debug("No steps or heart rate found in the data - skipping...")
+        return None
+    entry_date = datetime.strptime(entry.get("date"), DATETIME_FORMAT_ACTIVITY)
+    measurement_time = make_aware(entry_date)
+
+    if measurement_type == "steps":
+        distance = entry.get("distance")
+        elevation = entry.get("elevation")
+        calories = entry.get("calories")
+        steps = entry.get("steps")
+    else:
+        distance, elevation, calories, steps = None, None, None, None
+
+    return ActivitySummary(
+        device_type="unknown" if not entry.get("brand") else entry.get("brand"),
+        device_id=0 if not entry.get("deviceid", 0) else entry.get("deviceid", 0),
+        user=user,
+        measured_at=measurement_time,
+        measurement_type=measurement_type,
+        is_tracker=entry.get("is_tracker"),
+        steps=steps,
+        distance=distance,
+        elevation=elevation,
+        calories=calories,
+        soft_activities_duration=entry.get("soft"),
+        moderate_activities_duration=entry.get("moderate"),
+        intense_activities_duration=entry.get("intense"),
+        active_duration=entry.get("active"),
+        total_calories=entry.get("totalcalories"),
+        hr_average=entry.get("hr_average"),
+        hr_min=entry.get("hr_min"),
+        hr_max=entry.get("hr_max"),
+        hr_zone_light_duration=entry.get("hr_zone_0"),
+        hr_zone_moderate_duration=entry.get("hr_zone_1"),
+        hr_zone_intense_duration=entry.get("hr_zone_2"),
+        hr_zone_max_duration=entry.get("hr_zone_3"),
+    )
+
+
+def build_activity_raw(ts: str, entry: dict, user: APIUser):
+    # one row per timestamp, carrying whatever the devices measured at that time
+    if not any(entry.get(field) is not None for field in ACTIVITY_DATA_FIELDS_INTRADAY):
+        LOGGER.debug("No activity data found in the entry - skipping...")
+        return None
+    measurement_time = make_aware(datetime.fromtimestamp(int(ts)))
+    LOGGER.debug(f"Measurement time: %s", measurement_time)
+
+    return ActivityRaw(
+        device_type="unknown" if not entry.get("model") else entry.get("model",),
+        device_id=0 if not entry.get("model_id") else entry.get("model_id"),
+        user=user,
+        measured_at=measurement_time,
+        steps=entry.get("steps"),
+        duration=entry.get("duration"),
+        distance=entry.get("distance"),
+        elevation=entry.get("elevation"),
+        calories=entry.get("calories"),
+        heart_rate=entry.get("heart_rate"),
+        spo2_auto=entry.get("spo2_auto"),
+        stroke=entry.get("stroke"),
+        pool_lap=entry.get("pool_lap"),
+    )
+
+
 def get_activity_summary(
     access_token: str,
     user_id: int,
@@ -50,16 +130,19 @@ def get_activity_summary(
     end_date: datetime,
     offset: int = None,
     from_notification: bool = False,
+    rate_reserve: float = 0.0,
 ) -> int:
 
-    date_pairs = prepare_date_pairs(
-        ActivitySummary, start_date, end_date, from_notification
-    )
     user = APIUser.objects.get(user_id=user_id)
     # TODO: raise an error if user not found
+    start_date, end_date = resolve_date_range(
+        ActivitySummary, user, "getactivity", start_date, end_date, from_notification
+    )
+    planner = WindowPlanner("getactivity", start_date, end_date)
+    LOGGER.info("Planned %s activity summary request(s).", planner.planned_calls)
 
     counter = 0
-    for sub_start_date, sub_end_date in date_pairs:
+    for sub_start_date, sub_end_date in planner:
         req_params = {
             "action": "getactivity",
             "startdateymd": sub_start_date.strftime(DATETIME_FORMAT_ACTIVITY),
@@ -68,75 +151,37 @@ def get_activity_summary(
             "offset": offset,
         }
 
-        data = send_data_request(
-            os.path.join(WITHINGS_API_URL, "measure"), req_params, access_token
-        )
-
-        for entry in data["activities"]:
-            LOGGER.debug(entry)
-            if "heart_rate" in entry.keys() or "steps" in entry.keys():
-                measurement_type = (
-                    "heart_rate" if "heart_rate" in entry.keys() else "steps"
-                )
-            else:
-                LOGGER.debug("No steps or heart rate found in the data - skipping...")
-                continue
-            entry_date = datetime.strptime(entry.get("date"), DATETIME_FORMAT_ACTIVITY)
-            measurement_time = make_aware(entry_date)
-            potential_entry = ActivitySummary.objects.filter(
-                measured_at=measurement_time, measurement_type=measurement_type
-            )
-            if len(potential_entry) == 0:
+        for data in iterate_pages(
+            os.path.join(WITHINGS_API_URL, "measure"),
+            req_params,
+            access_token,
+            rate_reserve,
+        ):
+            planner.feedback(len(data["activities"]), data.get("more", False))
+            activity_summaries = []
+            for entry in data["activities"]:
+                LOGGER.debug(entry)
                 try:
-                    # save raw activity to DB
-                    if measurement_type == "steps":
-                        distance = entry.get("distance")
-                        elevation = entry.get("elevation")
-                        calories = entry.get("calories")
-                        steps = entry.get("steps")
-                    else:
-                        distance, elevation, calories, steps = None, None, None, None
-
-                    new_activity_summary = ActivitySummary(
-                        device_type="unknown"
-                        if not entry.get("brand")
-                        else entry.get("brand"),
-                        device_id=0
-                        if not entry.get("deviceid", 0)
-                        else entry.get("deviceid", 0),
-                        user=user,
-                        measured_at=measurement_time,
-                        measurement_type=measurement_type,
-                        is_tracker=entry.get("is_tracker"),
-                        steps=steps,
-                        distance=distance,
-                        elevation=elevation,
-                        calories=calories,
-                        soft_activities_duration=entry.get("soft"),
-                        moderate_activities_duration=entry.get("moderate"),
-                        intense_activities_duration=entry.get("intense"),
-                        active_duration=entry.get("active"),
-                        total_calories=entry.get("totalcalories"),
-                        hr_average=entry.get("hr_average"),
-                        hr_min=entry.get("hr_min"),
-                        hr_max=entry.get("hr_max"),
-                        hr_zone_light_duration=entry.get("hr_zone_0"),
-                        hr_zone_moderate_duration=entry.get("hr_zone_1"),
-                        hr_zone_intense_duration=entry.get("hr_zone_2"),
-                        hr_zone_max_duration=entry.get("hr_zone_3"),
-                    )
-                    new_activity_summary.save()
-                    counter += 1
-                except IntegrityError as e:
-                    LOGGER.error("An error occurred when writing to the DB: %s.", e)
+                    new_activity_summary = build_activity_summary(entry, user)
                 except KeyError as e:
                     LOGGER.error(
-                        "An error occurred when writing to the DB: %s. Data contents: %s. Datetime: %s",
+                        "An error occurred when writing to the DB: %s. Data contents: %s.",
                         e,
                         entry,
-                        measurement_time,
                     )
                     raise e
+                if new_activity_summary is not None:
+                    activity_summaries.append(new_activity_summary)
+            with transaction.atomic(), BulkWriter(
+                ActivitySummary, ACTIVITY_KEY_FIELDS, time_field="measured_at"
+            ) as writer:
+                for new_activity_summary in activity_summaries:
+                    writer.add(new_activity_summary)
+            counter += writer.written
+        advance_sync_cursor(
+            user, ActivitySummary, "getactivity", sub_start_date, sub_end_date
+        )
+    LOGGER.debug("Made %s activity summary request(s).", planner.calls)
     return counter
 
 
@@ -146,89 +191,113 @@ def get_activity_detailed(
     start_date: datetime,
     end_date: datetime,
     from_notification: bool = False,
+    use_copy: bool = False,
+    rate_reserve: float = 0.0,
 ) -> int:
 
-    date_pairs = prepare_date_pairs(
-        ActivityRaw, start_date, end_date, from_notification
-    )
     user = APIUser.objects.get(user_id=user_id)
     # TODO: raise an error if user not found
+    date_pairs = prepare_date_pairs(
+        ActivityRaw,
+        user,
+        "getintradayactivity",
+        start_date,
+        end_date,
+        from_notification,
+    )
 
     counter = 0
     skipped_counter = 0
-    for sub_start_date, sub_end_date in date_pairs:
-        req_params = {
+    windows = [
+        {
             "action": "getintradayactivity",
             "startdate": int(sub_start_date.timestamp()),
             "enddate": int(sub_end_date.timestamp()),
             "data_fields": ",".join(ACTIVITY_DATA_FIELDS_INTRADAY),
         }
-
-        data = send_data_request(
-            os.path.join(WITHINGS_API_URL, "measure"), req_params, access_token
-        )
-
-        # TODO: double check that - is this ts going to work?
-        for ts, entry in data["series"].items():
-            LOGGER.debug(entry)
-            if "heart_rate" in entry.keys() or "steps" in entry.keys():
-                measurement_type = (
-                    "heart_rate" if "heart_rate" in entry.keys() else "steps"
-                )
-            else:
-                LOGGER.debug("No steps or heart rate found in the data - skipping...")
-                skipped_counter += 1
-                continue
-            measurement_time = make_aware(datetime.fromtimestamp(int(ts)))
-            LOGGER.debug(f"Measurement time: %s", measurement_time)
-            potential_entry = ActivityRaw.objects.filter(
-                measured_at=measurement_time, measurement_type=measurement_type
-            )
-            if len(potential_entry) == 0:
+        for sub_start_date, sub_end_date in date_pairs
+    ]
+    # backfills stream all windows through one COPY writer instead of writing
+    # every window in its own transaction
+    copy_writer = CopyWriter(ActivityRaw, ACTIVITY_RAW_KEY_FIELDS) if use_copy else None
+    copied_measured = []
+    engine = FetchEngine(
+        os.path.join(WITHINGS_API_URL, "measure"),
+        access_token,
+        rate_reserve=rate_reserve,
+    )
+    for window, pages in engine.fetch_windows(windows):
+        for data in pages:
+            activities_raw = []
+            # TODO: double check that - is this ts going to work?
+            for ts, entry in data["series"].items():
+                LOGGER.debug(entry)
                 try:
-                    if measurement_type == "steps":
-                        distance = entry.get("distance")
-                        elevation = entry.get("elevation")
-                        calories = entry.get("calories")
-                        steps = entry.get("steps")
-                    else:
-                        distance, elevation = None, None
-                        calories, steps = None, None
-
-                    new_activity_raw = ActivityRaw(
-                        device_type="unknown"
-                        if not entry.get("model")
-                        else entry.get("model",),
-                        device_id=0
-                        if not entry.get("model_id")
-                        else entry.get("model_id"),
-                        user=user,
-                        measured_at=measurement_time,
-                        measurement_type=measurement_type,
-                        steps=steps,
-                        duration=entry.get("duration"),
-                        distance=distance,
-                        elevation=elevation,
-                        calories=calories,
-                        heart_rate=entry.get("heart_rate"),
-                    )
-                    new_activity_raw.save()
-                    counter += 1
-                except IntegrityError as e:
-                    LOGGER.error("An error occurred when writing to the DB: %s.", e)
+                    new_activity_raw = build_activity_raw(ts, entry, user)
                 except KeyError as e:
                     LOGGER.error(
-                        "An error occurred when writing to the DB: %s. Data contents: %s. Datetime: %s",
+                        "An error occurred when writing to the DB: %s. Data contents: %s. Timestamp: %s",
                         e,
                         entry,
-                        measurement_time,
+                        ts,
                     )
                     raise e
-        if skipped_counter > 0:
-            LOGGER.debug(
-                f"Total of {skipped_counter} of of {counter + skipped_counter} entries without "
-                f"heart rate or steps data were found "
+                if new_activity_raw is None:
+                    skipped_counter += 1
+                    continue
+                activities_raw.append(new_activity_raw)
+            if not activities_raw:
+                continue
+            measured = [
+                new_activity_raw.measured_at for new_activity_raw in activities_raw
+            ]
+            if copy_writer is not None:
+                for new_activity_raw in activities_raw:
+                    copy_writer.add(new_activity_raw)
+                copied_measured.extend((min(measured), max(measured)))
+                continue
+            with transaction.atomic():
+                with BulkWriter(
+                    ActivityRaw, ACTIVITY_RAW_KEY_FIELDS, time_field="measured_at"
+                ) as writer:
+                    for new_activity_raw in activities_raw:
+                        writer.add(new_activity_raw)
+                if writer.written:
+                    refresh_activity_rollups(user, min(measured), max(measured))
+            counter += writer.written
+        if copy_writer is None:
+            advance_sync_cursor(
+                user,
+                ActivityRaw,
+                "getintradayactivity",
+                datetime.fromtimestamp(window["startdate"], pytz.utc),
+                datetime.fromtimestamp(window["enddate"], pytz.utc),
+            )
+    if copy_writer is not None:
+        copy_writer.flush()
+        counter += copy_writer.written
+        LOGGER.info(
+            "Copied %s raw activity row(s) in %.2fs (%.0f rows/s).",
+            copy_writer.written,
+            copy_writer.elapsed,
+            copy_writer.rows_per_second,
+        )
+        if copy_writer.written:
+            rebuild_activity_rollups(user, min(copied_measured), max(copied_measured))
+        # the copied rows are only there once the writer is flushed
+        if date_pairs:
+            advance_sync_cursor(
+                user,
+                ActivityRaw,
+                "getintradayactivity",
+                date_pairs[0][0],
+                date_pairs[-1][1],
             )
+    if skipped_counter > 0:
+        LOGGER.debug(
+            f"Total of {skipped_counter} of of {counter + skipped_counter} entries without "
+            f"heart rate or steps data were found "
+        )
     return counter
 
 
@@ -238,6 +307,7 @@ def request_all_activities_data(
     start_date: datetime,
     end_date: datetime,
     from_notification: bool = False,
+    use_copy: bool = False,
 ) -> (int, int):
     activities_raw_counter = get_activity_detailed(
         access_token=access_token,
@@ -245,6 +315,7 @@ def request_all_activities_data(
         start_date=start_date,
         end_date=end_date,
         from_notification=from_notification,
+        use_copy=use_copy,
     )
     activities_summary_counter = get_activity_summary(
         access_token=access_token,
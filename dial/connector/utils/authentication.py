@@ -3,11 +3,11 @@ import json
 import logging
 import os
 
-import requests
 from django.db.models import Q
 from django.utils import timezone
 
 from connector.models import WithingsAuthentication, APIUser
+from connector.utils import client
 
 CLIENT_ID = os.environ.get("CLIENT_ID")
 CLIENT_SECRET = os.environ.get("CLIENT_SECRET")
@@ -111,7 +111,7 @@ def request_new_access_token(code: str):
         "code": code,
         "redirect_uri": CALLBACK_URL,
     }
-    token_response = requests.post(
+    token_response = client.post(
         "https://wbsapi.withings.net/v2/oauth2", data=req_params
     )
 
@@ -164,7 +164,7 @@ def refresh_access_token(valid_refresh_token):
         "grant_type": "refresh_token",
         "refresh_token": valid_refresh_token,
     }
-    token_response = requests.post(
+    token_response = client.post(
         "https://wbsapi.withings.net/v2/oauth2", data=req_params
     )
 
@@ -0,0 +1,119 @@
+import logging
+import os
+from datetime import datetime, timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, Sum
+from django.utils import timezone
+
+from connector.models import FetchJob, RateLimitBucket
+from connector.utils.rate_limit import GLOBAL_BUCKET
+
+LOGGER = logging.getLogger(__name__)
+# where the history of a user starts if no --from is given
+BACKFILL_START_DATE = os.environ.get("BACKFILL_START_DATE", "2009-01-01")
+BACKFILL_CHUNK_DAYS = int(os.environ.get("BACKFILL_CHUNK_DAYS", 30))
+# chunks of one backfill that are queued or running at the same time
+BACKFILL_MAX_IN_FLIGHT = int(os.environ.get("BACKFILL_MAX_IN_FLIGHT", 2))
+BACKFILL_MAX_ATTEMPTS = int(os.environ.get("BACKFILL_MAX_ATTEMPTS", 3))
+# how long a lane waits before it tries a failed chunk again
+BACKFILL_RETRY_SECONDS = int(os.environ.get("BACKFILL_RETRY_SECONDS", 60))
+# share of the global rate limit burst that backfills leave to the
+# notification-triggered fetches
+BACKFILL_RATE_RESERVE = float(os.environ.get("BACKFILL_RATE_RESERVE", 0.5))
+
+
+def quota_wait_seconds(now: datetime = None) -> float:
+    # How long a backfill chunk should wait before it starts, so that it does
+    # not use up the requests the rest of the app needs. 0 if it can go ahead.
+    bucket = RateLimitBucket.objects.filter(name=GLOBAL_BUCKET).first()
+    if bucket is None or bucket.refill_rate <= 0:
+        return 0
+    elapsed = max(((now or timezone.now()) - bucket.updated_at).total_seconds(), 0)
+    tokens = min(bucket.capacity, bucket.tokens + elapsed * bucket.refill_rate)
+    reserve = bucket.capacity * BACKFILL_RATE_RESERVE
+    if tokens >= reserve:
+        return 0
+    return (reserve - tokens) / bucket.refill_rate
+
+
+def start_backfill_lanes(job: FetchJob) -> int:
+    # Every lane is a task that fetches one chunk after the other, and
+    # re-enqueues itself (also with a countdown) until none is left. Returns
+    # how many more can be started next to the lanes of the job still going,
+    # which are counted as started right away.
+    with transaction.atomic():
+        job = FetchJob.objects.select_for_update().get(pk=job.pk)
+        pending = job.chunks.filter(status="pending").count()
+        lanes = max(min(BACKFILL_MAX_IN_FLIGHT - job.lanes, pending), 0)
+        if lanes:
+            job.lanes += lanes
+            job.lanes_seen_at = timezone.now()
+            job.save(update_fields=["lanes", "lanes_seen_at"])
+    return lanes
+
+
+def touch_backfill_lanes(job: FetchJob):
+    # marks the lanes of the job as still going (see stalled_fetch_jobs)
+    FetchJob.objects.filter(pk=job.pk).update(lanes_seen_at=timezone.now())
+
+
+def end_backfill_lane(job: FetchJob):
+    FetchJob.objects.filter(pk=job.pk, lanes__gt=0).update(lanes=F("lanes") - 1)
+
+
+def next_backfill_chunk_id(job: FetchJob):
+    # oldest first, so an interrupted backfill leaves no gaps behind it
+    return (
+        job.chunks.filter(status="pending")
+        .order_by("start_date", "kind")
+        .values_list("id", flat=True)
+        .first()
+    )
+
+
+def backfill_progress(job: FetchJob) -> dict:
+    # Chunk counts, rows so far and the throughput of the finished chunks.
+    # The ETA assumes the remaining chunks go as fast as the finished ones.
+    chunks = job.chunks.all()
+    statuses = dict(
+        chunks.values("status")
+        .annotate(chunks=Count("id"))
+        .values_list("status", "chunks")
+    )
+    finished = chunks.filter(status="done").aggregate(
+        rows=Sum("rows"), first=Min("started_at"), last=Max("finished_at")
+    )
+    total = sum(statuses.values())
+    done = statuses.get("done", 0)
+    remaining = total - done - statuses.get("failed", 0)
+    rows = finished["rows"] or 0
+    elapsed = (finished["last"] - finished["first"]).total_seconds() if done else 0
+    return {
+        "chunks": total,
+        "done": done,
+        "failed": statuses.get("failed", 0),
+        "remaining": remaining,
+        "rows": rows,
+        "rows_per_second": rows / elapsed if elapsed > 0 else 0.0,
+        "eta": timedelta(seconds=round(elapsed / done * remaining))
+        if done and remaining
+        else None,
+    }
+
+
+def log_backfill_progress(job: FetchJob):
+    progress = backfill_progress(job)
+    LOGGER.info(
+        "Backfill %s (%s of %s): %s of %s chunk(s) done, %s failed, %s row(s) "
+        "(%.1f rows/s), ETA %s.",
+        job.pk,
+        job.data_type,
+        job.user,
+        progress["done"],
+        progress["chunks"],
+        progress["failed"],
+        progress["rows"],
+        progress["rows_per_second"],
+        progress["eta"] or "-",
+    )
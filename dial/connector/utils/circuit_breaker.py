@@ -0,0 +1,80 @@
+import logging
+import os
+import threading
+import time
+
+WITHINGS_CIRCUIT_THRESHOLD = int(os.environ.get("WITHINGS_CIRCUIT_THRESHOLD", 5))
+WITHINGS_CIRCUIT_COOLDOWN = float(os.environ.get("WITHINGS_CIRCUIT_COOLDOWN", 60))
+LOGGER = logging.getLogger(__name__)
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        threshold: int = WITHINGS_CIRCUIT_THRESHOLD,
+        cooldown: float = WITHINGS_CIRCUIT_COOLDOWN,
+    ):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        # when the single trial request of the half-open circuit was let through
+        self.probe_started_at = None
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        # Once the cooldown has passed, one trial request goes through
+        # (half-open) while the others keep failing fast. Its success closes
+        # the circuit, its failure re-opens it. A trial that never reports
+        # back is replaced by another one after a further cooldown.
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            now = time.monotonic()
+            if now - self.opened_at < self.cooldown:
+                return False
+            if (
+                self.probe_started_at is not None
+                and now - self.probe_started_at < self.cooldown
+            ):
+                return False
+            self.probe_started_at = now
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                LOGGER.info("Circuit for %s closed again.", self.name)
+            self.failures = 0
+            self.opened_at = None
+            self.probe_started_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.probe_started_at = None
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    LOGGER.warning(
+                        "Circuit for %s opened after %s consecutive failures.",
+                        self.name,
+                        self.failures,
+                    )
+                self.opened_at = time.monotonic()
+
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def reset_circuit_breakers():
+    with _breakers_lock:
+        _breakers.clear()
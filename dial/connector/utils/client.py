@@ -0,0 +1,80 @@
+import logging
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+WITHINGS_POOL_CONNECTIONS = int(os.environ.get("WITHINGS_POOL_CONNECTIONS", 4))
+WITHINGS_POOL_MAXSIZE = int(os.environ.get("WITHINGS_POOL_MAXSIZE", 10))
+WITHINGS_CONNECT_TIMEOUT = float(os.environ.get("WITHINGS_CONNECT_TIMEOUT", 5))
+WITHINGS_READ_TIMEOUT = float(os.environ.get("WITHINGS_READ_TIMEOUT", 30))
+WITHINGS_KEEP_ALIVE = os.environ.get("WITHINGS_KEEP_ALIVE", "true").lower() == "true"
+LOGGER = logging.getLogger(__name__)
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def _build_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=WITHINGS_POOL_CONNECTIONS,
+        pool_maxsize=WITHINGS_POOL_MAXSIZE,
+        pool_block=True,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["Connection"] = "keep-alive" if WITHINGS_KEEP_ALIVE else "close"
+    return session
+
+
+def get_session() -> requests.Session:
+    global _session, _session_pid
+
+    # celery prefork workers inherit the parent's memory - sockets must not be
+    # shared across processes, so each process builds its own pool
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                LOGGER.debug(
+                    "Creating a new Withings HTTP session for process %s.", pid
+                )
+                _session = _build_session()
+                _session_pid = pid
+    return _session
+
+
+def close_session():
+    global _session, _session_pid
+
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session, _session_pid = None, None
+
+
+def post(url: str, data: dict = None, headers: dict = None) -> requests.Response:
+    return get_session().post(
+        url,
+        data=data,
+        headers=headers,
+        timeout=(WITHINGS_CONNECT_TIMEOUT, WITHINGS_READ_TIMEOUT),
+    )
+
+
+def get_pool_stats() -> dict:
+    # number of sockets opened vs requests sent through each pool of this process
+    stats = {}
+    if _session is None or _session_pid != os.getpid():
+        return stats
+    for adapter in set(_session.adapters.values()):
+        for key in adapter.poolmanager.pools.keys():
+            pool = adapter.poolmanager.pools[key]
+            stats[f"{key.key_scheme}://{key.key_host}:{key.key_port}"] = {
+                "connections": pool.num_connections,
+                "requests": pool.num_requests,
+            }
+    return stats
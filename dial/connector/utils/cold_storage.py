@@ -0,0 +1,266 @@
+import logging
+import os
+import zlib
+from datetime import date, datetime, timedelta
+from itertools import groupby
+
+import numpy as np
+import pytz
+from django.db import connection, transaction
+from django.db.models import IntegerField, Q
+
+from connector.models import ActivityColdDay, ActivityRaw, APIUser
+from connector.utils.rollups import (
+    ACTIVITY_COLD_METRICS,
+    day_start,
+    ensure_activity_rollups,
+)
+
+LOGGER = logging.getLogger(__name__)
+# days older than that have their cold metrics (see ACTIVITY_COLD_METRICS)
+# moved from the raw rows to the cold storage, the other values stay in the raw
+# rows (0 disables the compaction)
+ACTIVITY_COLD_AFTER_DAYS = int(os.environ.get("ACTIVITY_COLD_AFTER_DAYS", 7))
+# ActivityRaw columns stored in the compressed values, in this order - new
+# columns are only ever appended, older values simply lack them
+COLD_COLUMNS = (
+    "steps",
+    "duration",
+    "distance",
+    "elevation",
+    "calories",
+    "heart_rate",
+    "spo2_auto",
+    "stroke",
+    "pool_lap",
+)
+
+CLOSED_DAYS_SQL = """
+SELECT DISTINCT user_id, date_trunc('day', measured_at AT TIME ZONE 'UTC')::date
+FROM {raw}
+WHERE measured_at < %s AND ({metrics})
+"""
+
+# Encoding: the timestamps (epoch seconds) are delta-encoded. Every column of
+# the values is stored as a bitmap of its non-null points, followed by those
+# points - integers delta-encoded, floats as they are. Both are zlib-compressed,
+# the deltas of regular samples compress to almost nothing.
+
+
+def _is_integer(column: str) -> bool:
+    return isinstance(ActivityRaw._meta.get_field(column), IntegerField)
+
+
+def encode_timestamps(timestamps: list) -> bytes:
+    deltas = np.diff(np.array(timestamps, dtype=np.int64), prepend=0)
+    return zlib.compress(deltas.tobytes(), 9)
+
+
+def decode_timestamps(data: bytes) -> list:
+    return np.cumsum(np.frombuffer(zlib.decompress(data), dtype=np.int64)).tolist()
+
+
+def encode_values(rows: list) -> bytes:
+    # rows: one {column: value} dict per timestamp
+    chunks = []
+    for column in COLD_COLUMNS:
+        values = [row.get(column) for row in rows]
+        present = [value for value in values if value is not None]
+        mask = np.array([value is not None for value in values], dtype=bool)
+        chunks.append(np.packbits(mask).tobytes())
+        if _is_integer(column):
+            chunks.append(
+                np.diff(np.array(present, dtype=np.int64), prepend=0).tobytes()
+            )
+        else:
+            chunks.append(np.array(present, dtype=np.float64).tobytes())
+    return zlib.compress(b"".join(chunks), 9)
+
+
+def decode_values(data: bytes, points: int) -> list:
+    data = zlib.decompress(data)
+    rows = [{} for _ in range(points)]
+    offset = 0
+    for column in COLD_COLUMNS:
+        if offset >= len(data):
+            # a column appended after these values were encoded
+            for row in rows:
+                row[column] = None
+            continue
+        mask_size = (points + 7) // 8
+        mask = np.unpackbits(np.frombuffer(data, np.uint8, mask_size, offset))[:points]
+        offset += mask_size
+        count = int(mask.sum())
+        if _is_integer(column):
+            present = np.cumsum(np.frombuffer(data, np.int64, count, offset)).tolist()
+        else:
+            present = np.frombuffer(data, np.float64, count, offset).tolist()
+        offset += count * 8
+        present = iter(present)
+        for row, is_present in zip(rows, mask):
+            row[column] = next(present) if is_present else None
+    return rows
+
+
+def decode_cold_day(cold_day: ActivityColdDay) -> list:
+    timestamps = decode_timestamps(bytes(cold_day.timestamps))
+    rows = decode_values(bytes(cold_day.values), cold_day.points)
+    return [
+        ActivityRaw(
+            device_type=cold_day.device_type,
+            device_id=cold_day.device_id,
+            user_id=cold_day.user_id,
+            measured_at=datetime.fromtimestamp(timestamp, pytz.utc),
+            **row,
+        )
+        for timestamp, row in zip(timestamps, rows)
+    ]
+
+
+def _cold_columns() -> tuple:
+    # what is stored of a point - its cold metrics and how long it lasted
+    return ("duration", *ACTIVITY_COLD_METRICS)
+
+
+def _store_cold_day(user: APIUser, day: date, device, rows):
+    # merges with what was compacted before (e.g. if the day was fetched again)
+    device_type, device_id = device
+    cold_day = ActivityColdDay.objects.filter(
+        user=user, day=day, device_type=device_type, device_id=device_id,
+    ).first()
+    points = {}
+    if cold_day is not None:
+        for activity in decode_cold_day(cold_day):
+            points[int(activity.measured_at.timestamp())] = activity
+    for activity in rows:
+        points[int(activity.measured_at.timestamp())] = activity
+
+    timestamps = sorted(points)
+    values = [
+        {column: getattr(points[timestamp], column) for column in _cold_columns()}
+        for timestamp in timestamps
+    ]
+    ActivityColdDay.objects.update_or_create(
+        user=user,
+        day=day,
+        device_type=device_type,
+        device_id=device_id,
+        defaults={
+            "points": len(timestamps),
+            "timestamps": encode_timestamps(timestamps),
+            "values": encode_values(values),
+        },
+    )
+
+
+def _has_cold_metric() -> Q:
+    condition = Q()
+    for metric in ACTIVITY_COLD_METRICS:
+        condition |= Q(**{f"{metric}__isnull": False})
+    return condition
+
+
+def _has_no_value() -> Q:
+    return Q(
+        **{f"{column}__isnull": True for column in COLD_COLUMNS if column != "duration"}
+    )
+
+
+def compact_day(user: APIUser, day: date) -> int:
+    # Moves the cold metrics of one (UTC) day into the cold storage, all in one
+    # transaction. The other values stay in the raw rows, so that the rollups
+    # of the day can still be recomputed - only rows left without any value
+    # are deleted.
+    start = datetime(day.year, day.month, day.day, tzinfo=pytz.utc)
+    day_rows = ActivityRaw.objects.filter(
+        user=user, measured_at__gte=start, measured_at__lt=start + timedelta(days=1),
+    )
+    raw_rows = day_rows.filter(_has_cold_metric())
+    with transaction.atomic():
+        rows = sorted(
+            raw_rows.select_for_update(),
+            key=lambda row: (row.device_type, row.device_id),
+        )
+        for device, group in groupby(
+            rows, key=lambda row: (row.device_type, row.device_id)
+        ):
+            _store_cold_day(user, day, device, list(group))
+        # only the rows read above - rows written since then were not stored
+        compacted = day_rows.filter(pk__in=[row.pk for row in rows])
+        compacted.update(**dict.fromkeys(ACTIVITY_COLD_METRICS))
+        compacted.filter(_has_no_value()).delete()
+    return len(rows)
+
+
+def cold_metrics_condition() -> str:
+    # SQL condition for the raw rows that carry a cold metric - None if the
+    # compaction is disabled
+    if ACTIVITY_COLD_AFTER_DAYS <= 0 or not ACTIVITY_COLD_METRICS:
+        return None
+    qn = connection.ops.quote_name
+    return " OR ".join(
+        f"{qn(ActivityRaw._meta.get_field(metric).column)} IS NOT NULL"
+        for metric in ACTIVITY_COLD_METRICS
+    )
+
+
+def compact_closed_days(before: datetime) -> int:
+    # Moves the days before `before` to the cold storage. Their rollups have
+    # to be made first (see ensure_activity_rollups), as the raw rows are gone
+    # after.
+    metrics = cold_metrics_condition()
+    if metrics is None:
+        return 0
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            CLOSED_DAYS_SQL.format(raw=qn(ActivityRaw._meta.db_table), metrics=metrics),
+            [before],
+        )
+        days = cursor.fetchall()
+    users = APIUser.objects.in_bulk({user_id for user_id, _ in days})
+    compacted = 0
+    for user_id, day in sorted(days):
+        compacted += compact_day(users[user_id], day)
+    LOGGER.info(
+        "Moved %s raw activity row(s) of %s day(s) to the cold storage.",
+        compacted,
+        len(days),
+    )
+    return compacted
+
+
+def compact_activities(now: datetime = None) -> int:
+    # Moves the closed days older than ACTIVITY_COLD_AFTER_DAYS to the cold
+    # storage.
+    if ACTIVITY_COLD_AFTER_DAYS <= 0:
+        return 0
+    cutoff = day_start(
+        (now or datetime.now(pytz.utc)) - timedelta(days=ACTIVITY_COLD_AFTER_DAYS)
+    )
+    ensure_activity_rollups(cutoff)
+    return compact_closed_days(cutoff)
+
+
+def get_activities(user: APIUser, start: datetime, end: datetime) -> list:
+    # The raw activity rows between `start` and `end`, wherever they are stored.
+    # The cold metrics are filled in from the cold storage, points that are
+    # only left there are decoded into (unsaved) ActivityRaw objects.
+    activities = {
+        activity.measured_at: activity
+        for activity in ActivityRaw.objects.filter(
+            user=user, measured_at__gte=start, measured_at__lte=end
+        )
+    }
+    for cold_day in ActivityColdDay.objects.filter(
+        user=user, day__gte=day_start(start).date(), day__lte=day_start(end).date()
+    ):
+        for cold in decode_cold_day(cold_day):
+            if not start <= cold.measured_at <= end:
+                continue
+            activity = activities.setdefault(cold.measured_at, cold)
+            # a value fetched again after the compaction is the newer one
+            for metric in ACTIVITY_COLD_METRICS:
+                if getattr(activity, metric) is None:
+                    setattr(activity, metric, getattr(cold, metric))
+    return sorted(activities.values(), key=lambda activity: activity.measured_at)
@@ -1,18 +1,45 @@
 from datetime import datetime, timedelta
 import json
 import logging
+import os
+import random
+import time
 
 import requests
-from django.core.exceptions import FieldError
-from django.utils.timezone import make_aware
+from django.core.exceptions import FieldDoesNotExist
+from django.utils.timezone import is_naive, make_aware
+
+from connector.utils import client, rate_limit
+from connector.utils.circuit_breaker import get_circuit_breaker
+from connector.utils.sync import get_sync_cursor
 
 
 class APIError(Exception):
     pass
 
 
+class RetryableAPIError(APIError):
+    pass
+
+
+class CircuitOpenError(APIError):
+    pass
+
+
 DATETIME_FORMAT_COMMON = "%Y-%m-%dT%H:%M:%S%z"
 LOGGER = logging.getLogger(__name__)
+WITHINGS_MAX_RETRIES = int(os.environ.get("WITHINGS_MAX_RETRIES", 4))
+WITHINGS_BACKOFF_BASE = float(os.environ.get("WITHINGS_BACKOFF_BASE", 1))
+WITHINGS_BACKOFF_MAX = float(os.environ.get("WITHINGS_BACKOFF_MAX", 60))
+RETRYABLE_HTTP_STATUSES = {429, 500, 502, 503, 504}
+# Withings reports most errors with HTTP 200 and a status in the body:
+# 522 - timeout, 601 - too many requests, 2555 - unknown (server-side) error
+RETRYABLE_API_STATUSES = {522, 601, 2555}
+# notifications announce the window of the new data - it is widened by this
+# margin in case the timestamps of the data and the notification differ
+NOTIFICATION_WINDOW_MARGIN_MINUTES = int(
+    os.environ.get("NOTIFICATION_WINDOW_MARGIN_MINUTES", 30)
+)
 
 
 def parse_dates(start_date: str, end_date: str) -> (str, str):
@@ -32,6 +59,22 @@ def parse_dates(start_date: str, end_date: str) -> (str, str):
     )
 
 
+def notification_window(json_body: dict) -> (datetime, datetime):
+    # (start, end) of the data a Withings notification announces, or
+    # (None, None) if it does not announce any
+    if json_body.get("startdate") and json_body.get("enddate"):
+        margin = timedelta(minutes=NOTIFICATION_WINDOW_MARGIN_MINUTES)
+        return (
+            make_aware(datetime.fromtimestamp(int(json_body["startdate"]))) - margin,
+            make_aware(datetime.fromtimestamp(int(json_body["enddate"]))) + margin,
+        )
+    if json_body.get("date"):
+        # whole days need no margin
+        start_date = make_aware(datetime.strptime(json_body["date"], "%Y-%m-%d"))
+        return start_date, start_date + timedelta(days=1)
+    return None, None
+
+
 def extract_and_parse_dates(request) -> (str, str):
     start_date = request.GET.get("start_date")
     end_date = request.GET.get("end_date")
@@ -39,15 +82,34 @@ def extract_and_parse_dates(request) -> (str, str):
     return start_date, end_date
 
 
-def send_data_request(endpoint: str, params: dict, access_token: str):
-    headers = {"Authorization": f"Bearer {access_token}"}
+def backoff_delay(attempt: int) -> float:
+    # exponential backoff with "full jitter" so that the workers do not retry in sync
+    return random.uniform(
+        0, min(WITHINGS_BACKOFF_MAX, WITHINGS_BACKOFF_BASE * 2 ** attempt)
+    )
+
 
-    response = requests.post(endpoint, data=params, headers=headers,)
+def _post_data_request(
+    endpoint: str, params: dict, headers: dict, rate_reserve: float = 0.0
+) -> dict:
+    rate_limit.acquire(endpoint, rate_reserve)
+    try:
+        response = client.post(endpoint, data=params, headers=headers)
+    except (requests.Timeout, requests.ConnectionError) as e:
+        raise RetryableAPIError(f"Request to {endpoint} failed: {e}")
     LOGGER.debug("Endpoint: %s, params: %s", endpoint, params)
+    if response.status_code in RETRYABLE_HTTP_STATUSES:
+        raise RetryableAPIError(
+            f"API returned error {response.status_code}: {response.reason}"
+        )
     if response.status_code > 300:
         raise APIError(f"API returned error {response.status_code}: {response.reason}")
 
     data = json.loads(response.text)
+    if data["status"] in RETRYABLE_API_STATUSES:
+        raise RetryableAPIError(
+            f"A temporary error ({data['status']}) occurred while fetching data from {endpoint}: {data.get('error')}"
+        )
     if data["status"] != 0:
         raise APIError(
             f"An error occurred while fetching data from {endpoint}. The reason was: {data['error']}"
@@ -55,30 +117,116 @@ def send_data_request(endpoint: str, params: dict, access_token: str):
     return data["body"]
 
 
-def prepare_date_pairs(db_model, start_date, end_date, from_notification):
-    if from_notification:
-        # find the last available entry in the DB
+def send_data_request(
+    endpoint: str, params: dict, access_token: str, rate_reserve: float = 0.0
+):
+    headers = {"Authorization": f"Bearer {access_token}"}
+    breaker = get_circuit_breaker(endpoint)
+
+    attempt = 0
+    while True:
+        if not breaker.allow_request():
+            raise CircuitOpenError(
+                f"Requests to {endpoint} are suspended after repeated failures."
+            )
         try:
-            start_date = (
-                db_model.objects.filter(measured_at__isnull=False)
-                .latest("measured_at")
-                .measured_at
+            body = _post_data_request(endpoint, params, headers, rate_reserve)
+        except RetryableAPIError as e:
+            breaker.record_failure()
+            if attempt >= WITHINGS_MAX_RETRIES:
+                raise
+            delay = backoff_delay(attempt)
+            attempt += 1
+            LOGGER.warning(
+                "%s Retrying in %.1fs (attempt %s of %s).",
+                e,
+                delay,
+                attempt,
+                WITHINGS_MAX_RETRIES,
             )
-        # sleep entries do not have measured_at attribute
-        except FieldError as e:
-            LOGGER.debug("Error: %s - will try to fetch by end date.", e)
-            start_date = (
-                db_model.objects.filter(end_date__isnull=False)
-                .latest("end_date")
-                .end_date
+            time.sleep(delay)
+            continue
+        except APIError:
+            # the API is reachable - the request itself is wrong, do not retry it
+            breaker.record_success()
+            raise
+        breaker.record_success()
+        return body
+
+
+def iterate_pages(
+    endpoint: str, params: dict, access_token: str, rate_reserve: float = 0.0
+):
+    # Withings paginates wide responses with "more"/"offset" - keep requesting
+    # until the last page, yielding one page at a time. `rate_reserve` is the
+    # share of the rate limits left to the other fetches (see
+    # rate_limit.take_tokens).
+    while True:
+        page = send_data_request(endpoint, params, access_token, rate_reserve)
+        yield page
+        if not page.get("more"):
+            break
+        next_offset = page.get("offset")
+        if next_offset is None or next_offset == params.get("offset"):
+            LOGGER.warning(
+                "API reported more data for %s but did not advance the offset (%s).",
+                endpoint,
+                next_offset,
             )
+            break
+        LOGGER.debug("Fetching next page from %s at offset %s.", endpoint, next_offset)
+        params = {**params, "offset": next_offset}
+
+
+def _latest_stored(db_model, user):
+    # where the user's stored data ends - sleep entries do not have a
+    # measured_at attribute
+    try:
+        db_model._meta.get_field("measured_at")
+        date_field = "measured_at"
+    except FieldDoesNotExist:
+        date_field = "start_date"
+    return (
+        db_model.objects.filter(user=user)
+        .order_by(f"-{date_field}")
+        .values_list(date_field, flat=True)
+        .first()
+    )
+
+
+def resolve_date_range(
+    db_model, user, endpoint, start_date, end_date, from_notification
+):
+    if from_notification:
+        # resume from the user's own sync cursor; before the first synced
+        # window, from the last entry of the user in the DB
         end_date = make_aware(datetime.now())
+        start_date = get_sync_cursor(user, db_model, endpoint)
+        if start_date is None:
+            start_date = _latest_stored(db_model, user)
+        if start_date is None:
+            LOGGER.debug("No data of %s found - will fetch the last day.", user)
+            start_date = end_date - timedelta(days=1)
         LOGGER.debug(
             "Request from notification - start and end dates will be reset to %s and %s.",
             start_date.strftime(DATETIME_FORMAT_COMMON),
             end_date.strftime(DATETIME_FORMAT_COMMON),
         )
+    # manual requests may come with naive dates, which cannot be compared with
+    # the sync cursors
+    if is_naive(start_date):
+        start_date = make_aware(start_date)
+    if is_naive(end_date):
+        end_date = make_aware(end_date)
+    return start_date, end_date
+
 
+def prepare_date_pairs(
+    db_model, user, endpoint, start_date, end_date, from_notification
+):
+    start_date, end_date = resolve_date_range(
+        db_model, user, endpoint, start_date, end_date, from_notification
+    )
     time_diff = end_date - start_date
     if int(time_diff.days) > 0:
         time_range = range(int(time_diff.days + 1))
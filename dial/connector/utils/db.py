@@ -0,0 +1,330 @@
+import io
+import logging
+import os
+import time
+
+from django.db import connection, transaction
+from django.db.models import AutoField
+from psycopg2.extras import execute_values
+
+LOGGER = logging.getLogger(__name__)
+DB_WRITER_BATCH_SIZE = int(os.environ.get("DB_WRITER_BATCH_SIZE", 500))
+DB_COPY_BATCH_SIZE = int(os.environ.get("DB_COPY_BATCH_SIZE", 50000))
+# columns that describe the row itself rather than the measurement - they are
+# set on insert and never overwritten by an upsert
+UPSERT_IGNORED_FIELDS = ("reported_at",)
+
+
+def _unique_instances(instances: list, unique_fields: tuple) -> list:
+    # ON CONFLICT cannot touch the same row twice in one statement, so only the
+    # last occurrence of every natural key is kept
+    by_key = {}
+    for instance in instances:
+        key = tuple(
+            getattr(instance, instance._meta.get_field(name).attname)
+            for name in unique_fields
+        )
+        by_key[key] = instance
+    return list(by_key.values())
+
+
+def _insert_fields(model) -> list:
+    return [
+        field
+        for field in model._meta.concrete_fields
+        if not isinstance(field, AutoField)
+    ]
+
+
+def invalid_fields(instance) -> list:
+    # The columns the database would reject the instance for: a missing value
+    # for a NOT NULL column or a string longer than the column. Checked before
+    # the batch is written, so that one bad entry does not abort all the others.
+    invalid = []
+    for field in _insert_fields(type(instance)):
+        if getattr(field, "auto_now", False) or getattr(field, "auto_now_add", False):
+            continue
+        value = getattr(instance, field.attname)
+        if value is None:
+            if not field.null:
+                invalid.append(field.name)
+        elif (
+            field.max_length is not None
+            and isinstance(value, str)
+            and len(value) > field.max_length
+        ):
+            invalid.append(field.name)
+    return invalid
+
+
+def _on_conflict_sql(model, fields: list, unique_fields: tuple) -> str:
+    # ON CONFLICT (natural key) DO UPDATE, touching only the rows whose values
+    # actually changed; (xmax = 0) is true for inserted rows only
+    key_columns = [model._meta.get_field(name).column for name in unique_fields]
+    update_columns = [
+        field.column
+        for field in fields
+        if not field.primary_key
+        and field.column not in key_columns
+        and field.name not in UPSERT_IGNORED_FIELDS
+    ]
+    qn = connection.ops.quote_name
+
+    sql = "ON CONFLICT ({keys})".format(
+        keys=", ".join(qn(column) for column in key_columns)
+    )
+    if update_columns:
+        sql += " DO UPDATE SET {assignments} WHERE ({current}) IS DISTINCT FROM ({new})".format(
+            assignments=", ".join(
+                f"{qn(column)} = EXCLUDED.{qn(column)}" for column in update_columns
+            ),
+            current=", ".join(f"t.{qn(column)}" for column in update_columns),
+            new=", ".join(f"EXCLUDED.{qn(column)}" for column in update_columns),
+        )
+    else:
+        sql += " DO NOTHING"
+    return sql + " RETURNING (xmax = 0)"
+
+
+def drop_existing(
+    model, instances: list, unique_fields: tuple, time_field: str
+) -> list:
+    # Loads the rows already stored within the time range covered by
+    # `instances` in a single query and returns only the instances that are new
+    # or differ from their stored row, so that the overlapping parts of
+    # re-fetched windows are not written again. Duplicates within `instances`
+    # keep the last occurrence.
+    instances = _unique_instances(instances, unique_fields)
+    if not instances:
+        return []
+    key_attnames = [model._meta.get_field(name).attname for name in unique_fields]
+    value_attnames = [
+        field.attname
+        for field in _insert_fields(model)
+        if not field.primary_key
+        and field.attname not in key_attnames
+        and field.name not in UPSERT_IGNORED_FIELDS
+    ]
+    times = [getattr(instance, time_field) for instance in instances]
+    filters = {f"{time_field}__range": (min(times), max(times))}
+    if "user" in unique_fields:
+        filters["user_id__in"] = {instance.user_id for instance in instances}
+    stored = {
+        row[: len(key_attnames)]: row[len(key_attnames) :]
+        for row in model.objects.filter(**filters).values_list(
+            *key_attnames, *value_attnames
+        )
+    }
+    return [
+        instance
+        for instance in instances
+        if stored.get(tuple(getattr(instance, name) for name in key_attnames))
+        != tuple(getattr(instance, name) for name in value_attnames)
+    ]
+
+
+def _count_upserted(results) -> (int, int):
+    inserted = sum(1 for (was_inserted,) in results if was_inserted)
+    return inserted, len(results) - inserted
+
+
+def _prepared_rows(fields: list, instances: list) -> list:
+    return [
+        [
+            field.get_db_prep_save(field.pre_save(instance, True), connection)
+            for field in fields
+        ]
+        for instance in instances
+    ]
+
+
+def upsert(model, instances: list, unique_fields: tuple) -> (int, int):
+    # Writes the instances with a single INSERT ... ON CONFLICT statement.
+    # Returns the number of inserted and updated rows; rows that were already up
+    # to date are not counted.
+    instances = _unique_instances(instances, unique_fields)
+    if not instances:
+        return 0, 0
+    fields = _insert_fields(model)
+    qn = connection.ops.quote_name
+    sql = "INSERT INTO {table} AS t ({columns}) VALUES %s {on_conflict}".format(
+        table=qn(model._meta.db_table),
+        columns=", ".join(qn(field.column) for field in fields),
+        on_conflict=_on_conflict_sql(model, fields, unique_fields),
+    )
+    # explicit casts so that e.g. lists of JSON strings end up as jsonb[]
+    template = "({})".format(
+        ", ".join(f"%s::{field.cast_db_type(connection)}" for field in fields)
+    )
+
+    rows = _prepared_rows(fields, instances)
+    with connection.cursor() as cursor:
+        results = execute_values(
+            cursor, sql, rows, template=template, page_size=len(rows), fetch=True
+        )
+    return _count_upserted(results)
+
+
+def _copy_text(value) -> str:
+    # a single column in PostgreSQL's COPY text format
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        value = "t" if value else "f"
+    elif isinstance(value, (list, tuple)):
+        value = _array_literal(value)
+    else:
+        value = str(value)
+    return (
+        value.replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def _array_literal(values) -> str:
+    elements = []
+    for value in values:
+        if value is None:
+            elements.append("NULL")
+        else:
+            escaped = str(value).replace("\\", "\\\\").replace('"', '\\"')
+            elements.append(f'"{escaped}"')
+    return "{" + ",".join(elements) + "}"
+
+
+def copy_upsert(model, instances: list, unique_fields: tuple) -> (int, int):
+    # Streams the instances into a temporary staging table with COPY FROM STDIN
+    # and merges them into the model's table with one INSERT ... SELECT ... ON
+    # CONFLICT statement. Much cheaper than binding parameters for large batches.
+    instances = _unique_instances(instances, unique_fields)
+    if not instances:
+        return 0, 0
+    fields = _insert_fields(model)
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    staging_table = qn(f"staging_{model._meta.db_table}")
+    columns = ", ".join(qn(field.column) for field in fields)
+
+    buffer = io.StringIO()
+    for row in _prepared_rows(fields, instances):
+        buffer.write("\t".join(_copy_text(value) for value in row))
+        buffer.write("\n")
+    buffer.seek(0)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TEMPORARY TABLE {staging_table} ON COMMIT DROP AS "
+            f"SELECT {columns} FROM {table} WITH NO DATA"
+        )
+        cursor.copy_expert(f"COPY {staging_table} ({columns}) FROM STDIN", buffer)
+        cursor.execute(
+            f"INSERT INTO {table} AS t ({columns}) SELECT {columns} "
+            f"FROM {staging_table} {_on_conflict_sql(model, fields, unique_fields)}"
+        )
+        results = cursor.fetchall()
+        cursor.execute(f"DROP TABLE {staging_table}")
+    return _count_upserted(results)
+
+
+class BulkWriter:
+    # Buffers model instances and writes them in chunks. Meant to be used inside
+    # transaction.atomic() so that a window is written at once:
+    #
+    #   with transaction.atomic(), BulkWriter(ActivityRaw) as writer:
+    #       writer.add(ActivityRaw(...))
+    #
+    # With `unique_fields` the chunks are upserted on that natural key, otherwise
+    # they are inserted with bulk_create. With a `time_field` as well, rows that
+    # are stored already and did not change are dropped before the upsert.
+    # Instances the database would reject are logged and skipped.
+    def __init__(
+        self,
+        model,
+        unique_fields: tuple = None,
+        batch_size: int = DB_WRITER_BATCH_SIZE,
+        time_field: str = None,
+    ):
+        self.model = model
+        self.unique_fields = unique_fields
+        self.batch_size = batch_size
+        self.time_field = time_field
+        self.inserted = 0
+        self.updated = 0
+        self.skipped = 0
+        self.elapsed = 0.0
+        self._buffer = []
+
+    @property
+    def written(self) -> int:
+        return self.inserted + self.updated
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.written / self.elapsed if self.elapsed else 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+        else:
+            self._buffer = []
+
+    def add(self, instance):
+        invalid = invalid_fields(instance)
+        if invalid:
+            LOGGER.error(
+                "Skipping a %s row with invalid %s: %s.",
+                self.model._meta.model_name,
+                ", ".join(invalid),
+                {field: getattr(instance, field, None) for field in invalid},
+            )
+            self.skipped += 1
+            return
+        self._buffer.append(instance)
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        started_at = time.monotonic()
+        inserted, updated = self._write(self._buffer)
+        self.elapsed += time.monotonic() - started_at
+        LOGGER.debug(
+            "Wrote %s %s row(s): %s inserted, %s updated.",
+            len(self._buffer),
+            self.model._meta.model_name,
+            inserted,
+            updated,
+        )
+        self.inserted += inserted
+        self.updated += updated
+        self._buffer = []
+
+    def _write(self, instances: list) -> (int, int):
+        if self.unique_fields and self.time_field:
+            instances = drop_existing(
+                self.model, instances, self.unique_fields, self.time_field
+            )
+        if self.unique_fields:
+            return upsert(self.model, instances, self.unique_fields)
+        self.model.objects.bulk_create(instances, batch_size=self.batch_size)
+        return len(instances), 0
+
+
+class CopyWriter(BulkWriter):
+    # Same interface as BulkWriter but every chunk is written with COPY and
+    # merged on the natural key in its own transaction. Meant for backfills, so
+    # it buffers far more rows and is used around the whole fetch loop rather
+    # than per window.
+    def __init__(
+        self, model, unique_fields: tuple, batch_size: int = DB_COPY_BATCH_SIZE,
+    ):
+        super().__init__(model, unique_fields, batch_size)
+
+    def _write(self, instances: list) -> (int, int):
+        return copy_upsert(self.model, instances, self.unique_fields)
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection
+
+from connector.utils.common import iterate_pages
+
+WITHINGS_FETCH_CONCURRENCY = int(os.environ.get("WITHINGS_FETCH_CONCURRENCY", 4))
+LOGGER = logging.getLogger(__name__)
+
+
+async def _drain_tasks():
+    tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class FetchEngine:
+    def __init__(
+        self,
+        endpoint: str,
+        access_token: str,
+        concurrency: int = WITHINGS_FETCH_CONCURRENCY,
+        rate_reserve: float = 0.0,
+    ):
+        self.endpoint = endpoint
+        self.access_token = access_token
+        self.concurrency = max(concurrency, 1)
+        self.rate_reserve = rate_reserve
+        self.requests = 0
+        self.windows = 0
+        self.wall_clock = 0.0
+        self._lock = threading.Lock()
+
+    def _fetch_window(self, params: dict) -> list:
+        try:
+            pages = list(
+                iterate_pages(
+                    self.endpoint, params, self.access_token, self.rate_reserve
+                )
+            )
+        finally:
+            # the rate limiter uses the DB from this worker thread
+            connection.close()
+        with self._lock:
+            self.requests += len(pages)
+        return pages
+
+    async def _fetch_window_async(self, semaphore, executor, params: dict) -> list:
+        async with semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, self._fetch_window, params)
+
+    def fetch(self, windows: list):
+        for _, pages in self.fetch_windows(windows):
+            yield from pages
+
+    def fetch_windows(self, windows: list):
+        # The event loop runs in a helper thread so that the caller can keep using
+        # the (synchronous) Django ORM on the pages it receives. The pages of each
+        # window are yielded together with its params, in window order; only a
+        # limited number of windows is fetched ahead of the consumer so memory
+        # stays bounded.
+        started_at = time.monotonic()
+        loop = asyncio.new_event_loop()
+        loop_thread = threading.Thread(target=loop.run_forever, daemon=True)
+        loop_thread.start()
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+
+        async def make_semaphore():
+            return asyncio.Semaphore(self.concurrency)
+
+        semaphore = asyncio.run_coroutine_threadsafe(make_semaphore(), loop).result()
+        pending = list(windows)
+        in_flight = []
+
+        def submit_next():
+            if pending:
+                params = pending.pop(0)
+                coroutine = self._fetch_window_async(semaphore, executor, params)
+                in_flight.append(
+                    (params, asyncio.run_coroutine_threadsafe(coroutine, loop))
+                )
+
+        try:
+            for _ in range(self.concurrency * 2):
+                submit_next()
+            while in_flight:
+                params, future = in_flight.pop(0)
+                pages = future.result()
+                submit_next()
+                self.windows += 1
+                yield params, pages
+        finally:
+            for _, future in in_flight:
+                future.cancel()
+            asyncio.run_coroutine_threadsafe(_drain_tasks(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            loop_thread.join()
+            loop.close()
+            executor.shutdown(wait=True)
+            self.wall_clock += time.monotonic() - started_at
+            LOGGER.info(
+                "Fetched %s window(s) from %s with %s request(s) in %.2fs (concurrency: %s).",
+                self.windows,
+                self.endpoint,
+                self.requests,
+                self.wall_clock,
+                self.concurrency,
+            )
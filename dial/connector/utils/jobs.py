@@ -0,0 +1,236 @@
+import logging
+import os
+from datetime import datetime, timedelta
+from functools import partial
+
+from django.db import transaction
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+
+from connector.models import (
+    ActivityRaw,
+    ActivitySummary,
+    APIUser,
+    FetchChunk,
+    FetchJob,
+    SleepRaw,
+    SleepSummary,
+    Weight,
+)
+from connector.utils.activity import get_activity_detailed, get_activity_summary
+from connector.utils.authentication import get_valid_token
+from connector.utils.backfill import BACKFILL_MAX_ATTEMPTS, BACKFILL_RATE_RESERVE
+from connector.utils.common import resolve_date_range
+from connector.utils.measurements import get_measurements
+from connector.utils.notifications import release_notification_window
+from connector.utils.rollups import day_start
+from connector.utils.sleep import get_sleep_data_raw, get_sleep_data_summary
+
+LOGGER = logging.getLogger(__name__)
+# the date range of every data kind is split into chunks of that many days,
+# each fetched by a task of its own
+FETCH_CHUNK_DAYS = int(os.environ.get("FETCH_CHUNK_DAYS", 7))
+# running chunks that have not finished after that long are taken as lost
+FETCH_STALL_MINUTES = int(os.environ.get("FETCH_STALL_MINUTES", 30))
+
+# (data type, kind) -> the fetcher, plus the model and endpoint of its cursor
+FETCHERS = {
+    ("sleep", "raw"): (get_sleep_data_raw, SleepRaw, "get"),
+    ("sleep", "summary"): (get_sleep_data_summary, SleepSummary, "getsummary"),
+    ("activity", "raw"): (get_activity_detailed, ActivityRaw, "getintradayactivity"),
+    ("activity", "summary"): (get_activity_summary, ActivitySummary, "getactivity"),
+    ("measurements", "raw"): (
+        partial(get_measurements, meas_type="weight"),
+        Weight,
+        "getmeas",
+    ),
+}
+
+
+def split_range(start_date: datetime, end_date: datetime, days: int) -> list:
+    # Chunks of `days` whole UTC days, the first and the last one cut to the
+    # range. Chunks running in parallel then never share an hourly or daily
+    # rollup bucket, each of which is recomputed from the raw rows of only
+    # one chunk.
+    chunks = []
+    chunk_start = start_date
+    while True:
+        chunk_end = day_start(chunk_start) + timedelta(days=days)
+        if chunk_end >= end_date:
+            chunks.append((chunk_start, end_date))
+            return chunks
+        chunks.append((chunk_start, chunk_end))
+        chunk_start = chunk_end
+
+
+def plan_fetch_job(
+    user: APIUser,
+    data_type: str,
+    start_date: datetime,
+    end_date: datetime,
+    from_notification: bool = False,
+    use_copy: bool = False,
+    chunk_days: int = FETCH_CHUNK_DAYS,
+    backfill: bool = False,
+    notification_appli: int = None,
+) -> FetchJob:
+    # Creates the job and its chunks. Each data kind gets its own range - from
+    # a notification, every kind resumes from its own sync cursor.
+    ranges = {}
+    for (fetcher_data_type, kind), (_, db_model, endpoint) in FETCHERS.items():
+        if fetcher_data_type == data_type:
+            ranges[kind] = resolve_date_range(
+                db_model, user, endpoint, start_date, end_date, from_notification
+            )
+    with transaction.atomic():
+        job = FetchJob.objects.create(
+            user=user,
+            data_type=data_type,
+            start_date=min(start for start, _ in ranges.values()),
+            end_date=max(end for _, end in ranges.values()),
+            use_copy=use_copy,
+            backfill=backfill,
+            notification_appli=notification_appli,
+        )
+        FetchChunk.objects.bulk_create(
+            FetchChunk(job=job, kind=kind, start_date=start, end_date=end)
+            for kind, (kind_start, kind_end) in ranges.items()
+            for start, end in split_range(kind_start, kind_end, chunk_days)
+        )
+    LOGGER.info(
+        "Planned %s fetch of %s from %s to %s in %s chunk(s).",
+        data_type,
+        user,
+        job.start_date,
+        job.end_date,
+        job.chunks.count(),
+    )
+    return job
+
+
+def _fetch_chunk(chunk: FetchChunk) -> int:
+    job = chunk.job
+    fetcher, _, _ = FETCHERS[(job.data_type, chunk.kind)]
+    use_copy = job.use_copy and (job.data_type, chunk.kind) == ("activity", "raw")
+    kwargs = {"use_copy": True} if use_copy else {}
+    if job.backfill:
+        # every request leaves a share of the rate limits to the notifications
+        kwargs["rate_reserve"] = BACKFILL_RATE_RESERVE
+    # fetched for every chunk - a long job may outlive a token
+    access_token = get_valid_token(job.user.user_id)["access_token"]
+    return fetcher(
+        access_token=access_token,
+        user_id=job.user.user_id,
+        start_date=chunk.start_date,
+        end_date=chunk.end_date,
+        **kwargs,
+    )
+
+
+def run_fetch_chunk(chunk_id: int) -> FetchChunk:
+    # Fetches one pending chunk and records the outcome. A chunk that is not
+    # pending any more (e.g. a duplicate task) is left alone. A failed backfill
+    # chunk goes back to pending until it runs out of attempts.
+    claimed = FetchChunk.objects.filter(pk=chunk_id, status="pending").update(
+        status="running", started_at=timezone.now(), attempts=F("attempts") + 1
+    )
+    chunk = FetchChunk.objects.select_related("job__user").get(pk=chunk_id)
+    if not claimed:
+        LOGGER.info("Fetch chunk %s is %s - skipping.", chunk_id, chunk.status)
+        return chunk
+    try:
+        chunk.rows = _fetch_chunk(chunk)
+        chunk.status = "done"
+    except Exception as e:
+        retry = chunk.job.backfill and chunk.attempts < BACKFILL_MAX_ATTEMPTS
+        chunk.status = "pending" if retry else "failed"
+        chunk.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        chunk.finished_at = timezone.now()
+        chunk.save(update_fields=["rows", "status", "error", "finished_at"])
+        finish_fetch_job(chunk.job_id)
+    return chunk
+
+
+def finish_fetch_job(job_id: int) -> bool:
+    # Aggregates the chunks of a job once none is left to run - what a chord
+    # callback would do, but the workers have no result backend. The job row
+    # is locked, so only one of the last chunks to finish does it.
+    with transaction.atomic():
+        job = FetchJob.objects.select_for_update().get(pk=job_id)
+        if job.status != "running":
+            return False
+        chunks = job.chunks.all()
+        if chunks.filter(status__in=["pending", "running"]).exists():
+            return False
+        counts = dict(
+            chunks.filter(status="done")
+            .values("kind")
+            .annotate(rows=Sum("rows"))
+            .values_list("kind", "rows")
+        )
+        job.raw_count = counts.get("raw", 0)
+        job.summary_count = counts.get("summary", 0)
+        job.status = "failed" if chunks.filter(status="failed").exists() else "done"
+        job.finished_at = timezone.now()
+        job.save()
+        if job.status == "failed" and job.notification_appli is not None:
+            release_notification_window(
+                job.user.user_id, job.notification_appli, job.start_date, job.end_date
+            )
+    LOGGER.info(
+        "Fetch job %s (%s of %s) %s: fetched and updated %s raw and %s summary "
+        "entries in %.1fs.",
+        job.pk,
+        job.data_type,
+        job.user,
+        job.status,
+        job.raw_count,
+        job.summary_count,
+        (job.finished_at - job.created_at).total_seconds(),
+    )
+    return True
+
+
+def _active_since(cutoff: datetime) -> Q:
+    return (
+        Q(chunks__started_at__gte=cutoff)
+        | Q(chunks__finished_at__gte=cutoff)
+        | Q(lanes_seen_at__gte=cutoff)
+    )
+
+
+def is_fetch_job_active(job: FetchJob, now: datetime = None) -> bool:
+    # whether a chunk of the job started or finished, or a lane of it ran,
+    # recently
+    cutoff = (now or timezone.now()) - timedelta(minutes=FETCH_STALL_MINUTES)
+    return (
+        job.created_at >= cutoff
+        or FetchJob.objects.filter(_active_since(cutoff), pk=job.pk).exists()
+    )
+
+
+def stalled_fetch_jobs(now: datetime = None) -> list:
+    # Running chunks whose worker went away (a crash, a deploy) go back to
+    # pending. Returns the unfinished jobs none of whose chunks started or
+    # finished, and none of whose lanes ran, for a while - their tasks are lost
+    # and need to be enqueued again.
+    cutoff = (now or timezone.now()) - timedelta(minutes=FETCH_STALL_MINUTES)
+    reset = FetchChunk.objects.filter(status="running", started_at__lt=cutoff).update(
+        status="pending"
+    )
+    if reset:
+        LOGGER.warning("Reset %s stalled fetch chunk(s) to pending.", reset)
+    jobs = list(
+        FetchJob.objects.filter(
+            status="running", created_at__lt=cutoff, chunks__status="pending"
+        )
+        .exclude(_active_since(cutoff))
+        .select_related("user")
+        .distinct()
+        .order_by("created_at")
+    )
+    # the backfill lanes of those jobs are lost as well
+    FetchJob.objects.filter(pk__in=[job.pk for job in jobs]).update(lanes=0)
+    return jobs
@@ -2,11 +2,16 @@ import os
 from datetime import datetime
 import logging
 
+from django.db import transaction
 from django.utils.timezone import make_aware
 
 import numpy as np
 
-from connector.utils.common import prepare_date_pairs, send_data_request
+from connector.utils.common import iterate_pages, resolve_date_range
+from connector.utils.db import BulkWriter
+from connector.utils.sync import advance_sync_cursor
+from connector.utils.trends import update_weight_trends
+from connector.utils.windows import WindowPlanner
 from connector.models import Weight, APIUser
 
 
@@ -21,6 +26,7 @@ class InconsistentEntries(Exception):
 LOGGER = logging.getLogger(__name__)
 WITHINGS_API_URL = os.environ.get("WITHINGS_API_URL", "https://wbsapi.withings.net/v2")
 DATETIME_FORMAT_MEASUREMENT = "%Y-%m-%d"
+WEIGHT_KEY_FIELDS = ("user", "measured_at")
 
 MEASUREMENT_TYPES = {"weight": [1, 5, 6, 8, 11, 54, 76, 77, 88, 91]}
 MEASUREMENT_TYPE_MAPPING = {
@@ -67,18 +73,23 @@ def get_measurements(
     meas_type: str,
     offset: int = None,
     from_notification: bool = False,
+    rate_reserve: float = 0.0,
 ) -> int:
 
-    date_pairs = prepare_date_pairs(Weight, start_date, end_date, from_notification)
     user = APIUser.objects.get(user_id=user_id)
     # TODO: raise an error if user not found
+    start_date, end_date = resolve_date_range(
+        Weight, user, "getmeas", start_date, end_date, from_notification
+    )
+    planner = WindowPlanner("getmeas", start_date, end_date)
+    LOGGER.info("Planned %s measurement request(s).", planner.planned_calls)
 
     if meas_type not in MEASUREMENT_TYPES.keys():
         raise MeasurementTypeError(f"Measurement type '{meas_type}' is not supported.")
     required_measurements = [str(x) for x in MEASUREMENT_TYPES[meas_type]]
 
     counter = 0
-    for sub_start_date, sub_end_date in date_pairs:
+    for sub_start_date, sub_end_date in planner:
         req_params = {
             "action": "getmeas",
             "startdate": int(sub_start_date.timestamp()),
@@ -87,18 +98,23 @@ def get_measurements(
             "category": 1,
             "offset": offset,
         }
-        data = send_data_request(
-            os.path.join(WITHINGS_API_URL, "measure"), req_params, access_token
-        )
-
-        if meas_type == "weight":
-            weight_counter = process_weight_measurements(data["measuregrps"], user)
-            counter += weight_counter
-        else:
-            raise MeasurementTypeError(
-                f"Measurement type '{meas_type}' is not supported."
-            )
+        for data in iterate_pages(
+            os.path.join(WITHINGS_API_URL, "measure"),
+            req_params,
+            access_token,
+            rate_reserve,
+        ):
+            planner.feedback(len(data["measuregrps"]), data.get("more", False))
+            if meas_type == "weight":
+                weight_counter = process_weight_measurements(data["measuregrps"], user)
+                counter += weight_counter
+            else:
+                raise MeasurementTypeError(
+                    f"Measurement type '{meas_type}' is not supported."
+                )
+        advance_sync_cursor(user, Weight, "getmeas", sub_start_date, sub_end_date)
 
+    LOGGER.debug("Made %s measurement request(s).", planner.calls)
     return counter
 
 
@@ -162,33 +178,38 @@ def process_weight_measurements(measuregrps: list, user) -> int:
 
             data_for_db[measured_at_ts][measure_type.lower()] = measure_value_converted
 
+    weight_measurements = []
     for meas_ts in data_for_db.keys():
-        potential_entry = Weight.objects.filter(
-            measured_at=data_for_db[meas_ts]["measured_at"]
-        )
-        if len(potential_entry) == 0:
-            try:
-                new_weight_measurement = Weight(
-                    device_id=data_for_db[meas_ts].get("device_id", "unknown"),
-                    user=user,
-                    source=data_for_db[meas_ts].get("source"),
-                    measured_at=data_for_db[meas_ts].get("measured_at"),
-                    weight=data_for_db[meas_ts].get("weight"),
-                    fat_free_mass=data_for_db[meas_ts].get("fat_free_mass"),
-                    fat_ratio=data_for_db[meas_ts].get("fat_ratio"),
-                    fat_mass_weight=data_for_db[meas_ts].get("fat_mass_weight"),
-                    muscle_mass=data_for_db[meas_ts].get("muscle_mass"),
-                    hydration=data_for_db[meas_ts].get("hydration"),
-                    bone_mass=data_for_db[meas_ts].get("bone_mass"),
-                    pulse_wave_velocity=data_for_db[meas_ts].get("pulse_wave_velocity"),
-                    heart_rate=data_for_db[meas_ts].get("heart_rate"),
-                )
-                new_weight_measurement.save()
-                counter += 1
-            except KeyError as e:
-                LOGGER.error(
-                    f"Error while saving to DB. Current measurement: {data_for_db}\n{e}"
-                )
+        try:
+            new_weight_measurement = Weight(
+                device_id=data_for_db[meas_ts].get("device_id", "unknown"),
+                user=user,
+                source=data_for_db[meas_ts].get("source"),
+                measured_at=data_for_db[meas_ts].get("measured_at"),
+                weight=data_for_db[meas_ts].get("weight"),
+                fat_free_mass=data_for_db[meas_ts].get("fat_free_mass"),
+                fat_ratio=data_for_db[meas_ts].get("fat_ratio"),
+                fat_mass_weight=data_for_db[meas_ts].get("fat_mass_weight"),
+                muscle_mass=data_for_db[meas_ts].get("muscle_mass"),
+                hydration=data_for_db[meas_ts].get("hydration"),
+                bone_mass=data_for_db[meas_ts].get("bone_mass"),
+                pulse_wave_velocity=data_for_db[meas_ts].get("pulse_wave_velocity"),
+                heart_rate=data_for_db[meas_ts].get("heart_rate"),
+            )
+            weight_measurements.append(new_weight_measurement)
+        except KeyError as e:
+            LOGGER.error(
+                f"Error while saving to DB. Current measurement: {data_for_db}\n{e}"
+            )
+    with transaction.atomic():
+        with BulkWriter(Weight, WEIGHT_KEY_FIELDS, time_field="measured_at") as writer:
+            for new_weight_measurement in weight_measurements:
+                writer.add(new_weight_measurement)
+        if writer.written:
+            update_weight_trends(
+                user, since=min(weight.measured_at for weight in weight_measurements)
+            )
+    counter += writer.written
     return counter
 
 
@@ -1,4 +1,54 @@
-import requests
+import logging
+import os
+from datetime import datetime, timedelta
+
+from django.db import connection
+from django.utils import timezone
+
+from connector.models import PendingNotification
+from connector.utils import client
+from connector.utils.common import notification_window
+
+LOGGER = logging.getLogger(__name__)
+# notifications of the same user and appli arriving within that many seconds
+# of the first one are handled by a single task
+NOTIFICATION_DEBOUNCE_SECONDS = int(os.environ.get("NOTIFICATION_DEBOUNCE_SECONDS", 60))
+
+# A window left open (NULL) by any of the notifications stays open. The due
+# date is only reset if the task of the row is long overdue, i.e. was lost.
+DEBOUNCE_SQL = """
+INSERT INTO {pending} AS p (user_id, appli, start_date, end_date, notifications,
+    due_at, created_at)
+VALUES (%(user_id)s, %(appli)s, %(start_date)s, %(end_date)s, 1, %(due_at)s,
+    %(now)s)
+ON CONFLICT (user_id, appli) DO UPDATE SET
+    start_date = CASE
+        WHEN p.start_date IS NULL OR EXCLUDED.start_date IS NULL THEN NULL
+        ELSE least(p.start_date, EXCLUDED.start_date)
+    END,
+    end_date = CASE
+        WHEN p.end_date IS NULL OR EXCLUDED.end_date IS NULL THEN NULL
+        ELSE greatest(p.end_date, EXCLUDED.end_date)
+    END,
+    notifications = p.notifications + 1,
+    due_at = CASE
+        WHEN p.due_at < %(now)s - %(debounce)s THEN EXCLUDED.due_at
+        ELSE p.due_at
+    END
+RETURNING due_at = %(due_at)s
+"""
+# pending notifications whose task is long overdue (lost, or the window was
+# put back by a failed fetch) - they are due again, so that they are not
+# picked up twice
+OVERDUE_SQL = """
+UPDATE {pending} SET due_at = %s
+WHERE due_at < %s
+RETURNING user_id, appli
+"""
+CLAIM_SQL = """
+DELETE FROM {pending} WHERE user_id = %s AND appli = %s
+RETURNING start_date, end_date, notifications
+"""
 
 
 def subscribe_to_notifications(access_token: str, callback_url: str, appli: int):
@@ -8,7 +58,7 @@ def subscribe_to_notifications(access_token: str, callback_url: str, appli: int)
         "appli": appli,
     }
     headers = {"Authorization": f"Bearer {access_token}"}
-    notify_response = requests.post(
+    notify_response = client.post(
         "https://wbsapi.withings.net/notify", data=req_params, headers=headers,
     )
     return notify_response
@@ -20,7 +70,93 @@ def fetch_all_notifications(access_token: str, appli: int):
         "appli": appli,
     }
     headers = {"Authorization": f"Bearer {access_token}"}
-    notify_response = requests.post(
+    notify_response = client.post(
         "https://wbsapi.withings.net/notify", data=req_params, headers=headers
     )
     return notify_response
+
+
+def merge_pending_notification(user_id, appli, start_date, end_date) -> bool:
+    # Merges the window into the pending notification of the user and appli.
+    # True if there was none, i.e. a task has to be enqueued for it (with a
+    # countdown of NOTIFICATION_DEBOUNCE_SECONDS).
+    now = timezone.now()
+    debounce = timedelta(seconds=NOTIFICATION_DEBOUNCE_SECONDS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            DEBOUNCE_SQL.format(
+                pending=connection.ops.quote_name(PendingNotification._meta.db_table)
+            ),
+            {
+                "user_id": int(user_id),
+                "appli": int(appli),
+                "start_date": start_date,
+                "end_date": end_date,
+                "now": now,
+                "due_at": now + debounce,
+                "debounce": debounce,
+            },
+        )
+        return cursor.fetchone()[0]
+
+
+def debounce_notification(json_body: dict) -> bool:
+    # Merges the notification into the pending one of the same user and appli.
+    # True if a task has to be enqueued for it.
+    start_date, end_date = notification_window(json_body)
+    return merge_pending_notification(
+        json_body["userid"], json_body["appli"], start_date, end_date
+    )
+
+
+def release_notification_window(user_id, appli, start_date, end_date):
+    # Puts the window of a failed fetch back - it was claimed, so it would be
+    # lost otherwise. It is fetched again with the next notification, or by
+    # the resume task once it is overdue.
+    merge_pending_notification(user_id, appli, start_date, end_date)
+    LOGGER.warning(
+        "Put the window %s to %s of user %s for appli %s back after a failed fetch.",
+        start_date,
+        end_date,
+        user_id,
+        appli,
+    )
+
+
+def overdue_notifications(now: datetime = None) -> list:
+    # (user ID, appli) of the pending notifications that have to be enqueued
+    # again
+    now = now or timezone.now()
+    debounce = timedelta(seconds=NOTIFICATION_DEBOUNCE_SECONDS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            OVERDUE_SQL.format(
+                pending=connection.ops.quote_name(PendingNotification._meta.db_table)
+            ),
+            [now + debounce, now - debounce],
+        )
+        return cursor.fetchall()
+
+
+def claim_notification_window(user_id, appli):
+    # Takes the pending notification of the user and appli over. Returns the
+    # (start, end) to fetch - both None to resume from the sync cursors - or
+    # None if another task already took it.
+    with connection.cursor() as cursor:
+        cursor.execute(
+            CLAIM_SQL.format(
+                pending=connection.ops.quote_name(PendingNotification._meta.db_table)
+            ),
+            [int(user_id), int(appli)],
+        )
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    start_date, end_date, notifications = row
+    LOGGER.debug(
+        "Claimed %s notification(s) of user %s for appli %s.",
+        notifications,
+        user_id,
+        appli,
+    )
+    return start_date, end_date
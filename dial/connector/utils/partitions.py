@@ -0,0 +1,145 @@
+import logging
+import os
+from datetime import datetime
+
+import pytz
+from django.db import connection, transaction
+
+LOGGER = logging.getLogger(__name__)
+# partitioned table -> partition key column (monthly range partitions)
+PARTITIONED_TABLES = {"connector_activityraw": "measured_at"}
+PARTITION_MONTHS_AHEAD = int(os.environ.get("PARTITION_MONTHS_AHEAD", 3))
+
+
+def month_start(date: datetime) -> datetime:
+    if date.tzinfo is not None:
+        date = date.astimezone(pytz.utc)
+    return datetime(date.year, date.month, 1, tzinfo=pytz.utc)
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    year, month_index = divmod(month.month - 1 + months, 12)
+    return month.replace(year=month.year + year, month=month_index + 1)
+
+
+def partition_name(table: str, month: datetime) -> str:
+    return f"{table}_y{month.year}m{month.month:02d}"
+
+
+def default_partition_name(table: str) -> str:
+    return f"{table}_default"
+
+
+def partition_month(table: str, name: str) -> datetime:
+    return datetime.strptime(name[len(table) + 1 :], "y%Ym%m").replace(tzinfo=pytz.utc)
+
+
+def get_partitions(table: str) -> set:
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = %s::regclass
+            """,
+            [table],
+        )
+        return {name for (name,) in cursor.fetchall()}
+
+
+def _months_in_default_partition(table: str, column: str) -> list:
+    # rows outside of the existing partitions (e.g. from an old backfill) end up
+    # in the default partition - their months need a partition of their own
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT DISTINCT date_trunc('month', {qn(column)} AT TIME ZONE 'UTC') "
+            f"FROM {qn(default_partition_name(table))}"
+        )
+        return [month_start(pytz.utc.localize(month)) for (month,) in cursor.fetchall()]
+
+
+def create_partition(table: str, column: str, month: datetime) -> bool:
+    # The partition is created detached, filled with the matching rows from the
+    # default partition and only then attached, so that this also works when
+    # the default partition already holds data for that month.
+    name = partition_name(table, month)
+    if name in get_partitions(table):
+        return False
+    qn = connection.ops.quote_name
+    lower, upper = month, add_months(month, 1)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"CREATE TABLE {qn(name)} (LIKE {qn(table)} INCLUDING DEFAULTS)")
+        cursor.execute(
+            f"WITH moved AS ("
+            f"DELETE FROM {qn(default_partition_name(table))} "
+            f"WHERE {qn(column)} >= %s AND {qn(column)} < %s RETURNING *"
+            f") INSERT INTO {qn(name)} SELECT * FROM moved",
+            [lower, upper],
+        )
+        moved = cursor.rowcount
+        cursor.execute(
+            f"ALTER TABLE {qn(table)} ATTACH PARTITION {qn(name)} "
+            f"FOR VALUES FROM (%s) TO (%s)",
+            [lower, upper],
+        )
+    LOGGER.info(
+        "Created partition %s (%s row(s) moved from the default partition).",
+        name,
+        moved,
+    )
+    return True
+
+
+def create_partitions(
+    months_ahead: int = PARTITION_MONTHS_AHEAD, start: datetime = None
+) -> list:
+    # Makes sure that every month from `start` (default: the current month) up
+    # to `months_ahead` months in the future has its own partition.
+    first_month = month_start(start or datetime.now(pytz.utc))
+    last_month = add_months(month_start(datetime.now(pytz.utc)), months_ahead)
+    created = []
+    for table, column in PARTITIONED_TABLES.items():
+        months = set(_months_in_default_partition(table, column))
+        month = first_month
+        while month <= last_month:
+            months.add(month)
+            month = add_months(month, 1)
+        for month in sorted(months):
+            if create_partition(table, column, month):
+                created.append(partition_name(table, month))
+    return created
+
+
+def drop_partitions(table: str, before: datetime, keep: str = "false") -> dict:
+    # Drops the monthly partitions that only hold data older than `before` -
+    # much cheaper than deleting their rows. Partitions with rows matching the
+    # `keep` condition are left alone. Returns the number of rows that were
+    # dropped with each partition.
+    qn = connection.ops.quote_name
+    dropped = {}
+    for name in sorted(get_partitions(table) - {default_partition_name(table)}):
+        if add_months(partition_month(table, name), 1) > before:
+            continue
+        with transaction.atomic(), connection.cursor() as cursor:
+            # locked first, so that no row to keep can be written meanwhile
+            cursor.execute(f"LOCK TABLE {qn(name)} IN ACCESS EXCLUSIVE MODE")
+            cursor.execute(
+                f"SELECT count(*), count(*) FILTER (WHERE {keep}) FROM {qn(name)}"
+            )
+            rows, kept = cursor.fetchone()
+            if kept:
+                LOGGER.warning(
+                    "Not dropping partition %s: %s of its row(s) have to be kept.",
+                    name,
+                    kept,
+                )
+                continue
+            dropped[name] = rows
+            # deferred FK checks of rows written earlier in the same
+            # transaction would block the DROP
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+            cursor.execute(f"DROP TABLE {qn(name)}")
+        LOGGER.info("Dropped partition %s (%s row(s)).", name, dropped[name])
+    return dropped
@@ -0,0 +1,123 @@
+import logging
+import os
+import time
+from urllib.parse import urlparse
+
+from django.db import transaction
+from django.utils import timezone
+
+from connector.models import RateLimitBucket
+
+LOGGER = logging.getLogger(__name__)
+GLOBAL_BUCKET = "*"
+
+
+def parse_rate_limits(rate_limits: str) -> dict:
+    # "<bucket>:<requests per minute>" pairs, e.g. "*:120,measure:60,sleep:60";
+    # "*" is shared by all the endpoints, the others apply on top of it
+    limits = {}
+    for limit in rate_limits.split(","):
+        if not limit.strip():
+            continue
+        name, per_minute = limit.split(":")
+        if float(per_minute) > 0:
+            limits[name.strip()] = float(per_minute)
+    return limits
+
+
+WITHINGS_RATE_LIMITS = parse_rate_limits(
+    os.environ.get("WITHINGS_RATE_LIMITS", f"{GLOBAL_BUCKET}:120")
+)
+WITHINGS_RATE_LIMIT_BURST = float(os.environ.get("WITHINGS_RATE_LIMIT_BURST", 10))
+
+
+def endpoint_bucket_name(endpoint: str) -> str:
+    return urlparse(endpoint).path.rstrip("/").split("/")[-1]
+
+
+def take_tokens(limits: dict, reserve: float = 0.0) -> tuple:
+    # Takes a token from every bucket in `limits` (name -> requests per minute)
+    # or from none of them, so a caller blocked by one bucket does not use up
+    # the others while it waits. `reserve` is the share of every bucket's
+    # capacity the caller has to leave to the others. Returns (0, None) when
+    # the tokens were taken, otherwise the time until they are all available
+    # and the bucket that is the furthest from it.
+    buckets = []
+    with transaction.atomic():
+        # always locked in the same order, so concurrent callers cannot deadlock
+        for name in sorted(limits):
+            refill_rate = limits[name] / 60
+            capacity = min(WITHINGS_RATE_LIMIT_BURST, limits[name])
+            bucket, _ = RateLimitBucket.objects.select_for_update().get_or_create(
+                name=name,
+                defaults={
+                    "tokens": capacity,
+                    "capacity": capacity,
+                    "refill_rate": refill_rate,
+                },
+            )
+            buckets.append((bucket, capacity, refill_rate))
+
+        now = timezone.now()
+        delay, blocking = 0, None
+        for bucket, capacity, refill_rate in buckets:
+            elapsed = max((now - bucket.updated_at).total_seconds(), 0)
+            bucket.tokens = min(capacity, bucket.tokens + elapsed * refill_rate)
+            needed = 1 + capacity * reserve
+            if (
+                bucket.tokens < needed
+                and (needed - bucket.tokens) / refill_rate > delay
+            ):
+                delay, blocking = (needed - bucket.tokens) / refill_rate, bucket.name
+        if delay > 0:
+            return delay, blocking
+
+        for bucket, capacity, refill_rate in buckets:
+            bucket.tokens -= 1
+            bucket.capacity = capacity
+            bucket.refill_rate = refill_rate
+            bucket.updated_at = now
+            bucket.requests += 1
+            bucket.save()
+    return 0, None
+
+
+def record_wait(name: str, waited: float):
+    with transaction.atomic():
+        bucket = RateLimitBucket.objects.select_for_update().get(name=name)
+        bucket.delayed_requests += 1
+        bucket.total_wait += waited
+        bucket.max_wait = max(bucket.max_wait, waited)
+        bucket.save()
+
+
+def acquire(endpoint: str, reserve: float = 0.0) -> float:
+    limits = {
+        name: WITHINGS_RATE_LIMITS[name]
+        for name in [GLOBAL_BUCKET, endpoint_bucket_name(endpoint)]
+        if name in WITHINGS_RATE_LIMITS
+    }
+    if not limits:
+        return 0.0
+    waited = {}
+    delay, blocking = take_tokens(limits, reserve)
+    while delay > 0:
+        time.sleep(delay)
+        waited[blocking] = waited.get(blocking, 0.0) + delay
+        delay, blocking = take_tokens(limits, reserve)
+    for name, bucket_waited in waited.items():
+        LOGGER.debug("Waited %.2fs for a '%s' rate limit token.", bucket_waited, name)
+        record_wait(name, bucket_waited)
+    return sum(waited.values())
+
+
+def get_rate_limit_stats() -> dict:
+    return {
+        bucket.name: {
+            "requests": bucket.requests,
+            "delayed_requests": bucket.delayed_requests,
+            "total_wait": round(bucket.total_wait, 2),
+            "max_wait": round(bucket.max_wait, 2),
+        }
+        for bucket in RateLimitBucket.objects.all()
+    }
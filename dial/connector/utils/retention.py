@@ -0,0 +1,69 @@
+import logging
+import os
+from datetime import datetime
+
+from django.db import connection, transaction
+
+from connector.models import ActivityRaw
+from connector.utils.cold_storage import cold_metrics_condition, compact_closed_days
+from connector.utils.partitions import drop_partitions
+from connector.utils.rollups import ensure_activity_rollups, raw_retention_cutoff
+
+LOGGER = logging.getLogger(__name__)
+RETENTION_BATCH_SIZE = int(os.environ.get("RETENTION_BATCH_SIZE", 5000))
+
+# rows with a cold metric are never deleted - they are compacted first
+DELETE_BATCH_SQL = """
+DELETE FROM {raw} WHERE (id, measured_at) IN (
+    SELECT id, measured_at FROM {raw}
+    WHERE measured_at < %s AND NOT ({keep})
+    LIMIT %s
+)
+"""
+
+
+def delete_raw_activities(before: datetime, keep: str = "false") -> int:
+    # Deletes in small batches, each in its own transaction, so that no lock
+    # is held for long and the ingestion can carry on in the meantime. Rows
+    # matching the `keep` condition are left alone.
+    sql = DELETE_BATCH_SQL.format(
+        raw=connection.ops.quote_name(ActivityRaw._meta.db_table), keep=keep
+    )
+    deleted = 0
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(sql, [before, RETENTION_BATCH_SIZE])
+            deleted += cursor.rowcount
+        if cursor.rowcount < RETENTION_BATCH_SIZE:
+            return deleted
+
+
+def enforce_retention(now: datetime = None) -> dict:
+    # Removes the minute-level activity data older than the retention period.
+    # Whole monthly partitions are dropped, the rest is deleted in batches.
+    # The cold metrics of those days are moved to the cold storage first, and
+    # rows that still carry one (e.g. written by a backfill in the meantime)
+    # are neither deleted nor dropped with their partition.
+    cutoff = raw_retention_cutoff(now)
+    if cutoff is None:
+        return {"rolled_up_hours": 0, "dropped_partitions": {}, "deleted_rows": 0}
+    rolled_up_hours = ensure_activity_rollups(cutoff)
+    compact_closed_days(cutoff)
+    keep = cold_metrics_condition() or "false"
+    dropped_partitions = drop_partitions(ActivityRaw._meta.db_table, cutoff, keep)
+    deleted_rows = delete_raw_activities(cutoff, keep)
+    LOGGER.info(
+        "Reclaimed %s raw activity row(s) older than %s (%s from %s dropped "
+        "partition(s), %s deleted); rolled up %s hour(s) first.",
+        sum(dropped_partitions.values()) + deleted_rows,
+        cutoff,
+        sum(dropped_partitions.values()),
+        len(dropped_partitions),
+        deleted_rows,
+        rolled_up_hours,
+    )
+    return {
+        "rolled_up_hours": rolled_up_hours,
+        "dropped_partitions": dropped_partitions,
+        "deleted_rows": deleted_rows,
+    }
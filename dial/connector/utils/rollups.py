@@ -0,0 +1,244 @@
+import logging
+import os
+from datetime import datetime, timedelta
+
+import pytz
+from django.db import connection, transaction
+
+from connector.models import (
+    ActivityColdDay,
+    ActivityDaily,
+    ActivityHourly,
+    ActivityRaw,
+    APIUser,
+)
+
+LOGGER = logging.getLogger(__name__)
+# ActivityRaw columns that are rolled up, each into rows of its own
+ROLLUP_METRICS = ("steps", "heart_rate", "calories", "distance", "elevation")
+# minute-level activity data older than that is deleted, only the hourly and
+# daily rollups are kept (0 keeps the raw data forever) - see
+# connector.utils.retention
+ACTIVITY_RAW_RETENTION_DAYS = int(os.environ.get("ACTIVITY_RAW_RETENTION_DAYS", 90))
+# metrics that are kept at full resolution for good - their values are moved
+# from the raw rows to the cold storage once a day is old enough, see
+# connector.utils.cold_storage
+ACTIVITY_COLD_METRICS = list(
+    filter(None, os.environ.get("ACTIVITY_COLD_METRICS", "heart_rate").split(","))
+)
+
+HOURLY_SQL = """
+INSERT INTO {hourly} (user_id, metric, bucket, sum, min, max, avg, count)
+SELECT
+    user_id,
+    m.metric,
+    date_trunc('hour', measured_at AT TIME ZONE 'UTC') AT TIME ZONE 'UTC',
+    sum(m.value),
+    min(m.value),
+    max(m.value),
+    avg(m.value),
+    count(*)
+FROM {raw}
+CROSS JOIN LATERAL (VALUES {metrics}) AS m(metric, value)
+WHERE user_id = %s AND measured_at >= %s AND measured_at < %s
+    AND m.value IS NOT NULL
+GROUP BY 1, 2, 3
+ON CONFLICT (user_id, metric, bucket) {on_conflict}
+"""
+# days are rolled up from the (already refreshed) hours, not from the raw rows
+DAILY_SQL = """
+INSERT INTO {daily} (user_id, metric, bucket, sum, min, max, avg, count)
+SELECT
+    user_id,
+    metric,
+    date_trunc('day', bucket AT TIME ZONE 'UTC') AT TIME ZONE 'UTC',
+    sum(sum),
+    min(min),
+    max(max),
+    sum(sum) / sum(count),
+    sum(count)
+FROM {hourly}
+WHERE user_id = %s AND bucket >= %s AND bucket < %s
+GROUP BY 1, 2, 3
+ON CONFLICT (user_id, metric, bucket) {on_conflict}
+"""
+UPDATE_BUCKET_SQL = """DO UPDATE SET
+    sum = EXCLUDED.sum,
+    min = EXCLUDED.min,
+    max = EXCLUDED.max,
+    avg = EXCLUDED.avg,
+    count = EXCLUDED.count"""
+DELETE_BUCKETS_SQL = """
+DELETE FROM {table} b
+WHERE b.user_id = %s AND b.bucket >= %s AND b.bucket < %s AND NOT {protected}
+"""
+# the hourly buckets of the cold metrics on the days moved to the cold storage
+COMPACTED_SQL = """{alias}.metric IN ({metrics}) AND EXISTS (
+    SELECT 1 FROM {cold} c
+    WHERE c.user_id = {alias}.user_id
+        AND c.day = ({alias}.bucket AT TIME ZONE 'UTC')::date
+)"""
+# the days with raw data in hours that were never rolled up (e.g. data loaded
+# before the rollups existed), with the first and last point of those hours
+MISSING_ROLLUPS_SQL = """
+SELECT r.user_id, min(r.measured_at), max(r.measured_at),
+    count(DISTINCT date_trunc('hour', r.measured_at AT TIME ZONE 'UTC'))
+FROM {raw} r
+WHERE r.measured_at < %s AND NOT EXISTS (
+    SELECT 1 FROM {hourly} h
+    WHERE h.user_id = r.user_id
+        AND h.bucket = date_trunc('hour', r.measured_at AT TIME ZONE 'UTC')
+            AT TIME ZONE 'UTC'
+)
+GROUP BY r.user_id, date_trunc('day', r.measured_at AT TIME ZONE 'UTC')
+"""
+
+
+def hour_start(date: datetime) -> datetime:
+    return date.astimezone(pytz.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def day_start(date: datetime) -> datetime:
+    return hour_start(date).replace(hour=0)
+
+
+def raw_retention_cutoff(now: datetime = None) -> datetime:
+    # whole days only, so that no hourly or daily bucket is partially deleted -
+    # None if the raw data is kept forever
+    if ACTIVITY_RAW_RETENTION_DAYS <= 0:
+        return None
+    return day_start(
+        (now or datetime.now(pytz.utc)) - timedelta(days=ACTIVITY_RAW_RETENTION_DAYS)
+    )
+
+
+def _protected_buckets(alias: str) -> tuple:
+    # SQL condition (and its parameters) for the hourly buckets whose raw data
+    # is not all in the raw rows anymore - the days past the retention and, for
+    # the cold metrics, the compacted days. Their rollups are kept as they are.
+    conditions, params = [], []
+    cutoff = raw_retention_cutoff()
+    if cutoff is not None:
+        conditions.append(f"{alias}.bucket < %s")
+        params.append(cutoff)
+    if ACTIVITY_COLD_METRICS:
+        conditions.append(
+            COMPACTED_SQL.format(
+                alias=alias,
+                metrics=", ".join(f"'{metric}'" for metric in ACTIVITY_COLD_METRICS),
+                cold=connection.ops.quote_name(ActivityColdDay._meta.db_table),
+            )
+        )
+    return f"({' OR '.join(conditions) or 'false'})", params
+
+
+def _rollup(
+    sql: str, user: APIUser, start: datetime, end: datetime, params: list = ()
+) -> int:
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [user.pk, start, end, *params])
+        return cursor.rowcount
+
+
+def refresh_activity_rollups(
+    user: APIUser, start: datetime, end: datetime, overwrite: bool = True
+) -> int:
+    # Recomputes the hourly and daily buckets that contain any point between
+    # `start` and `end` (both inclusive) from the raw activity data. Without
+    # `overwrite` only the missing hourly buckets are added.
+    qn = connection.ops.quote_name
+    names = {
+        "raw": qn(ActivityRaw._meta.db_table),
+        "hourly": qn(ActivityHourly._meta.db_table),
+        "daily": qn(ActivityDaily._meta.db_table),
+        "metrics": ", ".join(
+            f"('{metric}', {qn(metric)}::double precision)" for metric in ROLLUP_METRICS
+        ),
+    }
+    first_hour, last_hour = hour_start(start), hour_start(end) + timedelta(hours=1)
+    first_day, last_day = day_start(start), day_start(end) + timedelta(days=1)
+    with transaction.atomic():
+        if overwrite:
+            # buckets without any rows left would not be overwritten by the
+            # upsert
+            protected, params = _protected_buckets("b")
+            _rollup(
+                DELETE_BUCKETS_SQL.format(table=names["hourly"], protected=protected),
+                user,
+                first_hour,
+                last_hour,
+                params,
+            )
+            protected, params = _protected_buckets("EXCLUDED")
+            hourly_conflict = f"{UPDATE_BUCKET_SQL}\nWHERE NOT {protected}"
+        else:
+            params, hourly_conflict = [], "DO NOTHING"
+        hours = _rollup(
+            HOURLY_SQL.format(**names, on_conflict=hourly_conflict),
+            user,
+            first_hour,
+            last_hour,
+            params,
+        )
+        # the hours of the touched days that were not refreshed are still valid
+        _rollup(
+            DELETE_BUCKETS_SQL.format(table=names["daily"], protected="false"),
+            user,
+            first_day,
+            last_day,
+        )
+        days = _rollup(
+            DAILY_SQL.format(**names, on_conflict=UPDATE_BUCKET_SQL),
+            user,
+            first_day,
+            last_day,
+        )
+    LOGGER.debug(
+        "Refreshed %s hourly and %s daily activity rollup(s) of %s.", hours, days, user
+    )
+    return hours + days
+
+
+def rebuild_activity_rollups(
+    user: APIUser, start: datetime = None, end: datetime = None
+) -> int:
+    # Rebuilds the rollups of the whole history (or of the given range) one day
+    # at a time, so that no transaction has to aggregate years of raw data.
+    raw_data = ActivityRaw.objects.filter(user=user)
+    if start is not None:
+        raw_data = raw_data.filter(measured_at__gte=start)
+    if end is not None:
+        raw_data = raw_data.filter(measured_at__lte=end)
+    first = raw_data.order_by("measured_at").values_list("measured_at", flat=True)
+    last = raw_data.order_by("-measured_at").values_list("measured_at", flat=True)
+    if not first.exists():
+        return 0
+
+    day, last_day = day_start(first[0]), day_start(last[0])
+    rebuilt = 0
+    while day <= last_day:
+        rebuilt += refresh_activity_rollups(
+            user, day, day + timedelta(days=1) - timedelta(microseconds=1)
+        )
+        day += timedelta(days=1)
+    return rebuilt
+
+
+def ensure_activity_rollups(before: datetime) -> int:
+    # Adds the missing rollups of the hours older than `before`, one refresh
+    # per user and day. Hours that already have rollups are left alone - their
+    # raw data may already be partially deleted. Returns the number of hours.
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            MISSING_ROLLUPS_SQL.format(
+                raw=qn(ActivityRaw._meta.db_table),
+                hourly=qn(ActivityHourly._meta.db_table),
+            ),
+            [before],
+        )
+        missing = cursor.fetchall()
+    users = APIUser.objects.in_bulk({user_id for user_id, _, _, _ in missing})
+    for user_id, first, last, _ in missing:
+        refresh_activity_rollups(users[user_id], first, last, overwrite=False)
+    return sum(hours for _, _, _, hours in missing)
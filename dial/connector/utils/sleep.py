@@ -2,11 +2,20 @@ import os
 from datetime import datetime
 import logging
 
-from django.db import IntegrityError
+import pytz
+from django.db import transaction
 from django.utils.timezone import make_aware
 
-from connector.utils.common import send_data_request, prepare_date_pairs
-from connector.models import SleepSummary, SleepRaw, APIUser
+from connector.utils.common import (
+    iterate_pages,
+    prepare_date_pairs,
+    resolve_date_range,
+)
+from connector.utils.db import BulkWriter
+from connector.utils.fetch_engine import FetchEngine
+from connector.utils.sync import advance_sync_cursor
+from connector.utils.windows import WindowPlanner
+from connector.models import SleepSummary, SleepRaw, SleepSignal, APIUser
 
 DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S%z"
 DATETIME_FORMAT_SLEEP = "%Y-%m-%d"
@@ -32,83 +41,150 @@ SLEEP_DATA_FIELDS = [
 SLEEP_DATA_FIELDS_RAW = ["hr", "rr", "snoring"]
 SLEEP_PHASES = {0: "AWAKE", 1: "LIGHT", 2: "DEEP", 3: "REM"}
 DEVICE_TYPES = {16: "TRACKER", 32: "SLEEP_MONITOR"}
+SLEEP_KEY_FIELDS = ("user", "device_id", "start_date")
+SLEEP_SIGNAL_KEY_FIELDS = ("user", "device_id", "signal", "ts")
 LOGGER = logging.getLogger(__name__)
 WITHINGS_API_URL = os.environ.get("WITHINGS_API_URL", "https://wbsapi.withings.net/v2")
 
 
+def split_series(series: dict) -> (list, list):
+    # {"<epoch seconds>": value, ...} -> sorted timestamps and matching values
+    points = sorted((int(timestamp), value) for timestamp, value in series.items())
+    return [timestamp for timestamp, _ in points], [value for _, value in points]
+
+
+def build_sleep_raw(entry: dict, user: APIUser) -> SleepRaw:
+    sleep_phase_id = entry.get("state")
+    hr_timestamps, hr_values = split_series(entry.get("hr", {}))
+    rr_timestamps, rr_values = split_series(entry.get("rr", {}))
+    snoring_timestamps, snoring_values = split_series(entry.get("snoring", {}))
+    return SleepRaw(
+        device_type=entry.get("model"),
+        device_id=entry.get("model_id"),
+        user=user,
+        start_date=make_aware(datetime.fromtimestamp(entry.get("startdate"))),
+        end_date=make_aware(datetime.fromtimestamp(entry.get("enddate"))),
+        sleep_phase=SLEEP_PHASES[sleep_phase_id],
+        sleep_phase_id=sleep_phase_id,
+        hr_timestamps=hr_timestamps,
+        hr_values=hr_values,
+        rr_timestamps=rr_timestamps,
+        rr_values=rr_values,
+        snoring_timestamps=snoring_timestamps,
+        snoring_values=snoring_values,
+    )
+
+
+def build_sleep_signals(sleep_raw: SleepRaw) -> list:
+    signals = []
+    for signal in SLEEP_DATA_FIELDS_RAW:
+        for timestamp, value in zip(
+            getattr(sleep_raw, f"{signal}_timestamps"),
+            getattr(sleep_raw, f"{signal}_values"),
+        ):
+            if value is None:
+                continue
+            signals.append(
+                SleepSignal(
+                    user=sleep_raw.user,
+                    device_type=sleep_raw.device_type,
+                    device_id=sleep_raw.device_id,
+                    ts=datetime.fromtimestamp(timestamp, pytz.utc),
+                    signal=signal,
+                    value=value,
+                )
+            )
+    return signals
+
+
 def get_sleep_data_raw(
     access_token: str,
     user_id: int,
     start_date: datetime,
     end_date: datetime,
     from_notification: bool = False,
+    rate_reserve: float = 0.0,
 ) -> int:
 
-    date_pairs = prepare_date_pairs(SleepRaw, start_date, end_date, from_notification)
     user = APIUser.objects.get(user_id=user_id)
     # TODO: raise an error if user not found
+    date_pairs = prepare_date_pairs(
+        SleepRaw, user, "get", start_date, end_date, from_notification
+    )
 
     counter = 0
-    for sub_start_date, sub_end_date in date_pairs:
-        req_params = {
+    windows = [
+        {
             "action": "get",
             "startdate": int(sub_start_date.timestamp()),
             "enddate": int(sub_end_date.timestamp()),
             "data_fields": ",".join(SLEEP_DATA_FIELDS_RAW),
         }
-
-        data = send_data_request(
-            os.path.join(WITHINGS_API_URL, "sleep"), req_params, access_token
+        for sub_start_date, sub_end_date in date_pairs
+    ]
+    engine = FetchEngine(
+        os.path.join(WITHINGS_API_URL, "sleep"),
+        access_token,
+        rate_reserve=rate_reserve,
+    )
+    for window, pages in engine.fetch_windows(windows):
+        for data in pages:
+            sleep_raws = []
+            for entry in data["series"]:
+                LOGGER.debug(entry)
+                sleep_raws.append(build_sleep_raw(entry, user))
+            with transaction.atomic():
+                with BulkWriter(
+                    SleepRaw, SLEEP_KEY_FIELDS, time_field="start_date"
+                ) as writer:
+                    for new_sleep_raw in sleep_raws:
+                        writer.add(new_sleep_raw)
+                # the same points, one row each, for the per-signal dashboard panels
+                with BulkWriter(
+                    SleepSignal, SLEEP_SIGNAL_KEY_FIELDS, time_field="ts"
+                ) as signal_writer:
+                    for new_sleep_raw in sleep_raws:
+                        for new_sleep_signal in build_sleep_signals(new_sleep_raw):
+                            signal_writer.add(new_sleep_signal)
+            counter += writer.written
+        advance_sync_cursor(
+            user,
+            SleepRaw,
+            "get",
+            datetime.fromtimestamp(window["startdate"], pytz.utc),
+            datetime.fromtimestamp(window["enddate"], pytz.utc),
         )
-
-        for entry in data["series"]:
-            LOGGER.debug(entry)
-            start_date_entry = make_aware(
-                datetime.fromtimestamp(entry.get("startdate"))
-            )
-            end_date_entry = make_aware(datetime.fromtimestamp(entry.get("enddate")))
-            potential_entry = SleepRaw.objects.filter(
-                start_date=start_date_entry, end_date=end_date_entry
-            )
-            sleep_phase_id = entry.get("state")
-            if len(potential_entry) == 0:
-                new_sleep_raw = SleepRaw(
-                    device_type=entry.get("model"),
-                    device_id=entry.get("model_id"),
-                    user=user,
-                    start_date=start_date_entry,
-                    end_date=end_date_entry,
-                    sleep_phase=SLEEP_PHASES[sleep_phase_id],
-                    sleep_phase_id=sleep_phase_id,
-                    hr_series=[
-                        prepare_timepoint_dict(x, y) for x, y in entry.get("hr").items()
-                    ]
-                    if "hr" in entry
-                    else [],
-                    rr_series=[
-                        prepare_timepoint_dict(x, y) for x, y in entry.get("rr").items()
-                    ]
-                    if "rr" in entry
-                    else [],
-                    snoring_series=[
-                        prepare_timepoint_dict(x, y)
-                        for x, y in entry.get("snoring").items()
-                    ]
-                    if "snoring" in entry
-                    else [],
-                )
-                new_sleep_raw.save()
-                counter += 1
     return counter
 
 
-def prepare_timepoint_dict(timestamp, value):
-    return {
-        "timestamp": make_aware(datetime.fromtimestamp(int(timestamp))).strftime(
-            DATETIME_FORMAT
+def build_sleep_summary(entry: dict, user: APIUser) -> SleepSummary:
+    entry_data = entry.get("data")
+    return SleepSummary(
+        start_date=make_aware(datetime.fromtimestamp(entry.get("startdate"))),
+        end_date=make_aware(datetime.fromtimestamp(entry.get("enddate"))),
+        user=user,
+        device_type=DEVICE_TYPES[entry.get("model")],
+        device_id=entry.get("model_id", 0),
+        breathing_disturbances_intensity=entry_data.get(
+            "breathing_disturbances_intensity", 0
         ),
-        "value": value,
-    }
+        deep_sleep_duration=entry_data.get("deepsleepduration"),
+        duration_to_sleep=entry_data.get("durationtosleep", 0),
+        duration_to_wakeup=entry_data.get("durationtowakeup", 0),
+        hr_average=entry_data.get("hr_average"),
+        hr_max=entry_data.get("hr_max"),
+        hr_min=entry_data.get("hr_min"),
+        light_sleep_duration=entry_data.get("lightsleepduration"),
+        rem_sleep_duration=entry_data.get("remsleepduration"),
+        rr_average=entry_data.get("rr_average"),
+        rr_max=entry_data.get("rr_max"),
+        rr_min=entry_data.get("rr_min"),
+        sleep_score=entry_data.get("sleep_score"),
+        snoring=entry_data.get("snoring", 0),
+        snoring_episode_count=entry_data.get("snoringepisodecount", 0),
+        wakeup_count=entry_data.get("wakeupcount", 0),
+        wakeup_duration=entry_data.get("wakeupduration", 0),
+    )
 
 
 def get_sleep_data_summary(
@@ -117,16 +193,19 @@ def get_sleep_data_summary(
     start_date: datetime,
     end_date: datetime,
     from_notification: bool = False,
+    rate_reserve: float = 0.0,
 ) -> int:
 
-    date_pairs = prepare_date_pairs(
-        SleepSummary, start_date, end_date, from_notification
-    )
     user = APIUser.objects.get(user_id=user_id)
     # TODO: raise an error if user not found
+    start_date, end_date = resolve_date_range(
+        SleepSummary, user, "getsummary", start_date, end_date, from_notification
+    )
+    planner = WindowPlanner("getsummary", start_date, end_date)
+    LOGGER.info("Planned %s sleep summary request(s).", planner.planned_calls)
 
     counter = 0
-    for sub_start_date, sub_end_date in date_pairs:
+    for sub_start_date, sub_end_date in planner:
         req_params = {
             "action": "getsummary",
             "startdateymd": sub_start_date.strftime(DATETIME_FORMAT_SLEEP),
@@ -134,62 +213,36 @@ def get_sleep_data_summary(
             "data_fields": ",".join(SLEEP_DATA_FIELDS),
         }
 
-        data = send_data_request(
-            os.path.join(WITHINGS_API_URL, "sleep"), req_params, access_token
-        )
-
-        for entry in data["series"]:
-            LOGGER.debug(entry)
-            entry_date = datetime.strptime(entry["date"], DATETIME_FORMAT_SLEEP)
-            measurement_time = make_aware(entry_date)
-            start_date_entry = make_aware(
-                datetime.fromtimestamp(entry.get("startdate"))
-            )
-            end_date_entry = make_aware(datetime.fromtimestamp(entry.get("enddate")))
-            potential_entry = SleepSummary.objects.filter(
-                start_date=start_date_entry, end_date=end_date_entry
-            )
-            if len(potential_entry) == 0:
+        for data in iterate_pages(
+            os.path.join(WITHINGS_API_URL, "sleep"),
+            req_params,
+            access_token,
+            rate_reserve,
+        ):
+            planner.feedback(len(data["series"]), data.get("more", False))
+            sleep_summaries = []
+            for entry in data["series"]:
+                LOGGER.debug(entry)
                 try:
-                    entry_data = entry.get("data")
-                    new_sleep_summary = SleepSummary(
-                        start_date=start_date_entry,
-                        end_date=end_date_entry,
-                        user=user,
-                        device_type=DEVICE_TYPES[entry.get("model")],
-                        device_id=entry.get("model_id", 0),
-                        breathing_disturbances_intensity=entry_data.get(
-                            "breathing_disturbances_intensity", 0
-                        ),
-                        deep_sleep_duration=entry_data.get("deepsleepduration"),
-                        duration_to_sleep=entry_data.get("durationtosleep", 0),
-                        duration_to_wakeup=entry_data.get("durationtowakeup", 0),
-                        hr_average=entry_data.get("hr_average"),
-                        hr_max=entry_data.get("hr_max"),
-                        hr_min=entry_data.get("hr_min"),
-                        light_sleep_duration=entry_data.get("lightsleepduration"),
-                        rem_sleep_duration=entry_data.get("remsleepduration"),
-                        rr_average=entry_data.get("rr_average"),
-                        rr_max=entry_data.get("rr_max"),
-                        rr_min=entry_data.get("rr_min"),
-                        sleep_score=entry_data.get("sleep_score"),
-                        snoring=entry_data.get("snoring", 0),
-                        snoring_episode_count=entry_data.get("snoringepisodecount", 0),
-                        wakeup_count=entry_data.get("wakeupcount", 0),
-                        wakeup_duration=entry_data.get("wakeupduration", 0),
-                    )
-                    new_sleep_summary.save()
-                    counter += 1
-                except IntegrityError as e:
-                    LOGGER.error("An error occurred when writing to the DB: %s.", e)
+                    sleep_summaries.append(build_sleep_summary(entry, user))
                 except KeyError as e:
                     LOGGER.error(
-                        "An error occurred when writing to the DB: %s. Data contents: %s. Datetime: %s",
+                        "An error occurred when writing to the DB: %s. Data contents: %s. Date: %s",
                         e,
                         entry,
-                        measurement_time,
+                        entry.get("date"),
                     )
                     raise e
+            with transaction.atomic(), BulkWriter(
+                SleepSummary, SLEEP_KEY_FIELDS, time_field="start_date"
+            ) as writer:
+                for new_sleep_summary in sleep_summaries:
+                    writer.add(new_sleep_summary)
+            counter += writer.written
+        advance_sync_cursor(
+            user, SleepSummary, "getsummary", sub_start_date, sub_end_date
+        )
+    LOGGER.debug("Made %s sleep summary request(s).", planner.calls)
     return counter
 
 
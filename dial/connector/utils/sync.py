@@ -0,0 +1,67 @@
+import logging
+from datetime import datetime
+
+import pytz
+from django.db import connection
+
+from connector.models import APIUser, SyncCursor
+
+LOGGER = logging.getLogger(__name__)
+
+# The cursor only moves forward, and only over windows that start at or before
+# it - a window fetched past a gap (e.g. a manual request for a later range)
+# must not make the gap look synced.
+ADVANCE_SQL = """
+INSERT INTO {cursor} AS c (user_id, data_type, endpoint, synced_until, updated_at)
+VALUES (%s, %s, %s, %s, now())
+ON CONFLICT (user_id, data_type, endpoint) DO UPDATE SET
+    synced_until = EXCLUDED.synced_until,
+    updated_at = EXCLUDED.updated_at
+WHERE c.synced_until >= %s AND c.synced_until < EXCLUDED.synced_until
+"""
+
+
+def _data_type(db_model) -> str:
+    return db_model._meta.model_name
+
+
+def get_sync_cursor(user: APIUser, db_model, endpoint: str):
+    # the time up to which the data of `db_model` was fetched from `endpoint`,
+    # or None if it never was
+    return (
+        SyncCursor.objects.filter(
+            user=user, data_type=_data_type(db_model), endpoint=endpoint
+        )
+        .values_list("synced_until", flat=True)
+        .first()
+    )
+
+
+def advance_sync_cursor(
+    user: APIUser,
+    db_model,
+    endpoint: str,
+    window_start: datetime,
+    window_end: datetime,
+) -> bool:
+    # Records that the window was fetched and stored. A single statement, so
+    # concurrent fetches of the same user cannot move the cursor backwards.
+    # Windows reaching into the future only count up to now.
+    synced_until = min(window_end, datetime.now(pytz.utc))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            ADVANCE_SQL.format(
+                cursor=connection.ops.quote_name(SyncCursor._meta.db_table)
+            ),
+            [user.pk, _data_type(db_model), endpoint, synced_until, window_start],
+        )
+        advanced = cursor.rowcount > 0
+    if advanced:
+        LOGGER.debug(
+            "Sync cursor of %s for %s/%s advanced to %s.",
+            user,
+            _data_type(db_model),
+            endpoint,
+            synced_until,
+        )
+    return advanced
@@ -0,0 +1,81 @@
+import logging
+import os
+from collections import deque
+from datetime import datetime
+
+from django.db.models import F, FloatField, ExpressionWrapper
+from django.db.models.functions import NullIf
+
+from connector.models import APIUser, Weight, WeightTrend
+from connector.utils.db import BulkWriter
+
+LOGGER = logging.getLogger(__name__)
+# number of samples the EWMA is (roughly) averaged over
+WEIGHT_TREND_EWMA_SPAN = int(os.environ.get("WEIGHT_TREND_EWMA_SPAN", 10))
+WEIGHT_TREND_KEY_FIELDS = ("user", "metric", "measured_at")
+TREND_WINDOWS = (7, 14)
+TREND_METRICS = {
+    "weight": F("weight"),
+    "fat_mass_weight": F("fat_mass_weight"),
+    "muscle_mass": F("muscle_mass"),
+    "fat_ratio": F("fat_ratio"),
+    "hydration": F("hydration"),
+    "muscle_fat_ratio": F("muscle_mass") / NullIf(F("fat_mass_weight"), 0.0),
+    "muscle_ratio": 100 * F("muscle_mass") / NullIf(F("weight"), 0.0),
+}
+
+
+def _samples(user: APIUser, metric: str):
+    value = ExpressionWrapper(TREND_METRICS[metric], output_field=FloatField())
+    return (
+        Weight.objects.filter(user=user)
+        .annotate(value=value)
+        .filter(value__isnull=False)
+        .values_list("measured_at", "value")
+    )
+
+
+def update_weight_trends(user: APIUser, since: datetime = None) -> int:
+    # Computes the trends of every sample measured at `since` or later (all of
+    # them by default). Only the last samples before `since` and the last EWMA
+    # are read from the history, so this stays cheap for new measurements.
+    alpha = 2 / (WEIGHT_TREND_EWMA_SPAN + 1)
+    with BulkWriter(WeightTrend, WEIGHT_TREND_KEY_FIELDS) as writer:
+        for metric in TREND_METRICS:
+            samples = _samples(user, metric)
+            previous_values, ewma = [], None
+            if since is not None:
+                previous = samples.filter(measured_at__lt=since).order_by(
+                    "-measured_at"
+                )[: max(TREND_WINDOWS) - 1]
+                previous_values = [value for _, value in reversed(previous)]
+                last_trend = (
+                    WeightTrend.objects.filter(
+                        user=user, metric=metric, measured_at__lt=since
+                    )
+                    .order_by("-measured_at")
+                    .first()
+                )
+                ewma = last_trend.ewma if last_trend is not None else None
+                samples = samples.filter(measured_at__gte=since)
+
+            window = deque(previous_values, maxlen=max(TREND_WINDOWS))
+            for measured_at, value in samples.order_by("measured_at"):
+                window.append(value)
+                ewma = value if ewma is None else alpha * value + (1 - alpha) * ewma
+                averages = {
+                    f"avg_{size}": sum(list(window)[-size:]) / min(size, len(window))
+                    for size in TREND_WINDOWS
+                }
+                writer.add(
+                    WeightTrend(
+                        user=user,
+                        metric=metric,
+                        measured_at=measured_at,
+                        value=value,
+                        ewma=ewma,
+                        **averages,
+                    )
+                )
+    LOGGER.debug("Updated %s weight trend(s) of %s.", writer.written, user)
+    return writer.written
@@ -0,0 +1,57 @@
+import logging
+import math
+import os
+from datetime import datetime, timedelta
+
+LOGGER = logging.getLogger(__name__)
+
+# the *ymd and getmeas actions accept arbitrary ranges (paginated with offset);
+# the intraday/raw actions are limited by Withings to 24h per call
+MAX_WINDOW_DAYS = {
+    "getactivity": int(os.environ.get("WITHINGS_MAX_WINDOW_DAYS_ACTIVITY", 31)),
+    "getsummary": int(os.environ.get("WITHINGS_MAX_WINDOW_DAYS_SLEEP", 31)),
+    "getmeas": int(os.environ.get("WITHINGS_MAX_WINDOW_DAYS_MEASUREMENTS", 31)),
+    "getintradayactivity": 1,
+    "get": 1,
+}
+DENSE_RESPONSE_ENTRIES = int(os.environ.get("WITHINGS_DENSE_RESPONSE_ENTRIES", 200))
+MIN_WINDOW = timedelta(days=1)
+
+
+class WindowPlanner:
+    def __init__(self, action: str, start_date: datetime, end_date: datetime):
+        self.action = action
+        self.span = timedelta(days=MAX_WINDOW_DAYS.get(action, 1))
+        if end_date - start_date < MIN_WINDOW:
+            end_date = start_date + MIN_WINDOW
+        self.start_date = start_date
+        self.end_date = end_date
+        self.calls = 0
+        self._cursor = start_date
+
+    @property
+    def planned_calls(self) -> int:
+        # calls already made plus the ones needed to cover the rest of the range
+        remaining = max(self.end_date - self._cursor, timedelta(0))
+        return self.calls + math.ceil(remaining / self.span)
+
+    def __iter__(self):
+        while self._cursor < self.end_date:
+            window_end = min(self._cursor + self.span, self.end_date)
+            yield self._cursor, window_end
+            self.calls += 1
+            self._cursor = window_end
+
+    def feedback(self, entries: int, more: bool = False):
+        # a paginated or crowded response means the window is too wide for this
+        # user's data - halve it for the remaining part of the range
+        if not (more or entries >= DENSE_RESPONSE_ENTRIES) or self.span <= MIN_WINDOW:
+            return
+        self.span = max(self.span / 2, MIN_WINDOW)
+        LOGGER.debug(
+            "Dense response for %s (%s entries, more=%s) - window reduced to %s.",
+            self.action,
+            entries,
+            more,
+            self.span,
+        )
@@ -23,7 +23,12 @@ from .utils.authentication import (
     CALLBACK_URL,
 )
 from .utils.common import extract_and_parse_dates
-from .utils.notifications import fetch_all_notifications, subscribe_to_notifications
+from .utils.notifications import (
+    NOTIFICATION_DEBOUNCE_SECONDS,
+    debounce_notification,
+    fetch_all_notifications,
+    subscribe_to_notifications,
+)
 
 LOGGER = logging.getLogger(__name__)
 HASS_CALLBACK_URL = os.environ.get("HASS_CALLBACK_URL")
@@ -34,6 +39,18 @@ else:
     DISABLED_APPLIS = [DISABLED_APPLIS]
 
 
+def enqueue_notification_task(task, json_body: dict):
+    # bursts of notifications for the same user and appli are merged into the
+    # task enqueued for the first of them
+    if debounce_notification(json_body):
+        task.apply_async((json_body,), countdown=NOTIFICATION_DEBOUNCE_SECONDS)
+    else:
+        LOGGER.info(
+            "Merged the notification for appli %s into a pending one.",
+            json_body["appli"],
+        )
+
+
 @csrf_exempt
 def index(request):
     if request.method == "GET":
@@ -96,15 +113,15 @@ def index(request):
 
         if appli and int(appli) == 44:
             LOGGER.info("Received POST request for appli %s.", appli)
-            celery_appli_44_sleep.delay(json_body)
+            enqueue_notification_task(celery_appli_44_sleep, json_body)
             return HttpResponse("OK")
         elif appli and int(appli) == 1:
             LOGGER.info("Received POST request for appli %s.", appli)
-            celery_appli_1_measurements.delay(json_body)
+            enqueue_notification_task(celery_appli_1_measurements, json_body)
             return HttpResponse("OK")
         elif appli and int(appli) == 16:
             LOGGER.info("Received POST request for appli %s.", appli)
-            celery_appli_16_activities.delay(json_body)
+            enqueue_notification_task(celery_appli_16_activities, json_body)
             return HttpResponse("OK")
         else:
             return HttpResponse("Unsupported appli.")
@@ -158,6 +175,8 @@ def check_activity(request):
     # extract query params
     start_date, end_date = extract_and_parse_dates(request)
     user_id = request.GET.get("user_id")
+    # large backfills can be written with COPY instead of batched INSERTs
+    use_copy = request.GET.get("copy", "false").lower() == "true"
 
     # fetch a valid token
     LOGGER.info("Fetching valid token for user: %s", user_id)
@@ -165,6 +184,6 @@ def check_activity(request):
 
     # make data request
     celery_request_all_activity_data.delay(
-        access_token_data, user_id, start_date, end_date
+        access_token_data, user_id, start_date, end_date, use_copy
     )
     return HttpResponse("OK")
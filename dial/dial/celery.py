@@ -21,6 +21,7 @@ app.conf.update(
     task_queues=cset.task_queues,
     task_default_queue=cset.task_default_queue,
     task_serializer=cset.task_serializer,
+    beat_schedule=cset.beat_schedule,
 )
 
 # Load task modules from all registered Django app configs.
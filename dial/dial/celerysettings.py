@@ -1,5 +1,6 @@
 import os
 
+from celery.schedules import crontab
 from kombu import Queue, Exchange
 
 broker_url = os.environ.get("CELERY_BROKER")
@@ -30,3 +31,31 @@ task_queues = (
 result_serializer = "json"
 timezone = "UTC"
 imports = ("connector.tasks",)
+
+# periodic tasks, picked up by `celery beat` (django-celery-beat's scheduler
+# stores them in the DB so they can also be adjusted in the admin)
+beat_schedule = {
+    "create-partitions": {
+        "task": "maintain_partitions",
+        "schedule": crontab(hour=3, minute=0),
+        "options": {"queue": "default"},
+    },
+    # before the retention, which would otherwise delete the raw rows first
+    "compact-activities": {
+        "task": "compact_activities",
+        "schedule": crontab(hour=3, minute=15),
+        "options": {"queue": "default"},
+    },
+    "enforce-retention": {
+        "task": "enforce_retention",
+        "schedule": crontab(hour=3, minute=30),
+        "options": {"queue": "default"},
+    },
+    # picks up the fetch jobs and backfills interrupted by a crash or a deploy,
+    # and the notifications whose fetch failed or was lost
+    "resume-fetch-jobs": {
+        "task": "resume_fetch_jobs",
+        "schedule": crontab(minute="*/5"),
+        "options": {"queue": "default"},
+    },
+}